@@ -0,0 +1,101 @@
+"""
+动态批量调度的压测，用 DummyBatchBackend 对比不同 max_batch_size / max_wait 下的吞吐和延迟
+
+    python -m benchmark.batching_bench --requests 2000 --concurrency 64
+
+max_batch_size=1 等价于不做批量，作为对照组
+"""
+import argparse
+import asyncio
+import hashlib
+import sys
+import time
+
+from benchmark.common import add_result_arguments, finish
+from src.ai_picture.batching import BatchBackend, BatchScheduler
+from src.utils.metrics import Histogram
+
+
+class DummyBatchBackend(BatchBackend):
+    """
+    @summary: 纯 CPU 的模拟后端，每批固定开销 batch_overhead 秒 + 每条 item_cost 秒的哈希计算，用于本地压测批量化收益
+    """
+
+    def __init__(self, batch_overhead=0.02, item_cost=0.002):
+        self.batch_overhead = batch_overhead
+        self.item_cost = item_cost
+
+    @staticmethod
+    def _burn(seconds):
+        deadline = time.perf_counter() + seconds
+        digest = b''
+        while time.perf_counter() < deadline:
+            digest = hashlib.sha256(digest).digest()
+        return digest
+
+    def predict_batch(self, questions):
+        self._burn(self.batch_overhead + self.item_cost * len(questions))
+        return list(questions)
+
+
+async def bench_scheduler(scheduler, requests, concurrency):
+    latency = Histogram()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(index):
+        async with semaphore:
+            start = time.perf_counter()
+            await scheduler.submit(f'question-{index}')
+            latency.observe(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(requests)))
+    elapsed = time.perf_counter() - start
+    latency_snapshot = latency.snapshot()
+    batch_snapshot = scheduler.batch_size_histogram.snapshot()
+    return dict(
+        requests_per_sec=requests / elapsed,
+        latency_p50_ms=latency_snapshot['p50'] * 1000,
+        latency_p99_ms=latency_snapshot['p99'] * 1000,
+        mean_batch_size=batch_snapshot['sum'] / max(batch_snapshot['count'], 1),
+    )
+
+
+def run(requests=2000, concurrency=64, batch_sizes=(1, 4, 16, 64), max_wait_ms=(1, 5), batch_overhead=0.02,
+        item_cost=0.002):
+    results = {}
+    for max_batch_size in batch_sizes:
+        for wait_ms in (max_wait_ms if max_batch_size > 1 else (0,)):
+            scheduler = BatchScheduler(
+                DummyBatchBackend(batch_overhead=batch_overhead, item_cost=item_cost),
+                max_batch_size=max_batch_size, max_wait=wait_ms / 1000,
+            )
+            results[f'batch={max_batch_size},wait={wait_ms}ms'] = asyncio.run(
+                bench_scheduler(scheduler, requests, concurrency))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--max-wait-ms', type=float, nargs='+', default=[1, 5])
+    parser.add_argument('--batch-overhead', type=float, default=0.02, help='每批固定开销，秒')
+    parser.add_argument('--item-cost', type=float, default=0.002, help='每条计算开销，秒')
+    add_result_arguments(parser)
+    args = parser.parse_args()
+
+    results = run(
+        requests=args.requests, concurrency=args.concurrency, batch_sizes=args.batch_sizes,
+        max_wait_ms=args.max_wait_ms, batch_overhead=args.batch_overhead, item_cost=args.item_cost,
+    )
+    print(f'{"variant":<24}{"req/s":>10}{"p50_ms":>10}{"p99_ms":>10}{"batch":>8}')
+    for name, result in results.items():
+        print(f'{name:<24}{result["requests_per_sec"]:>10.1f}{result["latency_p50_ms"]:>10.2f}'
+              f'{result["latency_p99_ms"]:>10.2f}{result["mean_batch_size"]:>8.1f}')
+    return finish(args, 'batching', results)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""
+CacheBase.get / save / delete 的 micro-benchmark，用内存字典模拟 redis，每次往返注入 --latency 秒的延迟
+
+    python -m benchmark.cache_bench --operations 20000 --concurrency 1 64 --latency 0.0005
+
+用例：get_l1_hit（L1 命中）、get_redis_hit（关闭 L1，redis 命中）、get_miss（全部未命中）、save、delete，
+以及开启 RedisBatchLoader 的 get_redis_hit_batched、save_batched；round_trips_per_op 为平均每次调用的 redis 往返数
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+
+from item_store.structure.proto_structure.all import ItemDoc
+
+from benchmark.common import add_result_arguments, finish, latency_summary
+from src.cache import CacheBase
+from src.cache.memory import build_memory_cache
+from src.cache.redis_batch import RedisBatchLoader
+
+
+class NullMemoryCache(object):
+    """
+    @summary: 不缓存任何内容的 L1，用于测量纯 redis 路径
+    """
+
+    def get_many_items(self, items):
+        return []
+
+    def set_many_items(self, items):
+        pass
+
+    def add_many_items(self, items):
+        pass
+
+    def delete_many_items(self, items):
+        pass
+
+
+class FakeRedisCache(CacheBase):
+    """
+    @summary: 用字典代替 redis 的 CacheBase，每次 mget / mset / delete 视为一次往返；batching 时与 RedisCache 一样经过
+    RedisBatchLoader 合并
+    """
+    refresh_ttl_on_hit = False
+    invalidation_enabled = True  # delete 不 sleep(delete_delay)
+
+    def __init__(self, latency=0.0, l1=True, batching=False, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.cache_memory = build_memory_cache(l1_backend='memory', l1_maxsize=1000000) if l1 else NullMemoryCache()
+        self.store = {}
+        self.round_trips = 0
+        self.batch_loader = RedisBatchLoader(self.mget_keys, self.mset_keys, max_wait=0) if batching else None
+
+    async def _round_trip(self):
+        self.round_trips += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def mget_keys(self, cache_keys):
+        await self._round_trip()
+        return [self.store.get(cache_key) for cache_key in cache_keys]
+
+    async def mset_keys(self, cache_items):
+        await self._round_trip()
+        self.store.update(cache_items)
+        return True
+
+    async def save_cache(self, items, only_update_ttl=False):
+        if only_update_ttl:
+            await self._round_trip()
+            return True
+        cache_items = {self.get_cache_key(item=item): self.encode_item(item=item) for item in items}
+        if self.batch_loader is not None:
+            return await self.batch_loader.mset(cache_items)
+        return await self.mset_keys(cache_items)
+
+    async def delete_cache(self, items):
+        await self._round_trip()
+        for item in items:
+            self.store.pop(self.get_cache_key(item=item), None)
+        return True
+
+    async def get_cache(self, items):
+        cache_keys = [self.get_cache_key(item=item) for item in items]
+        if self.batch_loader is not None:
+            values = await self.batch_loader.mget(cache_keys)
+        else:
+            values = await self.mget_keys(cache_keys)
+        return [self.decode_item(value) for value in values if value is not None]
+
+
+def gen_items(count, prefix='bench'):
+    return [ItemDoc(item_type=prefix, item_id=f'{i:08d}') for i in range(count)]
+
+
+async def bench_case(cache, func, batches, concurrency):
+    latencies = []
+    round_trips = cache.round_trips
+    queue = list(batches)
+
+    async def worker():
+        while queue:
+            batch = queue.pop()
+            start = time.perf_counter()
+            await func(batch)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return dict(
+        ops_per_sec=len(latencies) / elapsed,
+        round_trips_per_op=(cache.round_trips - round_trips) / len(latencies),
+        **latency_summary(latencies, unit='us'),
+    )
+
+
+async def run_cases(operations, concurrency, batch_size, keys, latency):
+    items = gen_items(keys)
+    missing_items = gen_items(keys, prefix='missing')
+
+    def batches(source):
+        return [random.sample(source, batch_size) for _ in range(operations)]
+
+    results = {}
+    l1_cache = FakeRedisCache(latency=latency)
+    await l1_cache.save(items)
+    await asyncio.sleep(0)  # save 异步写入 L1
+    redis_cache = FakeRedisCache(latency=latency, l1=False)
+    await redis_cache.save(items)
+    batched_cache = FakeRedisCache(latency=latency, l1=False, batching=True)
+    await batched_cache.save(items)
+    delete_cache = FakeRedisCache(latency=latency)
+    cases = {
+        'get_l1_hit': (l1_cache, l1_cache.get, batches(items)),
+        'get_redis_hit': (redis_cache, redis_cache.get, batches(items)),
+        'get_redis_hit_batched': (batched_cache, batched_cache.get, batches(items)),
+        'get_miss': (redis_cache, redis_cache.get, batches(missing_items)),
+        'save': (redis_cache, redis_cache.save, batches(items)),
+        'save_batched': (batched_cache, batched_cache.save, batches(items)),
+        'delete': (delete_cache, delete_cache.delete, batches(items)),
+    }
+    for name, (cache, func, case_batches) in cases.items():
+        results[f'{name},c={concurrency}'] = await bench_case(cache, func, case_batches, concurrency)
+    return results
+
+
+def run(operations=20000, concurrency=(1, 64), batch_size=10, keys=10000, latency=0.0005):
+    results = {}
+    for level in concurrency:
+        results.update(asyncio.run(run_cases(operations, level, batch_size, keys, latency)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--operations', type=int, default=20000, help='每个用例的调用次数')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 64])
+    parser.add_argument('--batch-size', type=int, default=10, help='每次调用的 item 数')
+    parser.add_argument('--keys', type=int, default=10000)
+    parser.add_argument('--latency', type=float, default=0.0005, help='模拟的 redis 往返延迟，秒')
+    add_result_arguments(parser)
+    args = parser.parse_args()
+
+    results = run(
+        operations=args.operations, concurrency=args.concurrency, batch_size=args.batch_size, keys=args.keys,
+        latency=args.latency,
+    )
+    print(f'{"case":<32}{"ops/s":>12}{"trips/op":>10}{"p50_us":>10}{"p99_us":>10}{"p999_us":>10}')
+    for name, result in results.items():
+        print(f'{name:<32}{result["ops_per_sec"]:>12.1f}{result["round_trips_per_op"]:>10.3f}{result["p50_us"]:>10.1f}'
+              f'{result["p99_us"]:>10.1f}{result["p999_us"]:>10.1f}')
+    return finish(args, 'cache', results)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""
+缓存值编码的 micro-benchmark，对比各 codec / 压缩算法的编解码耗时和每个 item 的字节数
+
+    python -m benchmark.codec_bench --sample items.txt --repeat 20
+
+--sample 为每行一个 base64 编码的 redis 缓存值（旧格式，由 CacheBase.load_item 解析），不传时生成合成数据
+"""
+import argparse
+import base64
+import sys
+import time
+
+from item_store.structure.proto_structure.all import ItemDoc
+
+from benchmark.common import add_result_arguments, finish
+from src.cache import CacheBase
+from src.cache.codec import ItemCodec, lz4_frame, msgpack, zstandard
+
+
+def load_sample_items(path):
+    cache = CacheBase()
+    with open(path) as f:
+        return [cache.load_item(base64.b64decode(line.strip())) for line in f if line.strip()]
+
+
+def gen_sample_items(count):
+    return [ItemDoc(item_type='bench', item_id=f'{i:08d}') for i in range(count)]
+
+
+def codec_variants(compress_threshold):
+    codecs = ['protobuf', 'json'] + (['msgpack'] if msgpack else [])
+    compressions = [None] + (['zstd'] if zstandard else []) + (['lz4'] if lz4_frame else [])
+    for codec in codecs:
+        for compression in compressions:
+            yield f'{codec}+{compression or "raw"}', ItemCodec(
+                codec=codec, compression=compression, compress_threshold=compress_threshold)
+
+
+def bench_codec(item_codec, items, repeat):
+    encoded = [item_codec.encode(item) for item in items]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for item in items:
+            item_codec.encode(item)
+    encode_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for data in encoded:
+            item_codec.decode(data)
+    decode_seconds = time.perf_counter() - start
+    operations = repeat * len(items)
+    return dict(
+        encode_us=encode_seconds / operations * 1e6,
+        decode_us=decode_seconds / operations * 1e6,
+        bytes_per_item=sum(len(data) for data in encoded) / len(encoded),
+    )
+
+
+def run(items, repeat=10, compress_threshold=1024):
+    return {
+        name: bench_codec(item_codec, items, repeat)
+        for name, item_codec in codec_variants(compress_threshold)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sample', help='每行一个 base64 缓存值的样本文件')
+    parser.add_argument('--count', type=int, default=1000, help='无样本文件时生成的合成 item 数')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--compress-threshold', type=int, default=1024)
+    add_result_arguments(parser)
+    args = parser.parse_args()
+
+    items = load_sample_items(args.sample) if args.sample else gen_sample_items(args.count)
+    results = run(items, repeat=args.repeat, compress_threshold=args.compress_threshold)
+    print(f'{"variant":<20}{"encode_us":>12}{"decode_us":>12}{"bytes/item":>12}')
+    for name, result in results.items():
+        print(f'{name:<20}{result["encode_us"]:>12.2f}{result["decode_us"]:>12.2f}{result["bytes_per_item"]:>12.1f}')
+    return finish(args, 'codec', results)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""
+benchmark 公共工具：延迟分位数、结果保存、与基线对比
+
+结果格式为 {case: {metric: value}}，对比时 metric 名以 _per_sec / _ratio 结尾的越大越好，
+以 _ms / _us / _seconds 结尾或以 bytes 开头的越小越好，其余只展示不对比
+"""
+import json
+import os
+import platform
+import time
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(max(int(round(q * len(sorted_values) + 0.5)) - 1, 0), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def latency_summary(latencies, unit='ms'):
+    """
+    @summary: latencies 单位为秒，返回按 unit（ms / us）换算后的 mean / p50 / p99 / p999 / max
+    """
+    scale = 1000 if unit == 'ms' else 1000000
+    values = sorted(latencies)
+    return {
+        f'mean_{unit}': sum(values) / len(values) * scale if values else 0.0,
+        f'p50_{unit}': percentile(values, 0.5) * scale,
+        f'p99_{unit}': percentile(values, 0.99) * scale,
+        f'p999_{unit}': percentile(values, 0.999) * scale,
+        f'max_{unit}': (values[-1] if values else 0.0) * scale,
+    }
+
+
+def metric_direction(metric):
+    """
+    @return 1 越大越好，-1 越小越好，0 不参与对比（max 波动太大不对比）
+    """
+    if metric.startswith('max_'):
+        return 0
+    if metric.endswith(('_per_sec', '_ratio')):
+        return 1
+    if metric.endswith(('_ms', '_us', '_seconds')) or metric.startswith('bytes'):
+        return -1
+    return 0
+
+
+def compare(results, baseline, tolerance=0.1):
+    """
+    @return 每个可对比指标的变化列表，change 为相对基线变好的比例（负数表示变差），regression 为是否超出容忍度
+    """
+    rows = []
+    for case, metrics in results.items():
+        baseline_metrics = baseline.get(case)
+        if not baseline_metrics:
+            continue
+        for metric, value in metrics.items():
+            direction = metric_direction(metric)
+            baseline_value = baseline_metrics.get(metric)
+            if not direction or not baseline_value or not isinstance(value, (int, float)):
+                continue
+            change = (value - baseline_value) / baseline_value * direction
+            rows.append(dict(
+                case=case, metric=metric, baseline=baseline_value, current=value, change=change,
+                regression=change < -tolerance,
+            ))
+    return rows
+
+
+def print_comparison(rows):
+    print(f'{"case":<32}{"metric":<18}{"baseline":>12}{"current":>12}{"change":>9}')
+    for row in rows:
+        flag = '  REGRESSION' if row['regression'] else ''
+        print(f'{row["case"]:<32}{row["metric"]:<18}{row["baseline"]:>12.2f}{row["current"]:>12.2f}'
+              f'{row["change"]:>+9.1%}{flag}')
+
+
+def load_results(path):
+    with open(path) as f:
+        document = json.load(f)
+    return document.get('results', document)
+
+
+def save_results(path, name, results):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    document = {
+        'name': name,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'results': results,
+    }
+    with open(path, 'w') as f:
+        json.dump(document, f, indent=2)
+
+
+def add_result_arguments(parser):
+    parser.add_argument('--output', help='结果保存为 json')
+    parser.add_argument('--baseline', help='基线 json，默认 benchmark/baselines/<name>.json')
+    parser.add_argument('--update-baseline', action='store_true', help='把本次结果保存为基线')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='相对基线变差超过该比例视为回退')
+
+
+def finish(args, name, results):
+    """
+    @summary: 按命令行参数保存结果、更新基线或与基线对比
+    @return 进程退出码，有指标回退时为 1
+    """
+    if args.output:
+        save_results(args.output, name, results)
+    baseline_path = args.baseline or os.path.join(BASELINE_DIR, f'{name}.json')
+    if args.update_baseline:
+        save_results(baseline_path, name, results)
+        print(f'baseline saved to {baseline_path}')
+        return 0
+    if not os.path.exists(baseline_path):
+        return 0
+    rows = compare(results, load_results(baseline_path), tolerance=args.tolerance)
+    print_comparison(rows)
+    return 1 if any(row['regression'] for row in rows) else 0
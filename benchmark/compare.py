@@ -0,0 +1,24 @@
+"""
+对比两份 benchmark 结果 json，有指标回退时退出码为 1
+
+    python -m benchmark.compare results.json benchmark/baselines/cache.json --tolerance 0.1
+"""
+import argparse
+import sys
+
+from benchmark.common import compare, load_results, print_comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('results')
+    parser.add_argument('baseline')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args()
+    rows = compare(load_results(args.results), load_results(args.baseline), tolerance=args.tolerance)
+    print_comparison(rows)
+    return 1 if any(row['regression'] for row in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""
+asyncio HTTP 压测，按固定并发数对每个目标路由持续发送请求（HTTP/1.1 keep-alive），输出吞吐和 p50/p99/p999 延迟
+
+    python -m benchmark.http_load --url http://127.0.0.1:8080 --concurrency 1 16 64 --duration 10
+
+--target 格式为 name=METHOD:path，path 中的 {rand} 替换为 [0, --keyspace) 的随机数，用于绕过响应缓存
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+from benchmark.common import add_result_arguments, finish, latency_summary
+
+DEFAULT_TARGETS = ['health=GET:/health', 'ai_picture_q=POST:/ai_picture/q?question=bench-{rand}']
+
+
+class HttpConnection(object):
+    """
+    @summary: 最小化的 HTTP/1.1 客户端连接，支持 Content-Length 和 chunked 响应，服务端关闭后自动重连
+    """
+
+    def __init__(self, host, port, timeout=10.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+    async def _read_body(self, headers):
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = []
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                if not size:
+                    await self.reader.readline()
+                    return b''.join(body)
+                body.append(await self.reader.readexactly(size))
+                await self.reader.readline()
+        return await self.reader.readexactly(int(headers.get('content-length', 0)))
+
+    async def request(self, method, path, body=b''):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(
+            f'{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\nContent-Length: {len(body)}\r\n\r\n'
+            .encode('latin-1') + body)
+        await self.writer.drain()
+        status_line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+        if not status_line:
+            raise ConnectionError('connection closed by server')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+        response_body = await asyncio.wait_for(self._read_body(headers), self.timeout)
+        if headers.get('connection', '').lower() == 'close':
+            await self.close()
+        return status, response_body
+
+
+def parse_target(target):
+    name, _, spec = target.partition('=')
+    method, _, path = spec.partition(':')
+    return name, method.upper(), path
+
+
+async def run_level(host, port, method, path, concurrency, duration, warmup, keyspace):
+    latencies = []
+    statuses = Counter()
+    errors = 0
+    loop = asyncio.get_running_loop()
+    measure_from = loop.time() + warmup
+    stop_at = measure_from + duration
+
+    async def worker():
+        nonlocal errors
+        connection = HttpConnection(host, port)
+        try:
+            while loop.time() < stop_at:
+                request_path = path.replace('{rand}', str(random.randrange(keyspace)))
+                start = time.perf_counter()
+                try:
+                    status, _ = await connection.request(method, request_path)
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+                    await connection.close()
+                    status = None
+                if loop.time() < measure_from:
+                    continue
+                if status is None:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+                statuses[status] += 1
+        finally:
+            await connection.close()
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return dict(
+        requests_per_sec=len(latencies) / duration,
+        requests=len(latencies),
+        errors=errors,
+        **{f'status_{status}': count for status, count in sorted(statuses.items())},
+        **latency_summary(latencies),
+    )
+
+
+def run(url='http://127.0.0.1:8080', targets=DEFAULT_TARGETS, concurrency=(1, 16, 64), duration=10.0, warmup=2.0,
+        keyspace=1000):
+    parts = urlsplit(url)
+    results = {}
+    for target in targets:
+        name, method, path = parse_target(target)
+        for level in concurrency:
+            results[f'{name},c={level}'] = asyncio.run(run_level(
+                parts.hostname, parts.port or 80, method, path, level, duration, warmup, keyspace))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8080')
+    parser.add_argument('--target', action='append', help='name=METHOD:path，可重复，默认 /health 和 /ai_picture/q')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16, 64])
+    parser.add_argument('--duration', type=float, default=10.0, help='每个并发级别的测量时长，秒')
+    parser.add_argument('--warmup', type=float, default=2.0, help='测量前的预热时长，秒')
+    parser.add_argument('--keyspace', type=int, default=1000)
+    add_result_arguments(parser)
+    args = parser.parse_args()
+
+    results = run(
+        url=args.url, targets=args.target or DEFAULT_TARGETS, concurrency=args.concurrency, duration=args.duration,
+        warmup=args.warmup, keyspace=args.keyspace,
+    )
+    print(f'{"case":<28}{"req/s":>10}{"p50_ms":>10}{"p99_ms":>10}{"p999_ms":>10}{"errors":>8}')
+    for name, result in results.items():
+        print(f'{name:<28}{result["requests_per_sec"]:>10.1f}{result["p50_ms"]:>10.2f}{result["p99_ms"]:>10.2f}'
+              f'{result["p999_ms"]:>10.2f}{result["errors"]:>8}')
+    return finish(args, 'http', results)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""
+L1 缓存淘汰策略对比：cacheout LFU / LRU（按条目数）与 TinyLFUCache（按字节，预算为条目数 * 平均大小），
+在倾斜的 key 访问序列上比较命中率和吞吐（未命中时 set，模拟回源后写回 L1）
+
+    python -m benchmark.l1_bench --capacity 10000 --accesses 500000
+    python -m benchmark.l1_bench --trace keys.txt --capacity 10000
+
+--trace 为每行一个 item_type:item_id 的访问序列（例如从访问日志导出）；不传时生成合成序列：
+zipf 为固定热点，shifting 为热点集合每 --shift-every 次访问整体平移（老热点不再被访问），scan 为 zipf 中混入一次性扫描
+"""
+import argparse
+import bisect
+import itertools
+import random
+import sys
+import time
+
+from cacheout import LFUCache, LRUCache
+
+from benchmark.common import add_result_arguments, finish
+from item_store.core import MemoryCache
+from src.cache.tinylfu import ENTRY_OVERHEAD, TinyLFUCache
+
+
+class TraceItem(object):
+    __slots__ = ('item_type', 'item_id', 'size')
+
+    def __init__(self, item_type, item_id, size):
+        self.item_type = item_type
+        self.item_id = item_id
+        self.size = size
+
+    def ByteSize(self):
+        return self.size
+
+
+def zipf_sampler(keys, skew, rng):
+    cum_weights = list(itertools.accumulate(1.0 / (rank ** skew) for rank in range(1, keys + 1)))
+    total = cum_weights[-1]
+    return lambda: bisect.bisect_left(cum_weights, rng.random() * total)
+
+
+def gen_trace(kind, accesses, keys, skew, shift_every, seed=7):
+    rng = random.Random(seed)
+    sample = zipf_sampler(keys, skew, rng)
+    permutation = list(range(keys * 4))
+    rng.shuffle(permutation)
+    trace = []
+    for index in range(accesses):
+        rank = sample()
+        if kind == 'shifting':
+            rank += (index // shift_every) * (keys // 2)
+        elif kind == 'scan' and rng.random() < 0.2:
+            trace.append(f'scan:{index}')
+            continue
+        trace.append(f'bench:{permutation[rank % len(permutation)]}')
+    return trace
+
+
+def load_trace(path):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def build_items(trace, min_size, max_size, seed=7):
+    rng = random.Random(seed)
+    items = {}
+    for key in trace:
+        if key not in items:
+            item_type, _, item_id = key.partition(':')
+            items[key] = TraceItem(item_type, item_id, rng.randint(min_size, max_size))
+    return items
+
+
+def replay(cache, trace, items):
+    hits = 0
+    start = time.perf_counter()
+    for key in trace:
+        item = items[key]
+        if cache.get_many_items([item]):
+            hits += 1
+        else:
+            cache.set_many_items([item])
+    elapsed = time.perf_counter() - start
+    return dict(hit_ratio=hits / len(trace), ops_per_sec=len(trace) / elapsed)
+
+
+def build_caches(capacity, avg_size, ttl):
+    return {
+        'cacheout_lfu': lambda: MemoryCache(LFUCache(maxsize=capacity, ttl=ttl)),
+        'cacheout_lru': lambda: MemoryCache(LRUCache(maxsize=capacity, ttl=ttl)),
+        'tinylfu': lambda: TinyLFUCache(max_bytes=int(capacity * (avg_size + ENTRY_OVERHEAD)), ttl=ttl),
+    }
+
+
+def run(traces, capacity=10000, min_size=200, max_size=4000, ttl=3600):
+    results = {}
+    for trace_name, trace in traces.items():
+        items = build_items(trace, min_size, max_size)
+        avg_size = sum(item.size for item in items.values()) / len(items)
+        for cache_name, factory in build_caches(capacity, avg_size, ttl).items():
+            results[f'{trace_name},{cache_name}'] = replay(factory(), trace, items)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--trace', action='append', help='访问序列文件，可重复')
+    parser.add_argument('--kinds', nargs='+', default=['zipf', 'shifting', 'scan'], help='合成序列类型')
+    parser.add_argument('--accesses', type=int, default=500000)
+    parser.add_argument('--keys', type=int, default=100000, help='合成序列的 key 数')
+    parser.add_argument('--skew', type=float, default=0.9)
+    parser.add_argument('--shift-every', type=int, default=100000)
+    parser.add_argument('--capacity', type=int, default=10000, help='cacheout 的 maxsize，TinyLFU 按相同条目数折算字节')
+    parser.add_argument('--min-size', type=int, default=200, help='合成 item 的最小字节数')
+    parser.add_argument('--max-size', type=int, default=4000)
+    add_result_arguments(parser)
+    args = parser.parse_args()
+
+    if args.trace:
+        traces = {path.rsplit('/', 1)[-1]: load_trace(path) for path in args.trace}
+    else:
+        traces = {
+            kind: gen_trace(kind, args.accesses, args.keys, args.skew, args.shift_every) for kind in args.kinds
+        }
+    results = run(traces, capacity=args.capacity, min_size=args.min_size, max_size=args.max_size)
+    print(f'{"case":<32}{"hit_ratio":>10}{"ops/s":>12}')
+    for name, result in results.items():
+        print(f'{name:<32}{result["hit_ratio"]:>10.3f}{result["ops_per_sec"]:>12.1f}')
+    return finish(args, 'l1', results)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""
+MysqlUtils 写入 / 更新 / 查询吞吐，需要本地 mysql 或 mariadb，会创建并清空 --table 指定的表
+
+    python -m benchmark.mysql_bench --host 127.0.0.1 --port 3306 --user root --password '' --database test --rows 20000
+
+不传连接参数时使用 src.config.config.pic_web_mysql
+"""
+import argparse
+import random
+import sys
+import time
+
+from benchmark.common import add_result_arguments, finish, latency_summary
+from src.config.config import pic_web_mysql
+from src.utils.mysql_utils import MysqlUtils
+
+CREATE_TABLE_SQL = """
+create table if not exists {table} (
+    `id` bigint not null,
+    `name` varchar(64) not null,
+    `score` int not null,
+    `payload` varchar(255) not null,
+    primary key (`id`)
+) engine=InnoDB default charset=utf8mb4
+"""
+
+
+def gen_rows(start, count, score=0):
+    return [
+        {'id': i, 'name': f'name-{i}', 'score': score, 'payload': f'payload-{i}-{score}'.ljust(64, 'x')}
+        for i in range(start, start + count)
+    ]
+
+
+def timed_batches(func, batches):
+    latencies = []
+    rows = 0
+    start = time.perf_counter()
+    for batch in batches:
+        batch_start = time.perf_counter()
+        func(batch)
+        latencies.append(time.perf_counter() - batch_start)
+        rows += len(batch) if isinstance(batch, list) else 1
+    elapsed = time.perf_counter() - start
+    return dict(rows_per_sec=rows / elapsed, calls_per_sec=len(latencies) / elapsed, **latency_summary(latencies))
+
+
+def chunks(rows, size):
+    return [rows[i:i + size] for i in range(0, len(rows), size)]
+
+
+def run(mysql, table='bench_mysql_utils', rows=20000, batch_size=500, queries=2000):
+    mysql.execute(CREATE_TABLE_SQL.format(table=table))
+    mysql.execute(f'truncate table {table}')
+    results = {}
+    half = rows // 2
+    results[f'insert,batch={batch_size}'] = timed_batches(
+        lambda batch: mysql.insert(table, batch), chunks(gen_rows(0, half), batch_size))
+    # 一半已存在、一半新增
+    upsert_rows = gen_rows(half // 2, half, score=1)
+    results[f'insert_or_update_many,batch={batch_size}'] = timed_batches(
+        lambda batch: mysql.insert_or_update_many(table, ['id'], batch), chunks(upsert_rows, batch_size))
+    results[f'update,batch={batch_size}'] = timed_batches(
+        lambda batch: mysql.update(table, ['id'], batch), chunks(gen_rows(0, half, score=2), batch_size))
+    results['insert_or_update,single'] = timed_batches(
+        lambda row: mysql.insert_or_update(table, ['id'], row), gen_rows(rows, min(queries, rows), score=3))
+    total = half + half // 2 + min(queries, rows)
+    point_ids = [random.randrange(total) for _ in range(queries)]
+    results['query,point'] = timed_batches(
+        lambda row_id: mysql.query(f'select * from {table} where id=%s', (row_id,)), point_ids)
+    range_starts = [random.randrange(max(total - 100, 1)) for _ in range(max(queries // 10, 1))]
+    results['query,range100'] = timed_batches(
+        lambda row_id: mysql.query(f'select * from {table} where id>=%s and id<%s', (row_id, row_id + 100)),
+        range_starts)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--user')
+    parser.add_argument('--password')
+    parser.add_argument('--database')
+    parser.add_argument('--table', default='bench_mysql_utils')
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--queries', type=int, default=2000)
+    add_result_arguments(parser)
+    args = parser.parse_args()
+
+    config = {key: value for key, value in pic_web_mysql.items() if key not in ('replicas', 'username')}
+    config['user'] = pic_web_mysql.get('username')
+    for key in ('host', 'port', 'user', 'password', 'database'):
+        if getattr(args, key) is not None:
+            config[key] = getattr(args, key)
+    results = run(MysqlUtils(**config), table=args.table, rows=args.rows, batch_size=args.batch_size,
+                  queries=args.queries)
+    print(f'{"case":<36}{"rows/s":>12}{"p50_ms":>10}{"p99_ms":>10}')
+    for name, result in results.items():
+        print(f'{name:<36}{result["rows_per_sec"]:>12.1f}{result["p50_ms"]:>10.2f}{result["p99_ms"]:>10.2f}')
+    return finish(args, 'mysql', results)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -28,7 +28,7 @@ setup(name='pic_web',
           "": ['*']
       },
       include_package_data=True,
-      packages=find_packages(exclude=['tests', ]),
+      packages=find_packages(exclude=['tests', 'benchmark', 'benchmark.*']),
       zip_safe=False,
       entry_points=entry_points,
       install_requires=requirements,
@@ -1 +1,6 @@
-from .controller import router as ai_picture_api
\ No newline at end of file
+def __getattr__(name):
+    # 按需导入路由：进程池子进程只导入 executor / batching，不加载 controller、FastAPI 和 RedisCache
+    if name == 'ai_picture_api':
+        from .controller import router
+        return router
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,144 @@
+import abc
+import asyncio
+import collections
+import inspect
+import logging
+
+from src.utils.metrics import Histogram, register_collector, series
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class BatchBackend(abc.ABC):
+    """
+    @summary: 批量推理后端，predict_batch 接收一批 question，按相同顺序返回结果；
+    单条结果可以是 Exception，只会抛给对应的调用方
+    """
+    media_type = 'application/octet-stream'
+
+    @abc.abstractmethod
+    def predict_batch(self, questions):
+        ...
+
+
+class PictureBatchBackend(BatchBackend):
+    """
+    @summary: 默认后端，逐条调用 get_ai_picture，单条出错只影响对应的调用方
+    """
+    media_type = 'text/plain; charset=utf-8'
+
+    def predict_batch(self, questions):
+        # service 导入了本模块，这里按需导入避免循环
+        from .service import get_ai_picture
+        results = []
+        for question in questions:
+            try:
+                results.append(get_ai_picture(question))
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+class BatchScheduler(object):
+    """
+    @summary: 动态批量调度，请求进入队列，凑满 max_batch_size 或最早的请求等待超过 max_wait 秒时发送一批给后端；
+    同一时间只有一批在执行，执行期间到达的请求自然组成下一批
+    """
+
+    def __init__(self, backend, max_batch_size=16, max_wait=0.005, executor=None, name='ai_picture'):
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.executor = executor
+        self.name = name
+        self.batch_size_histogram = Histogram(buckets=BATCH_SIZE_BUCKETS)
+        self.queue_wait_histogram = Histogram()
+        self._pending = collections.deque()
+        self._wakeup = None
+        self._task = None
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, question):
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((question, future, loop.time()))
+        self._wakeup.set()
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            deadline = self._pending[0][2] + self.max_wait
+            while len(self._pending) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            batch = [self._pending.popleft() for _ in range(min(len(self._pending), self.max_batch_size))]
+            # 调用方已经取消的请求不再计算
+            batch = [entry for entry in batch if not entry[1].done()]
+            if batch:
+                await self._run_batch(loop, batch)
+
+    async def _run_batch(self, loop, batch):
+        now = loop.time()
+        for _, _, enqueued_at in batch:
+            self.queue_wait_histogram.observe(now - enqueued_at)
+        self.batch_size_histogram.observe(len(batch))
+        questions = [question for question, _, _ in batch]
+        try:
+            if inspect.iscoroutinefunction(self.backend.predict_batch):
+                results = await self.backend.predict_batch(questions)
+            else:
+                results = await loop.run_in_executor(self.executor, self.backend.predict_batch, questions)
+            if len(results) != len(batch):
+                raise RuntimeError(f'batch backend returned {len(results)} results for {len(batch)} questions')
+        except Exception as e:
+            logger.error(f'ai_picture_batch_error {e=} batch_size={len(batch)}')
+            results = [e] * len(batch)
+        for (_, future, _), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def collect(self):
+        return {
+            'gauges': {series(f'{self.name}_batch_queue_size'): len(self._pending)},
+            'histograms': {
+                series(f'{self.name}_batch_size'): self.batch_size_histogram.snapshot(),
+                series(f'{self.name}_batch_queue_wait_seconds'): self.queue_wait_histogram.snapshot(),
+            },
+        }
+
+
+BACKENDS = {
+    'picture': PictureBatchBackend,
+}
+
+
+def build_batch_scheduler(backend=None, model_backend='picture', batch_max_size=16, batch_max_wait_ms=5, **kwargs):
+    scheduler = BatchScheduler(
+        backend=backend or BACKENDS[model_backend](),
+        max_batch_size=batch_max_size,
+        max_wait=batch_max_wait_ms / 1000,
+    )
+    register_collector('ai_picture_batching', scheduler.collect)
+    return scheduler
@@ -1,9 +1,20 @@
 #!/usr/bin/env
 # -*- coding: utf-8 -*-
+import base64
+import json
+import logging
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+
+from starlette.responses import StreamingResponse
+
+from src.cache.response_cache import response_cache
+from src.config.config import pic_web_ai_picture
+from src.utils.admission import AdmissionController, AdmissionError
 from . import service
 
+logger = logging.getLogger(__name__)
+
 # 属于该模块的路由
 router = APIRouter(
     # 这里配置的 tags、dependencies、responses 对这个模块的内的所有路径操作都生效
@@ -17,10 +28,30 @@ router = APIRouter(
     responses={404: {"description": "ai_picture not found"}}
 )
 
+q_admission = AdmissionController('ai_picture_q', **pic_web_ai_picture['admission'])
+q_stream_admission = AdmissionController('ai_picture_q_stream', **pic_web_ai_picture['admission'])
+q_sse_admission = AdmissionController('ai_picture_q_sse', **pic_web_ai_picture['admission'])
+
+
+def get_request_timeout(request: Request):
+    """
+    @summary: 客户端可以通过 X-Request-Timeout（秒）缩短 deadline，不能超过配置的 request_timeout
+    """
+    timeout = pic_web_ai_picture['request_timeout']
+    try:
+        return min(float(request.headers['x-request-timeout']), timeout)
+    except (KeyError, ValueError):
+        return timeout
+
 
 @router.post(path="/q")
-async def get_ai_picture(question: str = ''):
-    ai_picture = service.get_ai_picture(question)
+@response_cache(
+    ttl=pic_web_ai_picture['response_cache_ttl'],
+    cache_control=pic_web_ai_picture['response_cache_control'],
+)
+async def get_ai_picture(request: Request, question: str = ''):
+    ai_picture = await q_admission.run(
+        service.generate_ai_picture, question, timeout=get_request_timeout(request), request=request)
     if ai_picture is None:
         raise HTTPException(status_code=404, detail="ai_picture not found")
     return {
@@ -29,3 +60,70 @@ async def get_ai_picture(question: str = ''):
         "data": f'{ai_picture}',
         "success": True,
     }
+
+
+async def open_picture_stream(admission, request, question, chunk_size):
+    """
+    @summary: 在返回响应之前占用名额并生成第一块，排队失败返回 503 / 504，结果为空返回 404，生成出错返回 500
+    """
+    chunks = service.stream_ai_picture(question, chunk_size=chunk_size)
+    try:
+        return await admission.open_stream(chunks, timeout=get_request_timeout(request))
+    except AdmissionError:
+        raise
+    except LookupError:
+        raise HTTPException(status_code=404, detail="ai_picture not found")
+    except Exception as e:
+        logger.error(f'ai_picture_stream_error {e=} {question=}')
+        raise HTTPException(status_code=500, detail="ai_picture generation failed")
+
+
+@router.post(path="/q/stream")
+async def stream_ai_picture(request: Request, question: str = ''):
+    """
+    @summary: 直接输出图片字节，code/message/success 放在响应头里
+    """
+    chunks = await open_picture_stream(
+        q_stream_admission, request, question, pic_web_ai_picture['stream_chunk_size'])
+    return StreamingResponse(
+        chunks,
+        media_type=service.get_picture_media_type(),
+        headers={'X-Code': '200', 'X-Message': 'success', 'X-Success': 'true'},
+    )
+
+
+def format_sse_event(event, data, event_id=None):
+    lines = [f'event: {event}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {data}')
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+async def iter_sse_events(chunks, chunk_size):
+    yield format_sse_event('meta', json.dumps({
+        "code": 200,
+        "message": 'success',
+        "success": True,
+        "media_type": service.get_picture_media_type(),
+        "chunk_size": chunk_size,
+    }))
+    index = 0
+    async for chunk in chunks:
+        yield format_sse_event('chunk', base64.b64encode(chunk).decode('ascii'), event_id=index)
+        index += 1
+    yield format_sse_event('done', json.dumps({"chunks": index}))
+
+
+@router.post(path="/q/sse")
+async def sse_ai_picture(request: Request, question: str = ''):
+    """
+    @summary: SSE 输出，第一个 meta 事件为原来的响应信封，之后每个 chunk 事件为一块 base64 编码的图片字节
+    """
+    chunk_size = pic_web_ai_picture['stream_chunk_size']
+    chunks = await open_picture_stream(q_sse_admission, request, question, chunk_size)
+    return StreamingResponse(
+        iter_sse_events(chunks, chunk_size),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
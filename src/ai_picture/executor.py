@@ -0,0 +1,47 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from .batching import BACKENDS, BatchBackend
+
+logger = logging.getLogger(__name__)
+
+# 子进程内由 initializer 加载的模型
+_model = None
+
+
+def load_model(model_backend='picture'):
+    global _model
+    _model = BACKENDS[model_backend]()
+    logger.info(f'ai_picture_model_loaded {model_backend=}')
+
+
+def predict_batch_in_worker(questions):
+    return _model.predict_batch(questions)
+
+
+class ProcessPoolBackend(BatchBackend):
+    """
+    @summary: 把整批请求交给进程池中已加载模型的子进程执行
+    """
+
+    def __init__(self, executor):
+        self.executor = executor
+
+    async def predict_batch(self, questions):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, predict_batch_in_worker, questions)
+
+
+def build_process_pool(process_pool_workers=0, process_pool_start_method='spawn', model_backend='picture', **kwargs):
+    """
+    @summary: process_pool_workers 为 0 时返回 None，在事件循环内直接计算
+    """
+    if not process_pool_workers:
+        return None
+    return ProcessPoolExecutor(
+        max_workers=process_pool_workers,
+        mp_context=multiprocessing.get_context(process_pool_start_method),
+        initializer=load_model,
+        initargs=(model_backend,),
+    )
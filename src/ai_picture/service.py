@@ -1,5 +1,13 @@
+import asyncio
 import logging
 
+from src.config.config import pic_web_ai_picture
+from .batching import BACKENDS, build_batch_scheduler
+from .executor import ProcessPoolBackend, build_process_pool
+
+_batch_scheduler = None
+_process_pool = None
+
 
 # ===========================
 # operators on coin keywords
@@ -9,3 +17,48 @@ def get_ai_picture(question: str = ''):
         return question
     except Exception as e:
         logging.exception("exception: {}", e)
+
+
+def get_process_pool():
+    global _process_pool
+    if _process_pool is None and pic_web_ai_picture['process_pool_workers']:
+        _process_pool = build_process_pool(**pic_web_ai_picture)
+    return _process_pool
+
+
+def get_batch_scheduler():
+    global _batch_scheduler
+    if _batch_scheduler is None:
+        process_pool = get_process_pool()
+        backend = ProcessPoolBackend(process_pool) if process_pool else None
+        _batch_scheduler = build_batch_scheduler(backend=backend, **pic_web_ai_picture)
+    return _batch_scheduler
+
+
+async def generate_ai_picture(question: str = ''):
+    """
+    @summary: 开启 batching 时并发请求合并成批交给批量后端，配置了进程池时在子进程中调用 get_ai_picture，否则直接调用
+    """
+    if pic_web_ai_picture['batching']:
+        return await get_batch_scheduler().submit(question)
+    process_pool = get_process_pool()
+    if process_pool is not None:
+        return await asyncio.get_running_loop().run_in_executor(process_pool, get_ai_picture, question)
+    return get_ai_picture(question)
+
+
+def get_picture_media_type():
+    return BACKENDS[pic_web_ai_picture['model_backend']].media_type
+
+
+async def stream_ai_picture(question: str = '', chunk_size: int = 64 * 1024):
+    """
+    @summary: 按 generate_ai_picture 同样的路径（批量 / 进程池 / 直接调用）生成一次结果，再按块输出其字节，
+    结果为 None 时抛出 LookupError
+    """
+    ai_picture = await generate_ai_picture(question)
+    if ai_picture is None:
+        raise LookupError(f'ai_picture not found {question=}')
+    data = ai_picture if isinstance(ai_picture, bytes) else f'{ai_picture}'.encode('utf-8')
+    for offset in range(0, len(data), chunk_size):
+        yield data[offset:offset + chunk_size]
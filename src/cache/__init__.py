@@ -1,24 +1,117 @@
 import asyncio
+import collections
 import logging
+import time
 import typing
+from collections import defaultdict
 
-from cacheout import LFUCache
+from cacheout import LRUCache
 
-from item_store.core import BaseCore, MemoryCache
+from item_store.core import BaseCore
 from item_store.structure.proto_structure.all import *
 
+from src.config.config import pic_web_cache
+from src.utils.metrics import merge_snapshot, register_collector, series, timing
+from .codec import build_codec
+from .memory import build_memory_cache
+from .stale_refresher import StaleRefresher
+from .ttl_refresher import TTLRefresher
+
 logger = logging.getLogger(__name__)
 
+# get_detailed 的返回值，hits 为命中的 item，misses 为未命中（需要回源），absent 为已知不存在（无需回源）
+CacheResult = collections.namedtuple('CacheResult', ['hits', 'misses', 'absent'])
+# 单飞 future 的结果，表示 redis 中是不存在标记
+ABSENT = object()
+
 
 class CacheBase(BaseCore):
     delete_delay = 0.1
     cache_key_format = 'item_store:{item_type}:{item_id}'
     cache_ttl = 86400 * 2
-    cache_memory = MemoryCache(LFUCache(maxsize=10000, ttl=60))
+    cache_memory = build_memory_cache(**pic_web_cache)
+    codec = build_codec(**pic_web_cache)  # None 时沿用 dump_item/load_item
+    fill_lock_enabled = False  # 开启后 redis 未命中的 key 跨 worker 只放行一个请求回源
+    fill_lock_lease = 3.0  # 回源锁租期，持锁者在租期内 save / save_absent / release_fill 后释放
+    fill_lock_poll_interval = 0.05
+    # 按缓存类区分，cache_key -> 同 worker 内合并并发未命中的 future；未命中的 key 保留到 save / save_absent / release_fill 或租期结束
+    _inflights = {}
+    refresh_ttl_on_hit = True  # 命中时续期 redis TTL（滑动过期）
+    ttl_refresh_interval = 1.0  # 命中续期的批量刷新间隔
+    ttl_refresh_batch_size = 500  # 待续期 key 达到该数量时立即刷新
+    ttl_refresh_min_interval = 600  # 本 worker 续期过的 key 在该时间内不再续期
+    ttl_refresh_ratio = 0.5  # 预估剩余 TTL 低于 cache_ttl * ratio 后才按概率续期
+    _ttl_refreshers = {}
+    invalidation_enabled = False  # 开启后 save/delete 广播给其他 worker 淘汰 L1，delete 不再 sleep(delete_delay)
+    # 最近被淘汰的 key，防止淘汰前已发出的 get_cache 把旧值重新写回 L1
+    _recent_invalidations = LRUCache(maxsize=10000, ttl=5)
+    negative_cache_enabled = False  # 开启后 save_absent 写入不存在标记，get 命中标记的 key 不再回源
+    negative_cache_ttl = 60  # redis 中不存在标记的 TTL
+    negative_memory_ttl = 10  # 进程内不存在标记的 TTL，没有开启 invalidation 时也是其他 worker 感知 save 的最长延迟
+    absent_value = b'\x00absent'  # protobuf / json / codec 头部都不会以 0x00 开头
+    # 进程内的不存在标记，cache_key -> 写入时间，与 cache_memory 中的 item 分开存放
+    _absent_memory = LRUCache(maxsize=100000, ttl=10)
+    _lookup_counters = {}
+    # 开启后 L1 中超过 soft_ttl 的 key 返回旧值并在后台刷新，热 key 提前刷新，硬过期仍为 l1_ttl
+    stale_while_revalidate = pic_web_cache['stale_while_revalidate']
+    soft_ttl = pic_web_cache['l1_soft_ttl']
+    refresh_ahead_rate = pic_web_cache['refresh_ahead_rate']
+    refresh_ahead_ratio = pic_web_cache['refresh_ahead_ratio']
+    _stale_refreshers = {}
+
+    @property
+    def ttl_refresher(self) -> TTLRefresher:
+        refresher = self._ttl_refreshers.get(type(self))
+        if refresher is None:
+            refresher = self._ttl_refreshers[type(self)] = TTLRefresher(
+                self,
+                flush_interval=self.ttl_refresh_interval,
+                max_batch_size=self.ttl_refresh_batch_size,
+                min_refresh_interval=self.ttl_refresh_min_interval,
+                refresh_ratio=self.ttl_refresh_ratio,
+            )
+        return refresher
+
+    @property
+    def stale_refresher(self) -> StaleRefresher:
+        refresher = self._stale_refreshers.get(type(self))
+        if refresher is None:
+            refresher = self._stale_refreshers[type(self)] = StaleRefresher(
+                self,
+                soft_ttl=self.soft_ttl,
+                hard_ttl=pic_web_cache['l1_ttl'],
+                refresh_ahead_rate=self.refresh_ahead_rate,
+                refresh_ahead_ratio=self.refresh_ahead_ratio,
+            )
+        return refresher
+
+    def register_loader(self, loader: typing.Callable[[typing.List[ItemDoc]], typing.Awaitable[typing.List[ItemDoc]]]):
+        """
+        @summary: 注册后台刷新的回源函数，loader(items) 返回回源得到的 item（可以是同步函数），未返回的 item 视为已不存在；
+        未注册时后台刷新从 redis 重新读取
+        """
+        self.stale_refresher.loader = loader
+
+    @property
+    def inflight(self) -> typing.Dict[str, asyncio.Future]:
+        inflight = self._inflights.get(type(self))
+        if inflight is None:
+            inflight = self._inflights[type(self)] = {}
+        return inflight
 
     def get_cache_key(self, item: ItemDoc):
         return self.cache_key_format.format(item_type=item.item_type, item_id=item.item_id)
 
+    def encode_item(self, item: ItemDoc) -> bytes:
+        if self.codec is None:
+            return self.dump_item(item=item)
+        return self.codec.encode(item)
+
+    def decode_item(self, data: bytes) -> ItemDoc:
+        if self.codec is not None and self.codec.is_encoded(data):
+            return self.codec.decode(data)
+        return self.load_item(data)
+
     async def update_cache_ttl(self, items: typing.List[ItemDoc]) -> bool:
         return await self.save_cache(items, only_update_ttl=True)
 
@@ -31,42 +124,322 @@ class CacheBase(BaseCore):
     async def get_cache(self, items: typing.List[ItemDoc]) -> typing.List[ItemDoc]:
         ...
 
+    async def get_cache_with_absent(
+            self, items: typing.List[ItemDoc]) -> typing.Tuple[typing.List[ItemDoc], typing.List[ItemDoc]]:
+        """
+        @return (命中的 item, redis 中为不存在标记的 item)，不支持不存在标记的实现只返回命中的 item
+        """
+        return await self.run_async_func(self.get_cache, items), []
+
+    async def save_absent_cache(self, items: typing.List[ItemDoc]) -> bool:
+        return True
+
+    async def publish_invalidation(self, items: typing.List[ItemDoc]) -> bool:
+        return True
+
+    async def ensure_invalidation_listener(self):
+        ...
+
+    def invalidate_memory(self, items: typing.List[ItemDoc]):
+        now = time.monotonic()
+        for item in items:
+            cache_key = self.get_cache_key(item=item)
+            self._recent_invalidations.set(cache_key, now)
+            self._absent_memory.delete(cache_key)
+        self.cache_memory.delete_many_items(items)
+
+    def filter_invalidated(self, items: typing.List[ItemDoc], since: float) -> typing.List[ItemDoc]:
+        return [
+            item for item in items
+            if self._recent_invalidations.get(self.get_cache_key(item=item), 0) < since
+        ]
+
+    async def acquire_fill_locks(self, items: typing.List[ItemDoc]) -> typing.List[ItemDoc]:
+        return items
+
+    async def release_fill_locks(self, items: typing.List[ItemDoc]) -> bool:
+        return True
+
+    async def get_cache_single_flight(
+            self, items: typing.List[ItemDoc]) -> typing.Tuple[typing.List[ItemDoc], typing.List[ItemDoc]]:
+        """
+        @summary: 同一 worker 内同一个 key 的并发未命中只调用一次 get_cache，其余请求等待同一个 future；
+        开启 fill_lock_enabled 时 redis 也未命中的 key 由第一个请求回源，future 保留到它 save / save_absent / release_fill，
+        最长 fill_lock_lease 秒；未开启时 get_cache 返回后立即以未命中结束，等待者不依赖调用方 save
+        @return (命中的 item, 已知不存在的 item)
+        """
+        loop = asyncio.get_running_loop()
+        inflight = self.inflight
+        owned_futures, waiting_futures, owned_items, waiting_items = {}, [], [], []
+        for item in items:
+            cache_key = self.get_cache_key(item=item)
+            future = inflight.get(cache_key)
+            if future is None:
+                future = inflight[cache_key] = owned_futures[cache_key] = loop.create_future()
+                owned_items.append(item)
+            else:
+                waiting_futures.append(future)
+                waiting_items.append(item)
+        cache_items, absent_items = [], []
+        resolved = False
+        try:
+            if owned_items:
+                cache_items, absent_items = await self.run_async_func(self.get_cache_with_fill_lock, owned_items)
+                cache_items_map = {self.get_cache_key(item=item): item for item in cache_items}
+                cache_items_map.update({self.get_cache_key(item=item): ABSENT for item in absent_items})
+                for cache_key, future in owned_futures.items():
+                    if cache_key in cache_items_map or not self.fill_lock_enabled:
+                        self._expire_inflight(cache_key, future, cache_items_map.get(cache_key))
+                    else:
+                        loop.call_later(self.fill_lock_lease, self._expire_inflight, cache_key, future)
+            resolved = True
+        finally:
+            if not resolved:
+                for cache_key, future in owned_futures.items():
+                    if not future.done():
+                        future.set_result(None)
+                    if inflight.get(cache_key) is future:
+                        del inflight[cache_key]
+        if waiting_futures:
+            waiting_results = await asyncio.gather(*(asyncio.shield(future) for future in waiting_futures))
+            for waiting_item, result in zip(waiting_items, waiting_results):
+                if result is ABSENT:
+                    absent_items.append(waiting_item)
+                elif result is not None:
+                    cache_items.append(result)
+        return cache_items, absent_items
+
+    def _expire_inflight(self, cache_key, future, result=None):
+        if not future.done():
+            future.set_result(result)
+        if self.inflight.get(cache_key) is future:
+            del self.inflight[cache_key]
+
+    def resolve_inflight(self, results: typing.Iterable[typing.Tuple[ItemDoc, typing.Any]]):
+        """
+        @summary: 唤醒等待回源结果的请求，results 为 (item, 结果)，结果为 item、ABSENT 或 None（未命中，等待者自行回源）
+        """
+        inflight = self.inflight
+        for item, result in results:
+            future = inflight.pop(self.get_cache_key(item=item), None)
+            if future is not None and not future.done():
+                future.set_result(result)
+
+    async def get_cache_with_fill_lock(
+            self, items: typing.List[ItemDoc]) -> typing.Tuple[typing.List[ItemDoc], typing.List[ItemDoc]]:
+        """
+        @summary: redis 未命中时抢回源锁，抢到的 key 直接返回未命中由调用方回源并 save / save_absent；
+        没抢到的 key 在租期内轮询 redis 等待持锁者写入，超时后同样返回未命中
+        @return (命中的 item, 已知不存在的 item)
+        """
+        cache_items, absent_items = await self.get_cache_with_absent(items)
+        if not self.fill_lock_enabled or len(cache_items) + len(absent_items) >= len(items):
+            return cache_items, absent_items
+        cache_keys = {self.get_cache_key(item=item) for item in cache_items + absent_items}
+        waiting_items = [item for item in items if self.get_cache_key(item=item) not in cache_keys]
+        deadline = asyncio.get_running_loop().time() + self.fill_lock_lease
+        while True:
+            # 锁已被释放（持锁者 release_fill 或租期到期）且仍未写入的 key 重新抢锁，抢到的作为未命中返回
+            locked_keys = {
+                self.get_cache_key(item=item)
+                for item in await self.run_async_func(self.acquire_fill_locks, waiting_items)
+            }
+            waiting_items = [item for item in waiting_items if self.get_cache_key(item=item) not in locked_keys]
+            if not waiting_items or asyncio.get_running_loop().time() >= deadline:
+                break
+            await asyncio.sleep(self.fill_lock_poll_interval)
+            filled_items, filled_absent_items = await self.get_cache_with_absent(waiting_items)
+            if filled_items or filled_absent_items:
+                cache_items += filled_items
+                absent_items += filled_absent_items
+                filled_keys = {self.get_cache_key(item=item) for item in filled_items + filled_absent_items}
+                waiting_items = [
+                    item for item in waiting_items if self.get_cache_key(item=item) not in filled_keys]
+                if not waiting_items:
+                    break
+        return cache_items, absent_items
+
+    async def warm_memory(self, items: typing.List[ItemDoc], batch_size=500) -> int:
+        """
+        @summary: 从 redis 批量读取 items 写入 L1，用于新 worker 启动时预热，返回写入 L1 的数量
+        """
+        count = 0
+        for start in range(0, len(items), batch_size):
+            cache_items = await self.get_cache(items[start:start + batch_size])
+            if cache_items:
+                await self.run_async_func(self.cache_memory.set_many_items, cache_items)
+                count += len(cache_items)
+        return count
+
+    @property
+    def lookup_counters(self) -> typing.Dict[str, int]:
+        counters = self._lookup_counters.get(type(self))
+        if counters is None:
+            counters = self._lookup_counters[type(self)] = defaultdict(int)
+        return counters
+
+    def set_absent_memory(self, items: typing.List[ItemDoc]):
+        now = time.monotonic()
+        for item in items:
+            self._absent_memory.set(self.get_cache_key(item=item), now, ttl=self.negative_memory_ttl)
+
+    def clear_absent_memory(self, items: typing.List[ItemDoc]):
+        for item in items:
+            self._absent_memory.delete(self.get_cache_key(item=item))
+
+    def split_absent_memory(
+            self, items: typing.List[ItemDoc]) -> typing.Tuple[typing.List[ItemDoc], typing.List[ItemDoc]]:
+        """
+        @return (不在进程内不存在标记中的 item, 命中不存在标记的 item)
+        """
+        present_items, absent_items = [], []
+        for item in items:
+            if self._absent_memory.get(self.get_cache_key(item=item)) is None:
+                present_items.append(item)
+            else:
+                absent_items.append(item)
+        return present_items, absent_items
+
     async def save(self, items: typing.List[ItemDoc]) -> bool:
         state = False
         try:
+            self.resolve_inflight((item, item) for item in items)
             state = await self.run_async_func(self.save_cache, items)
             logger.debug('cache_save state=%s items=%s', state, items)
+            if state:
+                self.ttl_refresher.mark_refreshed(items)
+            if self.stale_while_revalidate:
+                self.stale_refresher.mark_loaded(items)
+            if self.negative_cache_enabled:
+                # redis 中的不存在标记已被 mset 覆盖，其他 worker 的进程内标记通过 invalidation 或 negative_memory_ttl 过期清除
+                self.clear_absent_memory(items)
+            if self.fill_lock_enabled:
+                await self.run_async_func(self.release_fill_locks, items)
+            if self.invalidation_enabled:
+                await self.ensure_invalidation_listener()
+                await self.run_async_func(self.publish_invalidation, items)
             asyncio.create_task(self.run_async_func(self.cache_memory.set_many_items, items))
         except Exception as e:
             logger.error(f'cache_save_error {e=} {items=}')
         return state
 
-    async def get(self, items: typing.List[ItemDoc]) -> typing.List[ItemDoc]:
-        cache_items = []
+    async def save_absent(self, items: typing.List[ItemDoc]) -> bool:
+        """
+        @summary: 回源确认不存在的 item 写入不存在标记，redis 中 negative_cache_ttl、进程内 negative_memory_ttl 后过期；
+        redis 中已有真实值的 key 不会被覆盖
+        """
+        if not self.negative_cache_enabled:
+            await self.release_fill(items)
+            return False
+        state = False
+        try:
+            self.resolve_inflight((item, ABSENT) for item in items)
+            state = await self.run_async_func(self.save_absent_cache, items)
+            logger.debug('cache_save_absent state=%s items=%s', state, items)
+            if self.fill_lock_enabled:
+                await self.run_async_func(self.release_fill_locks, items)
+            self.set_absent_memory(items)
+        except Exception as e:
+            logger.error(f'cache_save_absent_error {e=} {items=}')
+        return state
+
+    async def release_fill(self, items: typing.List[ItemDoc]) -> bool:
+        """
+        @summary: get_detailed 返回未命中、但回源失败或不写入缓存时调用，释放回源锁，等待的请求立即自行回源
+        """
+        self.resolve_inflight((item, None) for item in items)
+        if not self.fill_lock_enabled:
+            return True
+        try:
+            return await self.run_async_func(self.release_fill_locks, items)
+        except Exception as e:
+            logger.error(f'cache_release_fill_error {e=} {items=}')
+        return False
+
+    async def get_detailed(self, items: typing.List[ItemDoc]) -> CacheResult:
+        """
+        @summary: 两级缓存查找，分别返回命中、未命中（需要回源）和已知不存在（无需回源）的 item
+        """
+        cache_items, absent_items = [], []
+        counters = self.lookup_counters
         try:
-            memory_items = self.cache_memory.get_many_items(items)
+            started = time.monotonic()
+            if self.invalidation_enabled:
+                await self.ensure_invalidation_listener()
+            with timing('cache_l1'):
+                memory_items = self.cache_memory.get_many_items(items)
             cache_uniq_ids = self.get_items_uniq_ids(items=memory_items)
             if memory_items:
                 cache_items.extend(memory_items)
+                counters['hit_l1'] += len(memory_items)
+                if self.stale_while_revalidate:
+                    self.stale_refresher.touch(memory_items)
             not_memory_items = [item for item in items if self.get_item_uniq_id(item) not in cache_uniq_ids]
+            if not_memory_items and self.negative_cache_enabled:
+                not_memory_items, absent_items = self.split_absent_memory(not_memory_items)
+                counters['absent_l1'] += len(absent_items)
             if not_memory_items:
-                cache_not_memory_items = await self.run_async_func(self.get_cache, not_memory_items)
+                with timing('redis'):
+                    cache_not_memory_items, redis_absent_items = await self.get_cache_single_flight(not_memory_items)
+                counters['hit_redis'] += len(cache_not_memory_items)
+                counters['absent_redis'] += len(redis_absent_items)
                 cache_items += cache_not_memory_items
-                asyncio.create_task(self.run_async_func(self.cache_memory.add_many_items, cache_items))
-            logger.debug('cache_get cache_items=%s items=%s', cache_items, items)
-            if cache_items:
-                asyncio.create_task(self.run_async_func(self.update_cache_ttl, cache_items))
+                memory_add_items = self.filter_invalidated(cache_items, started) if self.invalidation_enabled else cache_items
+                asyncio.create_task(self.run_async_func(self.cache_memory.add_many_items, memory_add_items))
+                if self.stale_while_revalidate:
+                    self.stale_refresher.mark_loaded(cache_not_memory_items)
+                if redis_absent_items:
+                    absent_items += redis_absent_items
+                    self.set_absent_memory(
+                        self.filter_invalidated(redis_absent_items, started)
+                        if self.invalidation_enabled else redis_absent_items)
+            logger.debug('cache_get cache_items=%s absent_items=%s items=%s', cache_items, absent_items, items)
+            if cache_items and self.refresh_ttl_on_hit:
+                self.ttl_refresher.touch(cache_items)
+            elif cache_items:
+                self.ttl_refresher.record_hits(cache_items)
         except Exception as e:
             logger.error(f'cache_get_error {e=} {items=}')
-        return cache_items
+        found_uniq_ids = self.get_items_uniq_ids(items=cache_items + absent_items)
+        missing_items = [item for item in items if self.get_item_uniq_id(item) not in found_uniq_ids]
+        counters['miss'] += len(missing_items)
+        return CacheResult(cache_items, missing_items, absent_items)
+
+    async def get(self, items: typing.List[ItemDoc]) -> typing.List[ItemDoc]:
+        return (await self.get_detailed(items)).hits
 
     async def delete(self, items: typing.List[ItemDoc]) -> bool:
         state = False
         try:
-            asyncio.create_task(self.run_async_func(self.cache_memory.delete_many_items, items))
-            await asyncio.sleep(self.delete_delay)
-            state = await self.run_async_func(self.delete_cache, items)
+            if self.invalidation_enabled:
+                await self.ensure_invalidation_listener()
+                self.invalidate_memory(items)
+                state = await self.run_async_func(self.delete_cache, items)
+                await self.run_async_func(self.publish_invalidation, items)
+            else:
+                asyncio.create_task(self.run_async_func(self.cache_memory.delete_many_items, items))
+                await asyncio.sleep(self.delete_delay)
+                state = await self.run_async_func(self.delete_cache, items)
             logger.debug('cache_delete state=%s items=%s', state, items)
         except Exception as e:
             logger.error(f'cache_delete_error {e=} {items=}')
         return state
+
+
+def collect_cache_stats():
+    counters = {}
+    for cache_class, lookup_counters in list(CacheBase._lookup_counters.items()):
+        for result, count in list(lookup_counters.items()):
+            counters[series('cache_lookups_total', cache=cache_class.__name__, result=result)] = count
+    for cache_class, refresher in list(CacheBase._stale_refreshers.items()):
+        for event, count in list(refresher.counters.items()):
+            counters[series('cache_stale_refresh_total', cache=cache_class.__name__, event=event)] = count
+    snapshot = {'counters': counters, 'gauges': {}, 'histograms': {}}
+    # memory 后端（item_store.MemoryCache）没有 collect
+    collect_memory = getattr(CacheBase.cache_memory, 'collect', None)
+    if collect_memory is not None:
+        merge_snapshot(snapshot, collect_memory())
+    return snapshot
+
+
+register_collector('cache', collect_cache_stats)
@@ -1,48 +1,444 @@
+import asyncio
+import functools
+import json
 import logging
+import os
+import socket
+import time
+import uuid
 
 import aioredis
 from aioredis.client import Pipeline
+from cacheout import LRUCache
 
-from src.config.config import pic_web_redis
-from cache import CacheBase
+from src.config.config import pic_web_cache, pic_web_redis, pic_web_redis_circuit_breaker, pic_web_redis_nodes
+from src.utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+from src.utils.metrics import empty_snapshot, merge_snapshot, register_collector, series
+from . import CacheBase, ItemDoc
+from .hash_ring import HashRing
+from .redis_batch import RedisBatchLoader
 
 logger = logging.getLogger(__name__)
 
 
+def worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+# 只删除自己持有的回源锁，KEYS 为锁 key，ARGV 为对应的 token
+RELEASE_FILL_LOCKS_SCRIPT = """
+local released = 0
+for i, key in ipairs(KEYS) do
+    if redis.call('get', key) == ARGV[i] then
+        released = released + redis.call('del', key)
+    end
+end
+return released
+"""
+
+
+def redis_node_name(node):
+    return node.get('name') or '{host}:{port}'.format(host=node.get('host'), port=node.get('port'))
+
+
+class RedisClients(object):
+    """
+    @summary: 按进程懒加载的 redis 客户端，首次使用时创建；fork 出的子进程会重新创建，不复用父进程的连接。
+    每个节点一个熔断器（circuit_breaker 为 None 时不熔断），后台按 health_check_interval 定期 PING 各节点，
+    代替 redis-py 在每条命令前对空闲连接的 PING；熔断期间被拒绝的 delete 暂存，节点 PING 恢复后重试
+    """
+
+    def __init__(self, nodes, circuit_breaker=None, health_check_interval=1.0, max_pending_deletes=100000):
+        self.nodes = {redis_node_name(node): node for node in nodes}
+        self.breakers = {
+            name: CircuitBreaker(f'redis:{name}', **circuit_breaker) for name in self.nodes
+        } if circuit_breaker is not None else {}
+        self.health_check_interval = health_check_interval
+        self.max_pending_deletes = max_pending_deletes
+        self.pending_deletes = {name: set() for name in self.nodes}
+        self._pid = None
+        self._clients = {}
+        self._health_check_task = None
+
+    def get_clients(self):
+        if self._pid != os.getpid():
+            # name 只用于分片和指标，不是 redis 连接参数
+            self._clients = {
+                name: aioredis.Redis(**{key: value for key, value in node.items() if key != 'name'})
+                for name, node in self.nodes.items()
+            }
+            self._pid = os.getpid()
+        return self._clients
+
+    async def warm_up(self, connections=1):
+        """
+        @summary: 每个节点并发发送 connections 个 PING，让连接池预先建立连接
+        """
+        await asyncio.gather(*(
+            client.ping() for client in self.get_clients().values() for _ in range(connections)
+        ))
+
+    async def call(self, node_name, func, *args, fallback=None):
+        """
+        @summary: 经过熔断器调用 await func(client, *args)；
+        熔断打开时立即返回 fallback(*args)，fallback 为 None 时抛出 CircuitOpenError
+        """
+        client = self.get_clients()[node_name]
+        self.ensure_health_check()
+        breaker = self.breakers.get(node_name)
+        if breaker is None:
+            return await func(client, *args)
+        if not breaker.allow():
+            if fallback is None:
+                raise CircuitOpenError(breaker.name)
+            return fallback(*args)
+        start = time.monotonic()
+        try:
+            res = await func(client, *args)
+        except asyncio.CancelledError:
+            breaker.cancel()
+            raise
+        except Exception:
+            breaker.record(time.monotonic() - start, error=True)
+            raise
+        breaker.record(time.monotonic() - start)
+        return res
+
+    def ensure_health_check(self):
+        if not self.health_check_interval:
+            return
+        loop = asyncio.get_running_loop()
+        task = self._health_check_task
+        if task is None or task.done() or task.get_loop() is not loop:
+            self._health_check_task = loop.create_task(self._health_check())
+
+    async def _ping(self, client):
+        return await client.ping()
+
+    async def _health_check(self):
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            results = await asyncio.gather(*(
+                self.call(node_name, self._ping, fallback=lambda: None) for node_name in self.get_clients()
+            ), return_exceptions=True)
+            for node_name, res in zip(self.get_clients(), results):
+                if isinstance(res, Exception):
+                    logger.warning(f'redis_health_check_error {node_name=} {res=}')
+                elif res and self.pending_deletes[node_name]:
+                    await self.retry_deletes(node_name)
+
+    def defer_delete(self, node_name, keys):
+        """
+        @summary: call 的 fallback，熔断打开时暂存 delete 的 key，返回 None 表示没有删除
+        """
+        pending = self.pending_deletes[node_name]
+        if len(pending) + len(keys) > self.max_pending_deletes:
+            logger.error(f'redis_pending_deletes_full {node_name=} dropped={len(keys)}')
+            return None
+        pending.update(keys)
+        return None
+
+    @staticmethod
+    async def delete_keys(client, keys):
+        return await client.delete(*keys)
+
+    async def retry_deletes(self, node_name):
+        keys, self.pending_deletes[node_name] = list(self.pending_deletes[node_name]), set()
+        try:
+            await self.call(node_name, self.delete_keys, keys, fallback=functools.partial(self.defer_delete, node_name))
+        except Exception as e:
+            self.defer_delete(node_name, keys)
+            logger.error(f'redis_retry_deletes_error {node_name=} {e=}')
+
+    async def close(self):
+        if self._health_check_task is not None:
+            self._health_check_task.cancel()
+            self._health_check_task = None
+        if self._pid != os.getpid():
+            return
+        clients, self._clients, self._pid = self._clients, {}, None
+        for client in clients.values():
+            await client.close()
+            await client.connection_pool.disconnect()
+
+
 class RedisCache(CacheBase):
-    cache = aioredis.Redis(**pic_web_redis)
+    redis_clients = RedisClients(
+        [pic_web_redis, *pic_web_redis_nodes[1:]],
+        circuit_breaker=pic_web_redis_circuit_breaker['options'] if pic_web_redis_circuit_breaker['enabled'] else None,
+        health_check_interval=pic_web_redis_circuit_breaker['health_check_interval'],
+    )
+    hash_ring = HashRing(redis_clients.nodes.keys(), vnodes=160)
+    fill_lock_key_format = '{cache_key}:fill_lock'
+    # lock_key -> 本 worker 抢到锁时写入的 token，释放时比较后删除，不会删除租期过后被其他 worker 抢到的锁
+    _fill_lock_tokens = LRUCache(maxsize=100000)
+    invalidation_channel = 'item_store:invalidate'
+    invalidation_reconnect_delay = 1.0
+    _invalidation_listeners = {}
+    # 开启后并发请求的 get / save 合并为一次 mget / pipeline
+    batching_enabled = pic_web_cache['redis_batching']
+    batch_max_size = pic_web_cache['redis_batch_max_size']
+    batch_max_wait = pic_web_cache['redis_batch_max_wait_ms'] / 1000
+    _batch_loaders = {}  # (缓存类, cache_ttl) -> RedisBatchLoader，mset_keys 按 cache_ttl 设置过期时间
+
+    @property
+    def batch_loader(self) -> RedisBatchLoader:
+        loader = self._batch_loaders.get((type(self), self.cache_ttl))
+        if loader is None:
+            loader = self._batch_loaders[(type(self), self.cache_ttl)] = RedisBatchLoader(
+                self.mget_keys,
+                self.mset_keys,
+                max_batch_size=self.batch_max_size,
+                max_wait=self.batch_max_wait,
+            )
+        return loader
+
+    @property
+    def caches(self):
+        return self.redis_clients.get_clients()
+
+    @property
+    def cache(self):
+        # 第一个节点，用于 pub/sub
+        return next(iter(self.caches.values()))
+
+    def group_by_shard(self, cache_keys):
+        """
+        @return {node_name: [(index, cache_key), ...]}，index 为 key 在 cache_keys 中的位置，便于按原顺序合并结果
+        """
+        if len(self.caches) == 1:
+            return {next(iter(self.caches)): list(enumerate(cache_keys))}
+        shards = {}
+        for index, cache_key in enumerate(cache_keys):
+            shards.setdefault(self.hash_ring.get_node(cache_key), []).append((index, cache_key))
+        return shards
+
+    async def _gather_shards(self, func, cache_keys, fallback=None):
+        """
+        @param fallback: fallback(shard_keys) 为熔断打开的节点的结果，None 表示抛出 CircuitOpenError
+        """
+        shards = self.group_by_shard(cache_keys)
+        shard_res = await asyncio.gather(*(
+            self.redis_clients.call(node_name, func, [cache_key for _, cache_key in indexed_keys], fallback=fallback)
+            for node_name, indexed_keys in shards.items()
+        ))
+        return shards, shard_res
 
     async def save_cache(self, items, only_update_ttl=False):
+        if only_update_ttl:
+            return await self.update_cache_ttl(items)
         cache_items = {
-            self.get_cache_key(item=item): self.dump_item(item=item)
+            self.get_cache_key(item=item): self.encode_item(item=item)
             for item in items
         }
-        async with self.cache.pipeline() as pipe:  # type: Pipeline
-            if not only_update_ttl:
-                await pipe.mset(cache_items)
-            for key in cache_items.keys():
-                await pipe.expire(key, self.cache_ttl)
-            pipe_res = await pipe.execute()
-
-        state = all(pipe_res)
+        if self.batching_enabled:
+            return await self.batch_loader.mset(cache_items)
+        return await self.mset_keys(cache_items)
+
+    async def mset_keys(self, cache_items):
+        async def _save_shard(cache, cache_keys):
+            async with cache.pipeline() as pipe:  # type: Pipeline
+                await pipe.mset({key: cache_items[key] for key in cache_keys})
+                for key in cache_keys:
+                    await pipe.expire(key, self.cache_ttl)
+                return await pipe.execute()
+
+        _, shard_res = await self._gather_shards(_save_shard, list(cache_items), fallback=lambda keys: [False])
+        state = all(all(pipe_res) for pipe_res in shard_res)
         return state
 
+    async def update_cache_ttl(self, items):
+        cache_keys = list({self.get_cache_key(item=item) for item in items})
+
+        async def _expire_shard(cache, shard_keys):
+            async with cache.pipeline(transaction=False) as pipe:  # type: Pipeline
+                for key in shard_keys:
+                    await pipe.expire(key, self.cache_ttl)
+                return await pipe.execute()
+
+        _, shard_res = await self._gather_shards(_expire_shard, cache_keys, fallback=lambda keys: [False])
+        return all(all(pipe_res) for pipe_res in shard_res)
+
     async def delete_cache(self, items):
         delete_keys = [
             self.get_cache_key(item=item)
             for item in items
         ]
-        await self.cache.delete(*delete_keys)
-        return True
+        if self.batching_enabled:
+            self.batch_loader.discard(delete_keys)
+
+        async def _delete_node(node_name, shard_keys):
+            # 熔断打开或执行失败的 delete 暂存，节点恢复后由健康检查重试，调用方照常淘汰 L1
+            defer_delete = functools.partial(self.redis_clients.defer_delete, node_name)
+            try:
+                return await self.redis_clients.call(
+                    node_name, self.redis_clients.delete_keys, shard_keys, fallback=defer_delete)
+            except Exception:
+                defer_delete(shard_keys)
+                raise
+
+        shard_res = await asyncio.gather(*(
+            _delete_node(node_name, [cache_key for _, cache_key in indexed_keys])
+            for node_name, indexed_keys in self.group_by_shard(delete_keys).items()
+        ))
+        return all(res is not None for res in shard_res)
 
     async def get_cache(self, items):
+        cache_items, _ = await self.get_cache_with_absent(items)
+        return cache_items
+
+    async def get_cache_with_absent(self, items):
         cache_keys = [
             self.get_cache_key(item=item)
             for item in items
         ]
-        load_cache = await self.cache.mget(keys=cache_keys)
-        load_items = [
-            self.load_item(_load_cache)
-            for _load_cache in load_cache if _load_cache is not None
+        if self.batching_enabled:
+            load_cache = await self.batch_loader.mget(cache_keys)
+        else:
+            load_cache = await self.mget_keys(cache_keys)
+        load_items, absent_items = [], []
+        for item, _load_cache in zip(items, load_cache):
+            if _load_cache is None:
+                continue
+            if _load_cache == self.absent_value:
+                absent_items.append(item)
+            else:
+                load_items.append(self.decode_item(_load_cache))
+        return load_items, absent_items
+
+    async def mget_keys(self, cache_keys):
+        async def _mget_shard(cache, shard_keys):
+            return await cache.mget(keys=shard_keys)
+
+        # 熔断时按未命中处理，只使用 L1
+        shards, shard_res = await self._gather_shards(
+            _mget_shard, cache_keys, fallback=lambda keys: [None] * len(keys))
+        load_cache = [None] * len(cache_keys)
+        for indexed_keys, shard_values in zip(shards.values(), shard_res):
+            for (index, _), value in zip(indexed_keys, shard_values):
+                load_cache[index] = value
+        return load_cache
+
+    async def save_absent_cache(self, items):
+        cache_keys = list({self.get_cache_key(item=item) for item in items})
+
+        async def _save_absent_shard(cache, shard_keys):
+            async with cache.pipeline(transaction=False) as pipe:  # type: Pipeline
+                for key in shard_keys:
+                    await pipe.set(key, self.absent_value, nx=True, ex=self.negative_cache_ttl)
+                return await pipe.execute()
+
+        await self._gather_shards(_save_absent_shard, cache_keys, fallback=lambda keys: [])
+        return True
+
+    async def acquire_fill_locks(self, items):
+        lock_keys = [
+            self.fill_lock_key_format.format(cache_key=self.get_cache_key(item=item))
+            for item in items
         ]
-        return load_items
+
+        tokens = {lock_key: uuid.uuid4().hex for lock_key in lock_keys}
+
+        async def _lock_shard(cache, shard_keys):
+            async with cache.pipeline(transaction=False) as pipe:  # type: Pipeline
+                for lock_key in shard_keys:
+                    await pipe.set(lock_key, tokens[lock_key], nx=True, px=int(self.fill_lock_lease * 1000))
+                return await pipe.execute()
+
+        # 熔断时视为抢到锁，直接回源，不等待持锁者
+        shards, shard_res = await self._gather_shards(
+            _lock_shard, lock_keys, fallback=lambda keys: [True] * len(keys))
+        locked = [False] * len(lock_keys)
+        for indexed_keys, pipe_res in zip(shards.values(), shard_res):
+            for (index, lock_key), res in zip(indexed_keys, pipe_res):
+                locked[index] = bool(res)
+                if res:
+                    self._fill_lock_tokens.set(lock_key, tokens[lock_key], ttl=self.fill_lock_lease)
+        return [item for item, _locked in zip(items, locked) if _locked]
+
+    async def release_fill_locks(self, items):
+        tokens = {}
+        for item in items:
+            lock_key = self.fill_lock_key_format.format(cache_key=self.get_cache_key(item=item))
+            token = self._fill_lock_tokens.get(lock_key)
+            if token is not None:
+                self._fill_lock_tokens.delete(lock_key)
+                tokens[lock_key] = token
+        if not tokens:
+            return True
+
+        async def _unlock_shard(cache, shard_keys):
+            return await cache.eval(
+                RELEASE_FILL_LOCKS_SCRIPT, len(shard_keys), *shard_keys, *(tokens[key] for key in shard_keys))
+
+        await self._gather_shards(_unlock_shard, list(tokens), fallback=lambda keys: 0)
+        return True
+
+    async def publish_invalidation(self, items):
+        message = json.dumps({
+            'sender': worker_id(),
+            'items': [[item.item_type, item.item_id] for item in items],
+        })
+
+        async def _publish(cache):
+            return await cache.publish(self.invalidation_channel, message)
+
+        await self.redis_clients.call(next(iter(self.caches)), _publish, fallback=lambda: 0)
+        return True
+
+    async def ensure_invalidation_listener(self):
+        listener = self._invalidation_listeners.get(type(self))
+        if listener is None or listener.done():
+            self._invalidation_listeners[type(self)] = asyncio.get_running_loop().create_task(
+                self._listen_invalidation())
+
+    def on_invalidation_message(self, data):
+        message = json.loads(data)
+        if message.get('sender') == worker_id():
+            return
+        items = [ItemDoc(item_type=item_type, item_id=item_id) for item_type, item_id in message['items']]
+        self.invalidate_memory(items)
+        logger.debug('cache_invalidation items=%s', items)
+
+    async def _listen_invalidation(self):
+        while True:
+            pubsub = self.cache.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.invalidation_channel)
+                while True:
+                    message = await pubsub.get_message(timeout=1.0)
+                    if message is None:
+                        continue
+                    try:
+                        self.on_invalidation_message(message['data'])
+                    except Exception as e:
+                        logger.error(f'cache_invalidation_message_error {e=} {message=}')
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f'cache_invalidation_listen_error {e=}')
+                await asyncio.sleep(self.invalidation_reconnect_delay)
+            finally:
+                await pubsub.reset()
+
+
+def collect_redis_batch_stats():
+    snapshot = empty_snapshot()
+    for (cache_class, _), loader in list(RedisCache._batch_loaders.items()):
+        merge_snapshot(snapshot, loader.collect(cache_class.__name__))
+    return snapshot
+
+
+register_collector('redis_batch', collect_redis_batch_stats)
+
+
+def collect_redis_circuit_stats():
+    snapshot = empty_snapshot()
+    for breaker in list(RedisCache.redis_clients.breakers.values()):
+        merge_snapshot(snapshot, breaker.collect())
+    for node_name, pending in list(RedisCache.redis_clients.pending_deletes.items()):
+        snapshot['gauges'][series('redis_pending_deletes', node=node_name)] = len(pending)
+    return snapshot
+
+
+register_collector('redis_circuit', collect_redis_circuit_stats)
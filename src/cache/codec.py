@@ -0,0 +1,135 @@
+import json
+
+from google.protobuf.json_format import MessageToDict, ParseDict
+
+from item_store.structure.proto_structure.all import ItemDoc
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+# 头部: 3 字节 MAGIC + 1 字节 bit7 版本 | bit5-6 codec | bit3-4 压缩算法
+# 0xff 不会出现在 protobuf（wire type 7 不存在）、utf-8 json 和 pickle（0x80 开头）的首字节，
+# 再加 2 字节固定值，和旧值区分不依赖单个字节的取值
+MAGIC = b'\xffIC'
+HEADER_VERSION = 0
+HEADER_SIZE = len(MAGIC) + 1
+
+CODEC_IDS = {'protobuf': 0, 'msgpack': 1, 'json': 2}
+COMPRESSION_IDS = {None: 0, 'zstd': 1, 'lz4': 2}
+
+
+class ProtobufCodec(object):
+    name = 'protobuf'
+
+    def __init__(self, item_class=ItemDoc):
+        self.item_class = item_class
+
+    def dumps(self, item):
+        return item.SerializeToString()
+
+    def loads(self, data):
+        return self.item_class.FromString(data)
+
+
+class MsgpackCodec(ProtobufCodec):
+    name = 'msgpack'
+
+    def dumps(self, item):
+        return msgpack.packb(MessageToDict(item, preserving_proto_field_name=True), use_bin_type=True)
+
+    def loads(self, data):
+        return ParseDict(msgpack.unpackb(data, raw=False), self.item_class())
+
+
+class JsonCodec(ProtobufCodec):
+    name = 'json'
+
+    def dumps(self, item):
+        return json.dumps(
+            MessageToDict(item, preserving_proto_field_name=True), ensure_ascii=False, separators=(',', ':')
+        ).encode('utf-8')
+
+    def loads(self, data):
+        return ParseDict(json.loads(data), self.item_class())
+
+
+CODECS = {codec.name: codec for codec in (ProtobufCodec, MsgpackCodec, JsonCodec)}
+
+
+class ItemCodec(object):
+    """
+    @summary: 缓存值编码，MAGIC 之后 1 字节记录版本、codec 和压缩算法，超过 compress_threshold 字节的值压缩；
+    解码时根据头部选择 codec，因此不同配置写入的值可以共存
+    """
+
+    def __init__(self, codec='protobuf', compression='zstd', compress_threshold=1024, compress_level=3,
+                 item_class=ItemDoc):
+        if codec == 'msgpack' and msgpack is None:
+            raise RuntimeError('msgpack codec requires the msgpack package')
+        if compression == 'zstd' and zstandard is None:
+            raise RuntimeError('zstd compression requires the zstandard package')
+        if compression == 'lz4' and lz4_frame is None:
+            raise RuntimeError('lz4 compression requires the lz4 package')
+        self.codecs = {CODEC_IDS[name]: codec_class(item_class) for name, codec_class in CODECS.items()}
+        self.codec_id = CODEC_IDS[codec]
+        self.compression_id = COMPRESSION_IDS[compression]
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+        self._zstd_compressor = zstandard.ZstdCompressor(level=compress_level) if zstandard else None
+        self._zstd_decompressor = zstandard.ZstdDecompressor() if zstandard else None
+
+    @staticmethod
+    def make_header(codec_id, compression_id):
+        return MAGIC + bytes(((HEADER_VERSION << 7) | (codec_id << 5) | (compression_id << 3),))
+
+    @staticmethod
+    def is_encoded(data):
+        return len(data) >= HEADER_SIZE and data.startswith(MAGIC) and data[len(MAGIC)] >> 7 == HEADER_VERSION
+
+    def _compress(self, compression_id, body):
+        if compression_id == COMPRESSION_IDS['zstd']:
+            return self._zstd_compressor.compress(body)
+        return lz4_frame.compress(body, compression_level=self.compress_level)
+
+    def _decompress(self, compression_id, body):
+        if compression_id == COMPRESSION_IDS['zstd']:
+            return self._zstd_decompressor.decompress(body)
+        if compression_id == COMPRESSION_IDS['lz4']:
+            return lz4_frame.decompress(body)
+        return body
+
+    def encode(self, item):
+        body = self.codecs[self.codec_id].dumps(item)
+        compression_id = 0
+        if self.compression_id and len(body) > self.compress_threshold:
+            compression_id = self.compression_id
+            body = self._compress(compression_id, body)
+        return self.make_header(self.codec_id, compression_id) + body
+
+    def decode(self, data):
+        header = data[len(MAGIC)]
+        codec_id = (header >> 5) & 0b11
+        compression_id = (header >> 3) & 0b11
+        body = self._decompress(compression_id, data[HEADER_SIZE:])
+        return self.codecs[codec_id].loads(body)
+
+
+def build_codec(codec=None, codec_compression='zstd', codec_compress_threshold=1024, **kwargs):
+    """
+    @summary: codec 为 None 时返回 None，CacheBase 沿用 dump_item/load_item
+    """
+    if codec is None:
+        return None
+    return ItemCodec(codec=codec, compression=codec_compression, compress_threshold=codec_compress_threshold)
@@ -0,0 +1,44 @@
+import bisect
+
+from cityhash import CityHash64
+
+
+class HashRing(object):
+    """
+    @summary: 带虚拟节点的一致性哈希环，增删一个节点时只有约 1/N 的 key 会迁移
+    """
+
+    def __init__(self, nodes=(), vnodes=160):
+        self.vnodes = vnodes
+        self._hashes = []
+        self._nodes = []
+        for node in nodes:
+            self.add_node(node)
+
+    @staticmethod
+    def hash_key(key):
+        return CityHash64(key)
+
+    def add_node(self, node):
+        for index in range(self.vnodes):
+            vnode_hash = self.hash_key(f'{node}#{index}')
+            position = bisect.bisect(self._hashes, vnode_hash)
+            self._hashes.insert(position, vnode_hash)
+            self._nodes.insert(position, node)
+
+    def remove_node(self, node):
+        ring = [(_hash, _node) for _hash, _node in zip(self._hashes, self._nodes) if _node != node]
+        self._hashes = [_hash for _hash, _ in ring]
+        self._nodes = [_node for _, _node in ring]
+
+    @property
+    def nodes(self):
+        return sorted(set(self._nodes))
+
+    def get_node(self, key):
+        if not self._hashes:
+            raise ValueError('hash ring is empty')
+        position = bisect.bisect(self._hashes, self.hash_key(key))
+        if position == len(self._hashes):
+            position = 0
+        return self._nodes[position]
@@ -0,0 +1,25 @@
+from cacheout import LFUCache
+
+from item_store.core import MemoryCache
+
+from .shm_cache import SharedMemoryCache
+from .tinylfu import TinyLFUCache
+
+
+def build_memory_cache(l1_backend='memory', l1_maxsize=10000, l1_ttl=60, l1_shm_name='pic_web_l1',
+                       l1_shm_size_bytes=256 * 1024 * 1024, l1_shm_slot_size=4096, l1_max_bytes=64 * 1024 * 1024,
+                       **kwargs):
+    """
+    @summary: 按配置创建 CacheBase.cache_memory，memory 为进程内 LFU，shm 为同机多 worker 共享的 SharedMemoryCache，
+    tinylfu 为按字节预算的进程内 W-TinyLFU
+    """
+    if l1_backend == 'tinylfu':
+        return TinyLFUCache(max_bytes=l1_max_bytes, ttl=l1_ttl)
+    if l1_backend == 'shm':
+        return SharedMemoryCache(
+            name=l1_shm_name,
+            size_bytes=l1_shm_size_bytes,
+            slot_size=l1_shm_slot_size,
+            ttl=l1_ttl,
+        )
+    return MemoryCache(LFUCache(maxsize=l1_maxsize, ttl=l1_ttl))
@@ -0,0 +1,172 @@
+import asyncio
+import logging
+from collections import defaultdict
+
+from src.utils.metrics import Histogram, series
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+
+
+class RedisBatchLoader(object):
+    """
+    @summary: 合并同一 worker 内并发请求的 redis 读写：同一个事件循环 tick（max_wait 为 0）或 max_wait 秒内的
+    key 去重后合并为一次 mget_func，写入合并为一次 mset_func，按调用方拆分结果；凑满 max_batch_size 立即发送。
+    还没写完的 key 直接从待写入的值读取，不读 redis 中的旧值
+    """
+
+    def __init__(self, mget_func, mset_func, max_batch_size=500, max_wait=0.001):
+        self.mget_func = mget_func  # async (cache_keys) -> values，与 cache_keys 顺序一致，不存在为 None
+        self.mset_func = mset_func  # async ({cache_key: value}) -> bool
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.counters = defaultdict(int)
+        self.batch_sizes = {'get': Histogram(buckets=BATCH_SIZE_BUCKETS), 'set': Histogram(buckets=BATCH_SIZE_BUCKETS)}
+        self._pending_gets = {}  # cache_key -> future
+        self._pending_sets = {}  # cache_key -> value，同一批内后写覆盖先写
+        self._set_future = None  # 当前写入批次的 future，批内所有调用方共享
+        self._writing = {}  # cache_key -> 已发出、还没完成的写入的值
+        self._handles = {}
+        self._tasks = set()
+
+    def _schedule(self, kind):
+        if self._handles.get(kind) is not None:
+            return
+        loop = asyncio.get_running_loop()
+        flush = self._flush_gets if kind == 'get' else self._flush_sets
+        if self.max_wait <= 0:
+            self._handles[kind] = loop.call_soon(flush)
+        else:
+            self._handles[kind] = loop.call_later(self.max_wait, flush)
+
+    def _cancel_handle(self, kind):
+        handle = self._handles.pop(kind, None)
+        if handle is not None:
+            handle.cancel()
+
+    def _start(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _flush_gets(self):
+        self._cancel_handle('get')
+        if self._pending_gets:
+            pending, self._pending_gets = self._pending_gets, {}
+            self._start(self._run_gets(pending))
+
+    def _flush_sets(self):
+        self._cancel_handle('set')
+        if self._pending_sets:
+            pending, future = self._pending_sets, self._set_future
+            self._pending_sets, self._set_future = {}, None
+            self._writing.update(pending)
+            self._start(self._run_sets(pending, future))
+
+    async def _run_gets(self, pending):
+        self.counters['get_batches'] += 1
+        self.batch_sizes['get'].observe(len(pending))
+        try:
+            values = await self.mget_func(list(pending))
+        except Exception as e:
+            self.counters['get_errors'] += 1
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future, value in zip(pending.values(), values):
+            if not future.done():
+                future.set_result(value)
+
+    async def _run_sets(self, pending, future):
+        self.counters['set_batches'] += 1
+        self.batch_sizes['set'].observe(len(pending))
+        try:
+            state = await self.mset_func(pending)
+        except Exception as e:
+            self.counters['set_errors'] += 1
+            if not future.done():
+                future.set_exception(e)
+            return
+        finally:
+            for cache_key, value in pending.items():
+                if self._writing.get(cache_key) is value:
+                    del self._writing[cache_key]
+        if not future.done():
+            future.set_result(state)
+
+    @staticmethod
+    async def _wait(futures):
+        # 只等待不取消：某个调用方被取消时，同批次其他调用方仍能拿到结果
+        if futures:
+            await asyncio.wait(set(futures))
+        return [future.result() for future in futures]
+
+    async def mget(self, cache_keys):
+        loop = asyncio.get_running_loop()
+        futures = []
+        for cache_key in cache_keys:
+            value = self._pending_sets.get(cache_key, self._writing.get(cache_key))
+            if value is not None:
+                future = loop.create_future()
+                future.set_result(value)
+                futures.append(future)
+                self.counters['get_from_pending_set'] += 1
+                continue
+            future = self._pending_gets.get(cache_key)
+            if future is None:
+                future = self._pending_gets[cache_key] = loop.create_future()
+                if len(self._pending_gets) >= self.max_batch_size:
+                    self._flush_gets()
+            else:
+                self.counters['get_deduplicated'] += 1
+            futures.append(future)
+        self.counters['get_calls'] += 1
+        self.counters['get_keys'] += len(cache_keys)
+        if self._pending_gets:
+            self._schedule('get')
+        return await self._wait(futures)
+
+    async def mset(self, cache_items):
+        loop = asyncio.get_running_loop()
+        futures = []
+        for cache_key, value in cache_items.items():
+            if self._set_future is None:
+                self._set_future = loop.create_future()
+            if not futures or futures[-1] is not self._set_future:
+                futures.append(self._set_future)
+            self._pending_sets[cache_key] = value
+            if len(self._pending_sets) >= self.max_batch_size:
+                self._flush_sets()
+        self.counters['set_calls'] += 1
+        self.counters['set_keys'] += len(cache_items)
+        if self._pending_sets:
+            self._schedule('set')
+        return all(await self._wait(futures))
+
+    def discard(self, cache_keys):
+        """
+        @summary: 丢弃还没发出的写入，delete 之前调用，避免排队中的旧值在 delete 之后写回 redis
+        """
+        for cache_key in cache_keys:
+            self._pending_sets.pop(cache_key, None)
+            self._writing.pop(cache_key, None)
+
+    def collect(self, cache_name):
+        return {
+            'counters': {
+                series('redis_batch_total', cache=cache_name, event=event): value
+                for event, value in list(self.counters.items())
+            },
+            'histograms': {
+                series('redis_batch_size', cache=cache_name, kind=kind): histogram.snapshot()
+                for kind, histogram in self.batch_sizes.items()
+            },
+        }
+
+    async def close(self):
+        self._flush_gets()
+        self._flush_sets()
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
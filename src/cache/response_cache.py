@@ -0,0 +1,130 @@
+import asyncio
+import functools
+import hashlib
+import inspect
+import json
+import logging
+
+from fastapi.encoders import jsonable_encoder
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import Response
+
+from .aioredis_cache import RedisCache
+from .memory import build_memory_cache
+
+logger = logging.getLogger(__name__)
+
+
+class CachedResponse(object):
+    __slots__ = ('item_type', 'item_id', 'body', 'etag')
+
+    def __init__(self, item_type, item_id, body=b'', etag=''):
+        self.item_type = item_type
+        self.item_id = item_id
+        self.body = body
+        self.etag = etag
+
+
+class ResponseCache(RedisCache):
+    """
+    @summary: 路由响应缓存，复用 CacheBase 的两级缓存（独立的进程内 LFU + redis），每个路由一个实例以便单独设置 TTL
+    """
+    cache_key_format = 'response_cache:{item_type}:{item_id}'
+    cache_memory = build_memory_cache(l1_backend='memory', l1_maxsize=2000, l1_ttl=60)
+    codec = None
+    refresh_ttl_on_hit = False  # 响应按写入时间过期，命中不续期
+
+    def __init__(self, cache_ttl, **kwargs):
+        super().__init__(**kwargs)
+        self.cache_ttl = cache_ttl
+
+    def dump_item(self, item):
+        header = json.dumps({'item_type': item.item_type, 'item_id': item.item_id, 'etag': item.etag})
+        return header.encode('utf-8') + b'\n' + item.body
+
+    def load_item(self, data):
+        header, _, body = data.partition(b'\n')
+        return CachedResponse(body=body, **json.loads(header))
+
+
+def gen_response_cache_id(params):
+    normalized = json.dumps(jsonable_encoder(params), sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    candidates = [candidate.strip() for candidate in if_none_match.split(',')]
+    return etag in candidates or f'W/{etag}' in candidates
+
+
+def response_cache(ttl=300, cache_control=None):
+    """
+    @summary: 路由响应缓存装饰器，放在 @router.get/post 之下；按路由模板 + 参数的规范化哈希缓存 JSON 响应，
+    返回 ETag，请求带匹配的 If-None-Match 时返回 304；同一个 key 的并发未命中只执行一次 handler
+    """
+    cache_control = cache_control or f'max-age={ttl}'
+
+    def decorator(func):
+        signature = inspect.signature(func)
+        request_param = next(
+            (name for name, param in signature.parameters.items() if param.annotation is Request), None)
+        inject_request = request_param is None
+        if inject_request:
+            request_param = '_response_cache_request'
+            parameters = list(signature.parameters.values())
+            parameters.append(inspect.Parameter(request_param, inspect.Parameter.KEYWORD_ONLY, annotation=Request))
+            signature = signature.replace(parameters=parameters)
+        cache = ResponseCache(cache_ttl=ttl)
+        pending = {}
+
+        async def _call(kwargs):
+            if inspect.iscoroutinefunction(func):
+                return await func(**kwargs)
+            return await run_in_threadpool(func, **kwargs)
+
+        async def _generate(route, item_id, kwargs):
+            result = await _call(kwargs)
+            if isinstance(result, Response):
+                return result
+            body = json.dumps(
+                jsonable_encoder(result), ensure_ascii=False, allow_nan=False, separators=(',', ':')
+            ).encode('utf-8')
+            etag = '"{0}"'.format(hashlib.sha1(body).hexdigest())
+            cached = CachedResponse(route, item_id, body, etag)
+            asyncio.create_task(cache.save([cached]))
+            return cached
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            request = kwargs.pop(request_param) if inject_request else kwargs[request_param]
+            route = getattr(request.scope.get('route'), 'path', None) or request.url.path
+            params = {name: value for name, value in kwargs.items() if name != request_param}
+            item_id = gen_response_cache_id(params)
+            cached_items = await cache.get([CachedResponse(route, item_id)])
+            cache_status = 'HIT'
+            if cached_items:
+                cached = cached_items[0]
+            else:
+                cache_status = 'MISS'
+                future = pending.get(item_id)
+                if future is None:
+                    future = pending[item_id] = asyncio.ensure_future(_generate(route, item_id, kwargs))
+                    future.add_done_callback(lambda _: pending.pop(item_id, None))
+                cached = await asyncio.shield(future)
+                if isinstance(cached, Response):
+                    return cached
+            headers = {'ETag': cached.etag, 'Cache-Control': cache_control, 'X-Cache': cache_status}
+            if etag_matches(request.headers.get('if-none-match'), cached.etag):
+                return Response(status_code=304, headers=headers)
+            return Response(content=cached.body, media_type='application/json', headers=headers)
+
+        wrapper.__signature__ = signature
+        wrapper.response_cache = cache
+        return wrapper
+
+    return decorator
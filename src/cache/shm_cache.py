@@ -0,0 +1,231 @@
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from src.utils.metrics import series
+
+logger = logging.getLogger(__name__)
+
+_FILE_HEADER = struct.Struct('<8sIII')  # magic, slot_count, slot_size, ways
+_FILE_HEADER_SIZE = 64
+_MAGIC = b'PWSHM001'
+# seq, key_hash, expire_at, accessed_at, key_len, value_len
+_SLOT_HEADER = struct.Struct('<IQddHI')
+_SEQ = struct.Struct('<I')
+_DOUBLE = struct.Struct('<d')
+_ACCESSED_AT_OFFSET = 20
+
+
+def default_key_func(item):
+    return f'{item.item_type}:{item.item_id}'
+
+
+class SharedMemoryCache(object):
+    """
+    @summary: 同一台机器上多个 worker 进程共享的 L1 缓存，与 MemoryCache 接口一致
+    数据存放在 mmap 文件（默认 /dev/shm）中的组相联哈希表里，总字节数固定为 slot_count * slot_size；
+    读路径无锁（seqlock 校验，读到写入中的数据时重试），写路径按组分段加锁（进程内线程锁 + fcntl 文件区间锁），
+    组内满时淘汰最久未访问的条目，单个条目超过 slot_size 时不缓存。
+    文件名带上布局（slot_size、ways、总字节数），布局不同的配置使用不同的文件，不会清空其他 worker 正在使用的文件
+    """
+
+    def __init__(self, name='pic_web_l1', size_bytes=256 * 1024 * 1024, slot_size=4096, ways=8, ttl=60,
+                 lock_stripes=1024, key_func=default_key_func, dump_func=pickle.dumps, load_func=pickle.loads,
+                 directory=None):
+        self.slot_size = slot_size
+        self.ways = ways
+        self.set_count = max(size_bytes // (slot_size * ways), 1)
+        self.slot_count = self.set_count * ways
+        self.ttl = ttl
+        self.lock_stripes = lock_stripes
+        self.key_func = key_func
+        self.dump_func = dump_func
+        self.load_func = load_func
+        self.max_payload = slot_size - _SLOT_HEADER.size
+        directory = directory or ('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir())
+        self.size = _FILE_HEADER_SIZE + self.slot_count * self.slot_size
+        self.path = os.path.join(directory, f'{name}.{slot_size}.{ways}.{self.size}')
+        self.counters = defaultdict(int)
+        self._thread_locks = [threading.Lock() for _ in range(lock_stripes)]
+        self._pid = None
+        self._fd = None
+        self._mm = None
+
+    def _ensure_open(self):
+        if self._pid == os.getpid():
+            return self._mm
+        size = self.size
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(fd, fcntl.LOCK_EX)
+        try:
+            expected = _FILE_HEADER.pack(_MAGIC, self.slot_count, self.slot_size, self.ways)
+            if os.fstat(fd).st_size == 0:
+                os.ftruncate(fd, size)
+                os.pwrite(fd, expected, 0)
+            elif os.pread(fd, _FILE_HEADER.size, 0) != expected or os.fstat(fd).st_size != size:
+                # 不清空重建：其他 worker 可能正在使用这个文件
+                raise ValueError(f'shared memory cache {self.path} has an incompatible layout, remove it and restart')
+        except Exception:
+            os.close(fd)
+            raise
+        fcntl.lockf(fd, fcntl.LOCK_UN)
+        self._mm = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        self._fd = fd
+        self._pid = os.getpid()
+        return self._mm
+
+    def _locate(self, key):
+        key_bytes = key.encode('utf-8')
+        key_hash = int.from_bytes(hashlib.blake2b(key_bytes, digest_size=8).digest(), 'little')
+        set_index = key_hash % self.set_count
+        return key_bytes, key_hash, set_index
+
+    def _slot_offsets(self, set_index):
+        first_offset = _FILE_HEADER_SIZE + set_index * self.ways * self.slot_size
+        return range(first_offset, first_offset + self.ways * self.slot_size, self.slot_size)
+
+    def _lock(self, set_index):
+        stripe = set_index % self.lock_stripes
+        thread_lock = self._thread_locks[stripe]
+        thread_lock.acquire()
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, _FILE_HEADER_SIZE + stripe)
+        except Exception:
+            thread_lock.release()
+            raise
+        return stripe
+
+    def _unlock(self, stripe):
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, _FILE_HEADER_SIZE + stripe)
+        finally:
+            self._thread_locks[stripe].release()
+
+    def _get(self, mm, key, now):
+        key_bytes, key_hash, set_index = self._locate(key)
+        for offset in self._slot_offsets(set_index):
+            for _ in range(3):
+                seq, slot_hash, expire_at, _accessed_at, key_len, value_len = _SLOT_HEADER.unpack_from(mm, offset)
+                if seq & 1:
+                    continue
+                if slot_hash != key_hash or expire_at <= now:
+                    break
+                data_offset = offset + _SLOT_HEADER.size
+                data = mm[data_offset:data_offset + key_len + value_len]
+                if _SEQ.unpack_from(mm, offset)[0] != seq:
+                    continue
+                if data[:key_len] != key_bytes:
+                    break
+                _DOUBLE.pack_into(mm, offset + _ACCESSED_AT_OFFSET, now)
+                return data[key_len:]
+        return None
+
+    def _set(self, mm, key, value, now, only_add=False):
+        key_bytes, key_hash, set_index = self._locate(key)
+        if len(key_bytes) + len(value) > self.max_payload:
+            self.counters['oversize'] += 1
+            return False
+        stripe = self._lock(set_index)
+        try:
+            target = None
+            target_score = None
+            target_live = False
+            for offset in self._slot_offsets(set_index):
+                seq, slot_hash, expire_at, accessed_at, key_len, value_len = _SLOT_HEADER.unpack_from(mm, offset)
+                live = expire_at > now
+                if live and slot_hash == key_hash:
+                    data_offset = offset + _SLOT_HEADER.size
+                    if mm[data_offset:data_offset + key_len] == key_bytes:
+                        if only_add:
+                            return False
+                        target, target_live = offset, False
+                        break
+                score = accessed_at if live else -1.0
+                if target is None or score < target_score:
+                    target, target_score, target_live = offset, score, live
+            if target_live:
+                self.counters['evictions'] += 1
+            seq = _SEQ.unpack_from(mm, target)[0]
+            _SEQ.pack_into(mm, target, seq + 1)
+            data_offset = target + _SLOT_HEADER.size
+            mm[data_offset:data_offset + len(key_bytes) + len(value)] = key_bytes + value
+            _SLOT_HEADER.pack_into(mm, target, seq + 1, key_hash, now + self.ttl, now, len(key_bytes), len(value))
+            _SEQ.pack_into(mm, target, seq + 2)
+            return True
+        finally:
+            self._unlock(stripe)
+
+    def _delete(self, mm, key):
+        key_bytes, key_hash, set_index = self._locate(key)
+        stripe = self._lock(set_index)
+        try:
+            for offset in self._slot_offsets(set_index):
+                seq, slot_hash, expire_at, accessed_at, key_len, value_len = _SLOT_HEADER.unpack_from(mm, offset)
+                data_offset = offset + _SLOT_HEADER.size
+                if slot_hash == key_hash and mm[data_offset:data_offset + key_len] == key_bytes:
+                    _SEQ.pack_into(mm, offset, seq + 1)
+                    _SLOT_HEADER.pack_into(mm, offset, seq + 1, 0, 0.0, 0.0, 0, 0)
+                    _SEQ.pack_into(mm, offset, seq + 2)
+                    return True
+            return False
+        finally:
+            self._unlock(stripe)
+
+    def get_many_items(self, items):
+        mm = self._ensure_open()
+        now = time.time()
+        result = []
+        for item in items:
+            value = self._get(mm, self.key_func(item), now)
+            if value is None:
+                self.counters['misses'] += 1
+                continue
+            self.counters['hits'] += 1
+            result.append(self.load_func(value))
+        return result
+
+    def set_many_items(self, items):
+        mm = self._ensure_open()
+        now = time.time()
+        for item in items:
+            if self._set(mm, self.key_func(item), self.dump_func(item), now):
+                self.counters['sets'] += 1
+
+    def add_many_items(self, items):
+        mm = self._ensure_open()
+        now = time.time()
+        for item in items:
+            if self._set(mm, self.key_func(item), self.dump_func(item), now, only_add=True):
+                self.counters['sets'] += 1
+
+    def delete_many_items(self, items):
+        mm = self._ensure_open()
+        for item in items:
+            if self._delete(mm, self.key_func(item)):
+                self.counters['deletes'] += 1
+
+    def snapshot(self):
+        return dict(
+            path=self.path,
+            slot_count=self.slot_count,
+            slot_size=self.slot_size,
+            size_bytes=self.slot_count * self.slot_size,
+            **self.counters,
+        )
+
+    def collect(self):
+        # 容量是同机 worker 共享的，多个 worker 的快照相加，只导出本进程的计数
+        return {
+            'counters': {
+                series('cache_l1_total', backend='shm', event=event): value
+                for event, value in list(self.counters.items())
+            },
+        }
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+
+from cacheout import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class StaleRefresher(object):
+    """
+    @summary: 每个 worker 一个的 L1 软过期刷新器。记录 key 进入 L1 的时间，L1 命中时：
+    超过 soft_ttl（硬过期仍是 L1 的 ttl）的 key 照常返回旧值，同时在后台刷新；
+    访问频率不低于 refresh_ahead_rate 次/秒的热 key 在 soft_ttl * refresh_ahead_ratio 之后提前刷新。
+    同一个 key 同时只有一个后台刷新，刷新通过 loader 回源后 save（loader 没有返回的 item 被 delete），没有 loader 时从 redis 重新读取写入 L1
+    """
+
+    def __init__(self, cache, soft_ttl=45, hard_ttl=60, refresh_ahead_rate=5.0, refresh_ahead_ratio=0.5,
+                 retry_interval=1.0, max_tracked_keys=100000):
+        self.cache = cache
+        self.soft_ttl = soft_ttl
+        self.retry_interval = retry_interval  # 刷新失败的 key 在该时间内不再刷新，继续返回旧值
+        self.refresh_ahead_rate = refresh_ahead_rate  # None 表示不提前刷新
+        self.refresh_ahead_ratio = refresh_ahead_ratio
+        self.loader = None  # async (items) -> 回源得到的 items，未返回的 item 视为已不存在
+        self.counters = defaultdict(int)
+        # cache_key -> [进入 L1 的时间, 之后的访问次数]
+        self._entries = LRUCache(maxsize=max_tracked_keys, ttl=hard_ttl)
+        self._refreshing = set()
+        self._tasks = set()
+
+    def mark_loaded(self, items):
+        now = time.monotonic()
+        for item in items:
+            self._entries.set(self.cache.get_cache_key(item=item), [now, 0])
+
+    def should_refresh(self, entry, now):
+        elapsed = now - entry[0]
+        if elapsed >= self.soft_ttl:
+            return 'stale'
+        if self.refresh_ahead_rate is None or elapsed <= 0 or elapsed < self.soft_ttl * self.refresh_ahead_ratio:
+            return None
+        return 'ahead' if entry[1] / elapsed >= self.refresh_ahead_rate else None
+
+    def touch(self, items):
+        """
+        @summary: L1 命中的 item，需要刷新的 key 合并到一个后台任务中
+        """
+        now = time.monotonic()
+        refresh_items = []
+        for item in items:
+            cache_key = self.cache.get_cache_key(item=item)
+            entry = self._entries.get(cache_key)
+            if entry is None:
+                # 预热等途径进入 L1 的 key 从现在开始计时
+                self._entries.set(cache_key, [now, 0])
+                continue
+            entry[1] += 1
+            if cache_key in self._refreshing:
+                continue
+            reason = self.should_refresh(entry, now)
+            if reason is None:
+                continue
+            self.counters[f'refresh_{reason}'] += 1
+            self._refreshing.add(cache_key)
+            refresh_items.append(item)
+        if refresh_items:
+            task = asyncio.get_running_loop().create_task(self.refresh(refresh_items))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def refresh(self, items):
+        cache_keys = [self.cache.get_cache_key(item=item) for item in items]
+        failed = False
+        try:
+            if self.loader is not None:
+                loaded_items = await self.cache.run_async_func(self.loader, items)
+                loaded_uniq_ids = self.cache.get_items_uniq_ids(items=loaded_items)
+                gone_items = [item for item in items if self.cache.get_item_uniq_id(item) not in loaded_uniq_ids]
+                if loaded_items:
+                    await self.cache.save(loaded_items)
+                if gone_items:
+                    await self.cache.delete(gone_items)
+                    self.counters['refresh_gone'] += len(gone_items)
+            else:
+                started = time.monotonic()
+                loaded_items = await self.cache.run_async_func(self.cache.get_cache, items)
+                if loaded_items:
+                    memory_items = (
+                        self.cache.filter_invalidated(loaded_items, started)
+                        if self.cache.invalidation_enabled else loaded_items)
+                    await self.cache.run_async_func(self.cache.cache_memory.set_many_items, memory_items)
+                    self.mark_loaded(memory_items)
+                loaded_uniq_ids = self.cache.get_items_uniq_ids(items=loaded_items)
+                missing_items = [item for item in items if self.cache.get_item_uniq_id(item) not in loaded_uniq_ids]
+                if missing_items:
+                    # redis 中已过期或被删除，L1 的旧值保留到硬过期，期间不再反复刷新
+                    self.mark_loaded(missing_items)
+                    self.counters['refresh_missing'] += len(missing_items)
+            self.counters['refreshed'] += len(loaded_items)
+        except Exception as e:
+            failed = True
+            self.counters['refresh_errors'] += 1
+            logger.error(f'cache_stale_refresh_error {e=} keys={len(items)}')
+        finally:
+            if failed:
+                asyncio.get_running_loop().call_later(
+                    self.retry_interval, self._refreshing.difference_update, cache_keys)
+            else:
+                self._refreshing.difference_update(cache_keys)
+
+    async def close(self):
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
@@ -0,0 +1,255 @@
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict, defaultdict
+
+from src.utils.metrics import series
+from .shm_cache import default_key_func
+
+_MASK64 = (1 << 64) - 1
+_SKETCH_SEEDS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0x27D4EB2F165667C5)
+ENTRY_OVERHEAD = 120  # 每个条目的 OrderedDict 节点、key 字符串等固定开销估算，字节
+
+
+def default_size_func(item):
+    byte_size = getattr(item, 'ByteSize', None)
+    return (byte_size() if byte_size is not None else sys.getsizeof(item)) + ENTRY_OVERHEAD
+
+
+class CountMinSketch(object):
+    """
+    @summary: 4 行 4-bit 语义（上限 15）的 count-min sketch，累计 sample_size 次计数后所有计数减半（aging），
+    让过去热门但已不再访问的 key 频率逐渐衰减
+    """
+
+    def __init__(self, width, sample_factor=10):
+        width = max(width, 16)
+        self.bits = (width - 1).bit_length()
+        self.width = 1 << self.bits
+        self.rows = [array('B', bytes(self.width)) for _ in _SKETCH_SEEDS]
+        self.sample_size = self.width * sample_factor
+        self.additions = 0
+        self.resets = 0
+
+    def _indexes(self, key):
+        key_hash = hash(key) & _MASK64
+        shift = 64 - self.bits
+        return [((key_hash * seed) & _MASK64) >> shift for seed in _SKETCH_SEEDS]
+
+    def increment(self, key):
+        for row, index in zip(self.rows, self._indexes(key)):
+            if row[index] < 15:
+                row[index] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.reset()
+
+    def estimate(self, key):
+        return min(row[index] for row, index in zip(self.rows, self._indexes(key)))
+
+    def reset(self):
+        for row in self.rows:
+            row[:] = array('B', bytes(count >> 1 for count in row))
+        self.additions //= 2
+        self.resets += 1
+
+
+class _Entry(object):
+    __slots__ = ('item', 'size', 'expire_at')
+
+    def __init__(self, item, size, expire_at):
+        self.item = item
+        self.size = size
+        self.expire_at = expire_at
+
+
+class TinyLFUCache(object):
+    """
+    @summary: 按字节预算的 W-TinyLFU L1 缓存，与 MemoryCache 接口一致
+    新条目先进入 window LRU（max_bytes * window_ratio），被挤出 window 时与 main SLRU 的淘汰候选比较
+    count-min sketch 估算的访问频率，频率更高才准入，否则丢弃；main 中再次命中的条目从 probation 晋升到 protected
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=60, window_ratio=0.01, protected_ratio=0.8,
+                 expected_items=None, key_func=default_key_func, size_func=default_size_func):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.window_max = max(int(max_bytes * window_ratio), 1)
+        self.main_max = max_bytes - self.window_max
+        self.protected_max = int(self.main_max * protected_ratio)
+        self.key_func = key_func
+        self.size_func = size_func
+        # sketch 宽度按预计条目数估算，默认按每个条目 1KB
+        self.sketch = CountMinSketch(expected_items or max(max_bytes // 1024, 1024))
+        self.window = OrderedDict()
+        self.probation = OrderedDict()
+        self.protected = OrderedDict()
+        self.window_bytes = 0
+        self.probation_bytes = 0
+        self.protected_bytes = 0
+        self.counters = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.window) + len(self.probation) + len(self.protected)
+
+    @property
+    def used_bytes(self):
+        return self.window_bytes + self.probation_bytes + self.protected_bytes
+
+    def _pop(self, key):
+        for segment, attr in ((self.window, 'window_bytes'), (self.probation, 'probation_bytes'),
+                              (self.protected, 'protected_bytes')):
+            entry = segment.pop(key, None)
+            if entry is not None:
+                setattr(self, attr, getattr(self, attr) - entry.size)
+                return entry
+        return None
+
+    def _get(self, key, now):
+        self.sketch.increment(key)
+        entry = self.window.get(key)
+        if entry is not None:
+            if entry.expire_at <= now:
+                return self._expire(key)
+            self.window.move_to_end(key)
+            return entry.item
+        entry = self.protected.get(key)
+        if entry is not None:
+            if entry.expire_at <= now:
+                return self._expire(key)
+            self.protected.move_to_end(key)
+            return entry.item
+        entry = self.probation.pop(key, None)
+        if entry is None:
+            return None
+        self.probation_bytes -= entry.size
+        if entry.expire_at <= now:
+            self.counters['expirations'] += 1
+            return None
+        # probation 再次命中，晋升到 protected，protected 超出预算时把最旧的降级回 probation
+        self.protected[key] = entry
+        self.protected_bytes += entry.size
+        while self.protected_bytes > self.protected_max and len(self.protected) > 1:
+            demoted_key, demoted = self.protected.popitem(last=False)
+            self.protected_bytes -= demoted.size
+            self.probation[demoted_key] = demoted
+            self.probation_bytes += demoted.size
+        return entry.item
+
+    def _expire(self, key):
+        self._pop(key)
+        self.counters['expirations'] += 1
+        return None
+
+    def _main_victim(self):
+        if self.probation:
+            return next(iter(self.probation)), self.probation, 'probation_bytes'
+        if self.protected:
+            return next(iter(self.protected)), self.protected, 'protected_bytes'
+        return None, None, None
+
+    def _admit(self, key, entry, now):
+        """
+        @summary: window 挤出的候选条目按频率与 main 的淘汰候选比较，腾出足够空间后放入 probation
+        """
+        if entry.size > self.main_max:
+            self.counters['admission_rejects'] += 1
+            return False
+        candidate_freq = self.sketch.estimate(key)
+        while self.probation_bytes + self.protected_bytes + entry.size > self.main_max:
+            victim_key, segment, attr = self._main_victim()
+            victim = segment[victim_key]
+            if victim.expire_at > now and self.sketch.estimate(victim_key) >= candidate_freq:
+                self.counters['admission_rejects'] += 1
+                return False
+            del segment[victim_key]
+            setattr(self, attr, getattr(self, attr) - victim.size)
+            self.counters['evictions'] += 1
+        self.probation[key] = entry
+        self.probation_bytes += entry.size
+        return True
+
+    def _set(self, key, item, now, only_add=False):
+        if only_add:
+            existing = self.window.get(key) or self.protected.get(key) or self.probation.get(key)
+            if existing is not None and existing.expire_at > now:
+                return False
+        self.sketch.increment(key)
+        self._pop(key)
+        entry = _Entry(item, self.size_func(item), now + self.ttl)
+        if entry.size > self.window_max:
+            # 比整个 window 还大的条目直接参与准入比较
+            return self._admit(key, entry, now)
+        self.window[key] = entry
+        self.window_bytes += entry.size
+        while self.window_bytes > self.window_max:
+            candidate_key, candidate = self.window.popitem(last=False)
+            self.window_bytes -= candidate.size
+            self._admit(candidate_key, candidate, now)
+        return True
+
+    def get_many_items(self, items):
+        now = time.time()
+        result = []
+        with self._lock:
+            for item in items:
+                cache_item = self._get(self.key_func(item), now)
+                if cache_item is None:
+                    self.counters['misses'] += 1
+                    continue
+                self.counters['hits'] += 1
+                result.append(cache_item)
+        return result
+
+    def set_many_items(self, items):
+        now = time.time()
+        with self._lock:
+            for item in items:
+                if self._set(self.key_func(item), item, now):
+                    self.counters['sets'] += 1
+
+    def add_many_items(self, items):
+        now = time.time()
+        with self._lock:
+            for item in items:
+                if self._set(self.key_func(item), item, now, only_add=True):
+                    self.counters['sets'] += 1
+
+    def delete_many_items(self, items):
+        with self._lock:
+            for item in items:
+                if self._pop(self.key_func(item)) is not None:
+                    self.counters['deletes'] += 1
+
+    def snapshot(self):
+        return dict(
+            max_bytes=self.max_bytes,
+            used_bytes=self.used_bytes,
+            items=len(self),
+            window_items=len(self.window),
+            probation_items=len(self.probation),
+            protected_items=len(self.protected),
+            sketch_resets=self.sketch.resets,
+            **self.counters,
+        )
+
+    def collect(self):
+        return {
+            'counters': {
+                **{
+                    series('cache_l1_total', backend='tinylfu', event=event): value
+                    for event, value in list(self.counters.items())
+                },
+                series('cache_l1_total', backend='tinylfu', event='sketch_resets'): self.sketch.resets,
+            },
+            'gauges': {
+                series('cache_l1_used_bytes', backend='tinylfu'): self.used_bytes,
+                **{
+                    series('cache_l1_items', backend='tinylfu', segment=segment): len(entries)
+                    for segment, entries in (('window', self.window), ('probation', self.probation),
+                                             ('protected', self.protected))
+                },
+            },
+        }
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import random
+import time
+from collections import defaultdict
+
+from cacheout import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class TTLRefresher(object):
+    """
+    @summary: 每个 worker 一个的后台续期器，收集命中的 key，按时间间隔或数量阈值在一个 pipeline 中批量 EXPIRE；
+    本 worker 最近续期过的 key 会跳过，预估剩余 TTL 低于 cache_ttl * refresh_ratio 后按概率续期
+    """
+
+    def __init__(self, cache, flush_interval=1.0, max_batch_size=500, min_refresh_interval=600,
+                 refresh_ratio=0.5, max_tracked_keys=100000):
+        self.cache = cache
+        self.flush_interval = flush_interval
+        self.max_batch_size = max_batch_size
+        self.min_refresh_interval = min_refresh_interval
+        self.refresh_ratio = refresh_ratio
+        self.counters = defaultdict(int)
+        self._pending = {}
+        self._refreshed = LRUCache(maxsize=max_tracked_keys, ttl=cache.cache_ttl)  # cache_key -> 续期时间
+        self._hits = LRUCache(maxsize=max_tracked_keys)  # cache_key -> (item_type, item_id)，按最近命中排序
+        self._wakeup = None
+        self._task = None
+
+    def should_refresh(self, cache_key, now):
+        refreshed = self._refreshed.get(cache_key)
+        if refreshed is None:
+            return True
+        elapsed = now - refreshed
+        if elapsed < self.min_refresh_interval:
+            return False
+        threshold = self.cache.cache_ttl * self.refresh_ratio
+        remaining = self.cache.cache_ttl - elapsed
+        if remaining > threshold:
+            return False
+        # 剩余时间越少续期概率越高，避免多个 worker 在同一时刻集中续期
+        return random.random() >= remaining / threshold
+
+    def record_hits(self, items):
+        for item in items:
+            self._hits.set(self.cache.get_cache_key(item=item), (item.item_type, item.item_id))
+
+    def touch(self, items):
+        now = time.monotonic()
+        self.record_hits(items)
+        for item in items:
+            cache_key = self.cache.get_cache_key(item=item)
+            self.counters['touched'] += 1
+            if cache_key in self._pending:
+                continue
+            if not self.should_refresh(cache_key, now):
+                self.counters['skipped'] += 1
+                continue
+            self._pending[cache_key] = item
+        if self._pending:
+            self._ensure_task()
+            if len(self._pending) >= self.max_batch_size:
+                self._wakeup.set()
+
+    def mark_refreshed(self, items):
+        now = time.monotonic()
+        for item in items:
+            cache_key = self.cache.get_cache_key(item=item)
+            self._refreshed.set(cache_key, now)
+            self._pending.pop(cache_key, None)
+
+    def hot_items(self, limit=None):
+        """
+        @summary: 本 worker 最近在 L1 / redis 命中的 (item_type, item_id)，最近命中的排在前面，用于保存 L1 预热快照
+        """
+        items = list(reversed(list(self._hits.values())))
+        return items[:limit] if limit else items
+
+    def _ensure_task(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        while self._pending:
+            batch_keys = list(self._pending)[:self.max_batch_size]
+            batch_items = [self._pending.pop(cache_key) for cache_key in batch_keys]
+            try:
+                await self.cache.run_async_func(self.cache.update_cache_ttl, batch_items)
+                self.mark_refreshed(batch_items)
+                self.counters['flushes'] += 1
+                self.counters['refreshed'] += len(batch_items)
+            except Exception as e:
+                self.counters['errors'] += 1
+                logger.error(f'cache_ttl_refresh_error {e=} keys={len(batch_items)}')
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
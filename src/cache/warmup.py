@@ -0,0 +1,42 @@
+import logging
+import os
+
+from item_store.structure.proto_structure.all import ItemDoc
+
+logger = logging.getLogger(__name__)
+
+
+def load_hot_items(path, limit=None):
+    """
+    @summary: 读取热点 key 列表，每行 item_type<TAB>item_id，空行和 # 开头的行忽略；文件不存在时返回空列表
+    """
+    items = []
+    if not path or not os.path.exists(path):
+        return items
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line or line.startswith('#'):
+                continue
+            item_type, sep, item_id = line.partition('\t')
+            if not sep:
+                logger.warning(f'cache_hot_key_invalid {line=} {path=}')
+                continue
+            items.append(ItemDoc(item_type=item_type, item_id=item_id))
+            if limit and len(items) >= limit:
+                break
+    return items
+
+
+def save_hot_items(path, items):
+    """
+    @summary: 与 load_hot_items 相同的格式写入快照，先写临时文件再替换，多个 worker 同时写时保留最后一个
+    @param items: (item_type, item_id) 列表，预热时按 key 重新从 redis 读取
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for item_type, item_id in items:
+            f.write(f'{item_type}\t{item_id}\n')
+    os.replace(tmp_path, path)
+    return len(items)
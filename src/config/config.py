@@ -13,6 +13,9 @@ configuration_dict = {
             "username": "global_algorithm_user",
             "password": "123456",
             "database": "global_algorithm",
+            # 从库列表，未配置的字段继承主库配置，query() 会路由到从库
+            "replicas": [],
+            "replica_strategy": "round_robin",  # round_robin / least_outstanding
         },
         "pic_web_redis": {
             "host": "localhost",
@@ -21,6 +24,12 @@ configuration_dict = {
         },
         "logging_config": {
             "level": "DEBUG",
+            # 后台线程批量格式化和写日志，队列满时丢弃
+            "queue": True,
+            "queue_maxsize": 10000,
+            # 按 logger 名前缀采样 / 限流（条/秒）
+            "sampling": {"src.cache": {"DEBUG": 0.01}, "src.utils.mysql_utils": {"DEBUG": 0.1}},
+            "rate_limit": {"src.cache": 200, "src.utils.mysql_utils": 200},
         },
     }
 }
@@ -28,18 +37,126 @@ configuration_dict = {
 current_env_config = configuration_dict[deploy_env]
 logging_config = current_env_config.get("logging_config", {})
 logging_config['level'] = os.getenv('RESET_LOGGING_LEVEL') or logging_config.get("level")
-# update_logging_config(logging_config)
+update_logging_config(logging_config)
 
 # redis
 is_redis_keepalive = not os.getenv('OFF_REDIS_KEEPALIVE', False)
-pic_web_redis = {
-    **current_env_config['pic_web_redis'],
+redis_client_options = {
     "socket_keepalive": is_redis_keepalive,
-    "health_check_interval": 0.1 if is_redis_keepalive else 0,
+    # 不在每条命令前 PING 空闲连接，由 RedisClients 后台按 pic_web_redis_circuit_breaker.health_check_interval 检查
+    "health_check_interval": 0,
     "retry_on_timeout": True,
     "socket_timeout": 0.5,
     "socket_connect_timeout": 0.5,
 }
+# pic_web_redis 可以配置为单个节点或节点列表，多个节点时 RedisCache 按一致性哈希分片
+_redis_nodes = current_env_config['pic_web_redis']
+if isinstance(_redis_nodes, dict):
+    _redis_nodes = [_redis_nodes]
+pic_web_redis_nodes = [{**node, **redis_client_options} for node in _redis_nodes]
+pic_web_redis = pic_web_redis_nodes[0]
+# 每个 redis 节点的熔断器：最近 window 秒内错误或慢调用（slow_call_threshold 秒）比例超过阈值时打开，
+# 打开期间 get 只使用 L1、写入直接返回失败，open_duration 秒后放行少量探测请求
+pic_web_redis_circuit_breaker = {
+    "enabled": os.getenv('REDIS_CIRCUIT_BREAKER', '1') == '1',
+    "health_check_interval": 1.0,
+    "options": {
+        "window": 10.0,
+        "min_calls": 20,
+        "error_rate": 0.5,
+        "slow_call_threshold": 0.1,
+        "slow_call_rate": 0.5,
+        "open_duration": 5.0,
+        "half_open_max_calls": 3,
+    },
+    **current_env_config.get('pic_web_redis_circuit_breaker', {}),
+}
+
+# cache
+pic_web_cache = {
+    # memory: 进程内 LFU（按条目数）; tinylfu: 进程内 W-TinyLFU（按字节）; shm: 同机 worker 共享内存
+    "l1_backend": os.getenv('CACHE_L1_BACKEND', 'memory'),
+    "l1_maxsize": 10000,
+    "l1_max_bytes": int(os.getenv('CACHE_L1_MAX_BYTES', 64 * 1024 * 1024)),
+    "l1_ttl": 60,
+    # stale-while-revalidate：L1 中超过 l1_soft_ttl 的 key 返回旧值并后台刷新；
+    # 访问频率不低于 refresh_ahead_rate 次/秒的 key 在 l1_soft_ttl * refresh_ahead_ratio 之后提前刷新
+    "stale_while_revalidate": os.getenv('CACHE_STALE_WHILE_REVALIDATE', '0') == '1',
+    "l1_soft_ttl": 45,
+    "refresh_ahead_rate": 5.0,
+    "refresh_ahead_ratio": 0.5,
+    "l1_shm_name": "pic_web_l1",
+    "l1_shm_size_bytes": int(os.getenv('CACHE_L1_SHM_SIZE_BYTES', 256 * 1024 * 1024)),
+    "l1_shm_slot_size": 4096,
+    # redis 缓存值编码: None 沿用 dump_item/load_item; protobuf / msgpack / json 带 1 字节头部，旧值仍可读取
+    "codec": os.getenv('CACHE_CODEC') or None,
+    "codec_compression": "zstd",  # None / zstd / lz4
+    "codec_compress_threshold": 1024,
+    # 并发请求的 redis mget / mset 合并：最多等待 redis_batch_max_wait_ms（0 表示同一个事件循环 tick 内），每批最多 redis_batch_max_size 个 key
+    "redis_batching": os.getenv('CACHE_REDIS_BATCHING', '0') == '1',
+    "redis_batch_max_size": 500,
+    "redis_batch_max_wait_ms": 1,
+    **current_env_config.get('pic_web_cache', {}),
+}
+
+# metrics
+pic_web_metrics = {
+    # 多个 gunicorn worker 的指标快照写到该目录，/metrics 汇总后输出
+    "multiprocess_dir": os.getenv('METRICS_MULTIPROCESS_DIR', '/tmp/pic_web_metrics'),
+    "dump_interval": 5.0,
+    "stale_after": 60.0,
+}
+
+# ai_picture
+pic_web_ai_picture = {
+    # /ai_picture/q 响应缓存，相同参数的请求直接返回缓存结果
+    "response_cache_ttl": int(os.getenv('AI_PICTURE_RESPONSE_CACHE_TTL', 3600)),
+    "response_cache_control": "private, max-age=600",
+    # 批量后端，见 src/ai_picture/batching.py 中的 BACKENDS
+    "model_backend": "picture",
+    # 生成放到进程池中执行的子进程数，每个 gunicorn worker 各自一个进程池；默认 0 表示在事件循环内直接计算
+    "process_pool_workers": int(os.getenv('AI_PICTURE_PROCESS_POOL_WORKERS', 0)),
+    "process_pool_start_method": "spawn",
+    # 每个路由的准入控制，队列满时返回 503；开启 batching 时 max_concurrency 应不小于 batch_max_size
+    "admission": {
+        "max_concurrency": 16,
+        "max_queue": 64,
+        "retry_after": 1,
+        "disconnect_poll_interval": 0.1,
+    },
+    "request_timeout": 30,
+    # /q/stream、/q/sse 每块的字节数
+    "stream_chunk_size": 64 * 1024,
+    # 动态批量推理，凑满 batch_max_size 或等待 batch_max_wait_ms 后发送一批
+    "batching": os.getenv('AI_PICTURE_BATCHING', '0') == '1',
+    "batch_max_size": 16,
+    "batch_max_wait_ms": 5,
+    **current_env_config.get('pic_web_ai_picture', {}),
+}
 
 # mysql
 pic_web_mysql = current_env_config["pic_web_mysql"]
+# MysqlUtils.query 结果缓存，写入某个表后按表版本号失效；redis 开启时结果和表版本号在 worker 之间共享
+pic_web_mysql_query_cache = {
+    "enabled": os.getenv('MYSQL_QUERY_CACHE', '0') == '1',
+    "maxsize": 10000,
+    "default_ttl": 0,  # 0 表示只缓存调用时传入 cache_ttl 的查询
+    "redis": os.getenv('MYSQL_QUERY_CACHE_REDIS', '0') == '1',
+    "version_ttl": 1.0,  # 从 redis 读取的表版本号在本 worker 内的有效期，即其他 worker 写入后的最长可见延迟
+    "max_result_rows": 1000,
+    **current_env_config.get('pic_web_mysql_query_cache', {}),
+}
+
+# startup
+pic_web_startup = {
+    # 每个 worker 启动时预先建立的连接数，0 表示不预热
+    "redis_warm_connections": 2,
+    "mysql_warm_connections": int(os.getenv('MYSQL_WARM_CONNECTIONS', 2)),
+    "warm_up_timeout": 5.0,
+    # L1 预热：热点 key 列表（每行 item_type<TAB>item_id），以及退出时写入、启动时读取的最近命中 key 快照
+    "hot_keys_file": os.getenv('CACHE_HOT_KEYS_FILE') or None,
+    "snapshot_file": os.getenv('CACHE_SNAPSHOT_FILE') or None,
+    "warm_max_items": 10000,
+    "warm_batch_size": 500,
+    **current_env_config.get('pic_web_startup', {}),
+}
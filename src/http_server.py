@@ -3,13 +3,19 @@ import logging
 from fastapi import FastAPI
 from fastapi.exceptions import RequestValidationError, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, PlainTextResponse
 
 from src.ai_picture import ai_picture_api
+from src.config.config import pic_web_metrics
+from src.startup import lifespan, startup_timer
+from src.utils.admission import AdmissionError
+from src.utils.http_metrics import HttpMetricsMiddleware
+from src.utils.metrics import MultiProcessExporter, render_prometheus
+from src.utils.mysql_stats import mysql_stats
 
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -17,6 +23,16 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
 )
+metrics_exporter = MultiProcessExporter(
+    directory=pic_web_metrics['multiprocess_dir'],
+    interval=pic_web_metrics['dump_interval'],
+    stale_after=pic_web_metrics['stale_after'],
+)
+app.add_middleware(
+    HttpMetricsMiddleware,
+    on_request=metrics_exporter.ensure_started,
+    on_response=startup_timer.on_response,
+)
 
 
 @app.get(path='/health')
@@ -28,6 +44,24 @@ async def health():
     }
 
 
+@app.get(path='/metrics')
+async def metrics():
+    return PlainTextResponse(
+        render_prometheus(metrics_exporter.aggregate()),
+        media_type='text/plain; version=0.0.4',
+    )
+
+
+@app.get(path='/metrics/mysql')
+async def mysql_metrics():
+    return {
+      "code": 200,
+      "message": 'success',
+      "success": True,
+      "data": mysql_stats.snapshot(),
+    }
+
+
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc):
     return JSONResponse({
@@ -38,6 +72,16 @@ async def http_exception_handler(request, exc):
     }, status_code=500)
 
 
+@app.exception_handler(AdmissionError)
+async def admission_exception_handler(request, exc):
+    return JSONResponse({
+      "code": exc.status_code,
+      "message": f"{exc=}",
+      "success": False,
+      "data": [],
+    }, status_code=exc.status_code, headers=exc.headers)
+
+
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request, exc):
     return JSONResponse({
@@ -50,6 +94,7 @@ async def validation_exception_handler(request, exc):
 
 # 添加子路由
 app.include_router(ai_picture_api)
+startup_timer.mark_imported()
 
 
 def server():
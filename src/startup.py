@@ -0,0 +1,132 @@
+import asyncio
+import contextlib
+import logging
+import os
+import time
+
+from src.cache.aioredis_cache import RedisCache
+from src.cache.warmup import load_hot_items, save_hot_items
+from src.config.config import pic_web_mysql, pic_web_mysql_query_cache, pic_web_startup
+from src.utils.aiomysql_utils import AsyncMysqlUtils
+from src.utils.metrics import register_collector, series
+from src.utils.mysql_query_cache import build_query_cache
+
+logger = logging.getLogger(__name__)
+
+
+def process_uptime():
+    """
+    @summary: 当前进程启动以来的秒数，gunicorn worker 为 fork 之后的时间；读取 /proc，非 linux 返回 None
+    """
+    try:
+        with open('/proc/self/stat') as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupTimer(object):
+    """
+    @summary: 本 worker 的启动耗时：进程启动到 import 完成、lifespan 各预热步骤、第一个请求的耗时，以 gauge 输出到 /metrics
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self._first_response = True
+
+    def mark(self, name, seconds):
+        if seconds is None:
+            return
+        self.timings[name] = seconds
+        logger.info(f'startup_timing {name=} seconds={seconds:.4f}')
+
+    def mark_imported(self):
+        self.mark('import', process_uptime())
+
+    def on_response(self, method, route, status, seconds):
+        if self._first_response:
+            self._first_response = False
+            self.mark('first_request', seconds)
+            self.mark('until_first_response', process_uptime())
+
+    def collect(self):
+        return {
+            'gauges': {
+                series(f'startup_{name}_seconds', pid=os.getpid()): seconds for name, seconds in self.timings.items()
+            },
+        }
+
+
+startup_timer = StartupTimer()
+register_collector('startup', startup_timer.collect)
+
+
+async def _warm_up_step(name, coro, timeout):
+    start = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(coro, timeout)
+    except Exception as e:
+        logger.error(f'startup_warm_up_error {e=} {name=}')
+        result = None
+    startup_timer.mark(f'warm_{name}', time.perf_counter() - start)
+    return result
+
+
+def load_warm_items(config):
+    """
+    @summary: 合并热点 key 列表和快照中的 key，读取失败的文件记录日志后跳过
+    """
+    items = {}
+    for path in (config['hot_keys_file'], config['snapshot_file']):
+        try:
+            path_items = load_hot_items(path, limit=config['warm_max_items'])
+        except Exception as e:
+            logger.error(f'startup_warm_items_load_error {e=} {path=}')
+            continue
+        for item in path_items:
+            items.setdefault((item.item_type, item.item_id), item)
+    return list(items.values())[:config['warm_max_items']]
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app, config=pic_web_startup):
+    """
+    @summary: 每个 worker 在 fork 之后创建并预热 redis / mysql 连接，从热点 key 列表和快照预热 L1；
+    退出时把最近命中的 key 写入快照并关闭连接。预热失败只记录日志，不影响启动
+    """
+    start = time.perf_counter()
+    cache = RedisCache()
+    query_cache_config = {**pic_web_mysql_query_cache}
+    # 查询缓存共用 redis 第一个节点的客户端
+    query_cache_config['redis'] = cache.cache if query_cache_config['redis'] else None
+    app.state.mysql = AsyncMysqlUtils(**pic_web_mysql, query_cache=build_query_cache(**query_cache_config))
+    timeout = config['warm_up_timeout']
+    if config['redis_warm_connections']:
+        await _warm_up_step('redis', cache.redis_clients.warm_up(config['redis_warm_connections']), timeout)
+    if config['mysql_warm_connections']:
+        await _warm_up_step('mysql', app.state.mysql.warm_up(config['mysql_warm_connections']), timeout)
+    warm_items = load_warm_items(config)
+    if warm_items:
+        warmed = await _warm_up_step(
+            'cache_memory', cache.warm_memory(warm_items, batch_size=config['warm_batch_size']), timeout)
+        logger.info(f'startup_cache_memory_warmed {warmed=} total={len(warm_items)}')
+    startup_timer.mark('lifespan', time.perf_counter() - start)
+    try:
+        yield
+    finally:
+        if config['snapshot_file']:
+            hot_items = cache.ttl_refresher.hot_items(limit=config['warm_max_items'])
+            if hot_items:
+                try:
+                    save_hot_items(config['snapshot_file'], hot_items)
+                except OSError as e:
+                    logger.error(f'startup_snapshot_save_error {e=}')
+        if cache.stale_while_revalidate:
+            await cache.stale_refresher.close()
+        for batch_loader in list(cache._batch_loaders.values()):
+            await batch_loader.close()
+        await cache.redis_clients.close()
+        await AsyncMysqlUtils.close_all()
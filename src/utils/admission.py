@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+
+from .metrics import Histogram, register_collector, series
+
+logger = logging.getLogger(__name__)
+
+_empty = object()
+
+
+class AdmissionError(Exception):
+    status_code = 503
+
+    def __init__(self, name, message='', headers=None):
+        super().__init__(f'{name} {message}'.strip())
+        self.name = name
+        self.headers = headers or {}
+
+
+class AdmissionRejected(AdmissionError):
+    status_code = 503
+
+
+class DeadlineExceeded(AdmissionError):
+    status_code = 504
+
+
+class RequestAbandoned(AdmissionError):
+    status_code = 499
+
+
+class AdmissionController(object):
+    """
+    @summary: 单个路由的准入控制，最多 max_concurrency 个请求同时执行，另外最多 max_queue 个排队；
+    队列满时立即抛出 AdmissionRejected（503 + Retry-After），超过 deadline 或客户端断开时取消排队中的请求
+    """
+
+    def __init__(self, name, max_concurrency=8, max_queue=64, retry_after=1, disconnect_poll_interval=0.1):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.disconnect_poll_interval = disconnect_poll_interval
+        self.occupied = 0  # 排队 + 执行中
+        self.running = 0
+        self.counters = defaultdict(int)
+        self.queue_wait = Histogram()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        register_collector(f'admission_{name}', self.collect)
+
+    def is_full(self):
+        return self.occupied >= self.max_concurrency + self.max_queue
+
+    async def _run(self, func, args):
+        start = time.perf_counter()
+        await self._semaphore.acquire()
+        self.queue_wait.observe(time.perf_counter() - start)
+        self.running += 1
+        try:
+            return await func(*args)
+        finally:
+            self.running -= 1
+            self._semaphore.release()
+
+    async def _wait_disconnect(self, request):
+        while not await request.is_disconnected():
+            await asyncio.sleep(self.disconnect_poll_interval)
+
+    async def run(self, func, *args, timeout=None, request=None):
+        """
+        @summary: 在准入控制下执行 await func(*args)；传入 request 时轮询客户端是否断开
+        """
+        self.check()
+        self.counters['admitted'] += 1
+        self.occupied += 1
+        task = asyncio.ensure_future(self._run(func, args))
+        watcher = asyncio.ensure_future(self._wait_disconnect(request)) if request is not None else None
+        try:
+            done, _ = await asyncio.wait(
+                [task, watcher] if watcher else [task], timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self.occupied -= 1
+            if watcher is not None:
+                watcher.cancel()
+            if not task.done():
+                task.cancel()
+        if task in done:
+            return task.result()
+        if watcher is not None and watcher in done:
+            self.counters['abandoned'] += 1
+            raise RequestAbandoned(self.name, 'client disconnected')
+        self.counters['deadline_exceeded'] += 1
+        raise DeadlineExceeded(self.name, f'deadline {timeout}s exceeded')
+
+    def check(self):
+        """
+        @summary: 队列满时抛出 AdmissionRejected，只检查不占用名额
+        """
+        if self.is_full():
+            self.counters['rejected'] += 1
+            raise AdmissionRejected(self.name, 'queue is full', headers={'Retry-After': str(self.retry_after)})
+
+    async def open_stream(self, agen, timeout=None):
+        """
+        @summary: 流式响应在构造 StreamingResponse 之前调用：立即占用名额，等待执行名额并取出第一块，
+        这期间的失败（AdmissionRejected / DeadlineExceeded / 生成出错）在发送响应头之前抛出；
+        返回的异步生成器输出全部内容，整个输出期间占用一个执行名额，结束、出错或被关闭时释放。timeout 限制排队和第一块
+        """
+        self.check()
+        self.counters['admitted'] += 1
+        self.occupied += 1
+        stream = self._stream(agen, timeout)
+        # 预先启动生成器，之后即使响应没有开始迭代，生成器被关闭或回收时也会执行 finally 释放名额
+        await stream.__anext__()
+        return stream
+
+    async def _stream(self, agen, timeout):
+        acquired = False
+        try:
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout)
+            except asyncio.TimeoutError:
+                self.counters['deadline_exceeded'] += 1
+                raise DeadlineExceeded(self.name, f'deadline {timeout}s exceeded')
+            acquired = True
+            self.queue_wait.observe(time.perf_counter() - start)
+            self.running += 1
+            remaining = None if timeout is None else max(timeout - (time.perf_counter() - start), 0)
+            try:
+                first_chunk = await asyncio.wait_for(agen.__anext__(), remaining)
+            except StopAsyncIteration:
+                first_chunk = _empty
+            except asyncio.TimeoutError:
+                self.counters['deadline_exceeded'] += 1
+                raise DeadlineExceeded(self.name, f'deadline {timeout}s exceeded')
+            yield None
+            if first_chunk is not _empty:
+                yield first_chunk
+                async for chunk in agen:
+                    yield chunk
+        finally:
+            if acquired:
+                self.running -= 1
+                self._semaphore.release()
+            self.occupied -= 1
+            await agen.aclose()
+
+    def collect(self):
+        return {
+            'counters': {
+                series(f'admission_{key}_total', route=self.name): value for key, value in self.counters.items()
+            },
+            'gauges': {
+                series('admission_queue_size', route=self.name): max(self.occupied - self.running, 0),
+                series('admission_in_flight', route=self.name): self.running,
+            },
+            'histograms': {series('admission_queue_wait_seconds', route=self.name): self.queue_wait.snapshot()},
+        }
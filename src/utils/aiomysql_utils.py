@@ -0,0 +1,250 @@
+import asyncio
+import functools
+import logging
+import os
+import time
+
+import aiomysql
+from aiomysql.cursors import DictCursor, SSCursor, SSDictCursor
+
+from .mysql_stats import mysql_stats
+from .mysql_utils import BaseDBlUtils, CONNECTION_ERRORS, md
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncMysqlUtils(BaseDBlUtils):
+    """
+    @summary: 基于 aiomysql 连接池的异步版本，接口与 MysqlUtils 保持一致，在 async def 路由中使用不会阻塞事件循环
+    """
+    _cache_pool = {}
+
+    @classmethod
+    def _normalize_conn(cls, kwargs):
+        conn = super()._normalize_conn(kwargs)
+        if 'database' in conn:
+            conn['db'] = conn.pop('database')
+        return conn
+
+    @classmethod
+    def _connect_default(cls):
+        return dict(
+            cursorclass=DictCursor,
+            charset='utf8',
+            autocommit=True,
+            minsize=1,
+            maxsize=20,  # 连接池允许的最大连接数
+            pool_recycle=3600,  # 连接空闲多久后重建，-1 表示不重建
+        )
+
+    @classmethod
+    async def _get_pool(cls, **kwargs):
+        """
+        @summary: 按配置去重获取连接池，并发的首次调用共享同一个创建任务
+        @return aiomysql.Pool
+        """
+        connect = {**cls._connect_default()}
+        connect.update(**kwargs)
+        cache_key = (os.getpid(), md(tuple((_, connect[_]) for _ in sorted(connect))))
+        if cache_key not in cls._cache_pool:
+            cls._cache_pool[cache_key] = asyncio.ensure_future(aiomysql.create_pool(**connect))
+        pool_future = cls._cache_pool[cache_key]
+        try:
+            pool = await asyncio.shield(pool_future)
+        except Exception:
+            if cls._cache_pool.get(cache_key) is pool_future:
+                cls._cache_pool.pop(cache_key)
+            raise
+        mysql_stats.register_pool(cls._pool_name(connect), functools.partial(cls._pool_stats, pool))
+        return pool
+
+    @staticmethod
+    def _pool_stats(pool):
+        return dict(
+            in_use=pool.size - pool.freesize,
+            idle=pool.freesize,
+            maxsize=pool.maxsize,
+            minsize=pool.minsize,
+        )
+
+    @staticmethod
+    async def _acquire(pool):
+        start = time.perf_counter()
+        try:
+            _conn = await pool.acquire()
+        except Exception:
+            mysql_stats.observe_checkout(time.perf_counter() - start, error=True)
+            raise
+        mysql_stats.observe_checkout(time.perf_counter() - start)
+        return _conn
+
+    @classmethod
+    async def close_all(cls):
+        # 只关闭当前进程创建的连接池
+        pid = os.getpid()
+        pool_futures = [pool_future for (pool_pid, _), pool_future in cls._cache_pool.items() if pool_pid == pid]
+        cls._cache_pool = {cache_key: pool_future for cache_key, pool_future in cls._cache_pool.items()
+                           if cache_key[0] != pid}
+        for pool_future in pool_futures:
+            try:
+                pool = await pool_future
+                pool.close()
+                await pool.wait_closed()
+            except Exception as e:
+                logger.error('mysql_pool_close_error e:{e}'.format(e=e))
+
+    async def _run_steps(self, steps):
+        """
+        @summary: 与 BaseDBlUtils._run_steps 相同，yield 出的 IO 调用在这里 await
+        """
+        try:
+            call = next(steps)
+            while True:
+                try:
+                    result = await call()
+                except Exception as e:
+                    call = steps.throw(e)
+                else:
+                    call = steps.send(result)
+        except StopIteration as stop:
+            return stop.value
+
+    async def query(self, sql, param=None, cache_ttl=None):
+        """
+        @param cache_ttl: 开启 query_cache 时结果缓存的秒数，None 使用 query_cache.default_ttl，0 表示不缓存
+        """
+        return await self._run_steps(self._query_steps(sql, param, cache_ttl))
+
+    async def _invalidate_query_cache(self, sql):
+        return await self._run_steps(self._invalidate_query_cache_steps(sql))
+
+    async def query_iter(self, sql, param=None, chunk_size=1000, as_dict=True):
+        """
+        @summary: 基于服务端游标的异步流式查询，提前退出时请用 contextlib.aclosing 包裹以便立即归还连接
+        @return 逐行返回 dict（as_dict=False 时为 tuple）的异步生成器
+        """
+        logger.debug('debug_query_iter sql:%s param:%s chunk_size:%s', sql, param, chunk_size)
+        replica = self._choose_replica(readonly=True)
+        failed = False
+        try:
+            pool = await self._get_conn_pool(replica)
+            _conn = await self._acquire(pool)
+            try:
+                async with _conn.cursor(SSDictCursor if as_dict else SSCursor) as _cursor:
+                    start = time.perf_counter()
+                    try:
+                        if param:
+                            await _cursor.execute(sql, param)
+                        else:
+                            await _cursor.execute(sql)
+                    except Exception:
+                        mysql_stats.observe_query(sql, param, time.perf_counter() - start, error=True)
+                        raise
+                    mysql_stats.observe_query(sql, param, time.perf_counter() - start)
+                    while True:
+                        rows = await _cursor.fetchmany(chunk_size)
+                        if not rows:
+                            break
+                        for row in rows:
+                            yield row
+            finally:
+                pool.release(_conn)
+        except CONNECTION_ERRORS:
+            failed = True
+            raise
+        finally:
+            if replica is not None:
+                self._replicas.release(replica, failed=failed)
+
+    async def _get_conn_pool(self, replica=None):
+        self._check_pid()
+        if replica is not None:
+            if replica.pool is None:
+                replica.pool = await self._get_pool(**replica.config)
+            return replica.pool
+        if self._pool is None:
+            self._pool = await self._get_pool(**self._db_config)
+        return self._pool
+
+    async def warm_up(self, connections=1):
+        """
+        @summary: 预先建立 connections 个主库连接并放回连接池
+        """
+        pool = await self._get_conn_pool()
+        conns = []
+        try:
+            for _ in range(connections):
+                conns.append(await self._acquire(pool))
+        finally:
+            for _conn in conns:
+                pool.release(_conn)
+        return len(conns)
+
+    async def _query(self, sql, param=None, many=False, fetch=False, readonly=False):
+        logger.debug('debug_query sql:%s param:%s many:%s fetch:%s', sql, param, many, fetch)
+        replica = self._choose_replica(readonly)
+        if replica is not None:
+            failed = False
+            try:
+                return await self._execute_query(await self._get_conn_pool(replica), sql, param, many, fetch)
+            except CONNECTION_ERRORS as e:
+                failed = True
+                logger.error(f'mysql_replica_query_error {e=} replica={replica.name}')
+            finally:
+                self._replicas.release(replica, failed=failed)
+        return await self._execute_query(await self._get_conn_pool(), sql, param, many, fetch)
+
+    async def _execute_query(self, pool, sql, param=None, many=False, fetch=False):
+        _conn = await self._acquire(pool)
+        start = time.perf_counter()
+        error = False
+        try:
+            async with _conn.cursor() as _cursor:
+                if many:
+                    execute_func = _cursor.executemany
+                else:
+                    execute_func = _cursor.execute
+                if param:
+                    result = await execute_func(sql, param)
+                else:
+                    result = await execute_func(sql)
+                if fetch:
+                    result = await _cursor.fetchall()
+        except Exception:
+            error = True
+            raise
+        finally:
+            mysql_stats.observe_query(sql, param, time.perf_counter() - start, error=error)
+            pool.release(_conn)
+        return result
+
+    async def execute(self, sql, param=None):
+        try:
+            return await self._query(sql, param)
+        finally:
+            await self._invalidate_query_cache(sql)
+
+    async def execute_many(self, sql, param=None):
+        try:
+            return await self._query(sql, param, True)
+        finally:
+            await self._invalidate_query_cache(sql)
+
+    async def update(self, table_name, where, results):
+        return await self._run_steps(self._update_steps(table_name, where, results))
+
+    async def insert_ignore(self, table_name, results, ignore=True):
+        return await self._run_steps(self._insert_ignore_steps(table_name, results, ignore))
+
+    async def insert(self, table_name, results):
+        return await self.insert_ignore(table_name, results, ignore=False)
+
+    async def insert_or_update_many(self, table_name, where, results, chunk_size=None, max_packet_size=None):
+        """
+        @summary: 批量 upsert，见 BaseDBlUtils.insert_or_update_many
+        """
+        return await self._run_steps(
+            self._insert_or_update_many_steps(table_name, where, results, chunk_size, max_packet_size))
+
+    async def insert_or_update(self, table_name, where, result):
+        return await self._run_steps(self._insert_or_update_steps(table_name, where, result))
@@ -0,0 +1,129 @@
+import logging
+import time
+from collections import defaultdict, deque
+
+from .metrics import series
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+
+    def __init__(self, name):
+        super().__init__(f'circuit {name} is open')
+        self.name = name
+
+
+class CircuitBreaker(object):
+    """
+    @summary: 按最近 window 秒的错误率和慢调用率熔断，调用数不少于 min_calls 且任一比例超过阈值时打开；
+    打开 open_duration 秒后进入半开，放行最多 half_open_max_calls 个探测调用，全部成功则关闭，任一失败或过慢重新打开。
+    单线程使用（事件循环内），调用方先 allow()，完成后 record()，被取消时 cancel()
+    """
+
+    def __init__(self, name, window=10.0, buckets=10, min_calls=20, error_rate=0.5, slow_call_threshold=0.1,
+                 slow_call_rate=0.5, open_duration=5.0, half_open_max_calls=3):
+        self.name = name
+        self.window = window
+        self.bucket_width = window / buckets
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_threshold = slow_call_threshold  # 秒，None 表示不统计慢调用
+        self.slow_call_rate = slow_call_rate
+        self.open_duration = open_duration
+        self.half_open_max_calls = half_open_max_calls
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.counters = defaultdict(int)
+        self.transitions = defaultdict(int)  # (from_state, to_state) -> 次数
+        self._buckets = deque()  # [bucket_start, calls, errors, slow_calls]
+        self._half_open_inflight = 0
+        self._half_open_successes = 0
+
+    def allow(self):
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.open_duration:
+                self.counters['rejected'] += 1
+                return False
+            self._transition(HALF_OPEN)
+        if self._half_open_inflight + self._half_open_successes >= self.half_open_max_calls:
+            self.counters['rejected'] += 1
+            return False
+        self._half_open_inflight += 1
+        return True
+
+    def record(self, duration, error=False):
+        slow = not error and self.slow_call_threshold is not None and duration >= self.slow_call_threshold
+        self.counters['error' if error else 'slow' if slow else 'success'] += 1
+        if self.state == HALF_OPEN:
+            self._half_open_inflight = max(self._half_open_inflight - 1, 0)
+            if error or slow:
+                self._transition(OPEN)
+                return
+            self._half_open_successes += 1
+            if self._half_open_successes >= self.half_open_max_calls:
+                self._transition(CLOSED)
+            return
+        if self.state == OPEN:
+            # 打开之前已经发出的调用
+            return
+        calls, errors, slow_calls = self._observe(time.monotonic(), error, slow)
+        if calls >= self.min_calls and (errors >= calls * self.error_rate or slow_calls >= calls * self.slow_call_rate):
+            self._transition(OPEN)
+
+    def cancel(self):
+        if self.state == HALF_OPEN:
+            self._half_open_inflight = max(self._half_open_inflight - 1, 0)
+
+    def _observe(self, now, error, slow):
+        bucket_start = now - now % self.bucket_width
+        if not self._buckets or self._buckets[-1][0] != bucket_start:
+            self._buckets.append([bucket_start, 0, 0, 0])
+        while self._buckets[0][0] <= now - self.window:
+            self._buckets.popleft()
+        bucket = self._buckets[-1]
+        bucket[1] += 1
+        bucket[2] += error
+        bucket[3] += slow
+        calls = errors = slow_calls = 0
+        for _, bucket_calls, bucket_errors, bucket_slow_calls in self._buckets:
+            calls += bucket_calls
+            errors += bucket_errors
+            slow_calls += bucket_slow_calls
+        return calls, errors, slow_calls
+
+    def _transition(self, state):
+        logger.warning(f'circuit_breaker_transition name={self.name} {self.state} -> {state}')
+        self.transitions[(self.state, state)] += 1
+        self.state = state
+        self._half_open_inflight = self._half_open_successes = 0
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        elif state == CLOSED:
+            self._buckets.clear()
+
+    def collect(self):
+        return {
+            'counters': {
+                **{
+                    series('circuit_breaker_calls_total', breaker=self.name, result=result): value
+                    for result, value in list(self.counters.items())
+                },
+                **{
+                    series('circuit_breaker_transitions_total', breaker=self.name, from_state=from_state,
+                           to_state=to_state): value
+                    for (from_state, to_state), value in list(self.transitions.items())
+                },
+            },
+            # 多个 worker 相加后为处于各状态的 worker 数
+            'gauges': {
+                series('circuit_breaker_state', breaker=self.name, state=state): int(self.state == state)
+                for state in (CLOSED, OPEN, HALF_OPEN)
+            },
+        }
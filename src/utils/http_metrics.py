@@ -0,0 +1,91 @@
+import threading
+import time
+from collections import defaultdict
+
+from .metrics import (Histogram, format_server_timing, get_timings, register_collector, reset_timings, series,
+                      start_timings)
+
+
+class HttpMetrics(object):
+    """
+    @summary: 按 method + 路由模板统计请求耗时直方图、状态码计数和正在处理的请求数
+    """
+    unmatched_route = '__unmatched__'
+
+    def __init__(self):
+        self.latency = {}
+        self.status = defaultdict(int)
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def observe(self, method, route, status, duration):
+        histogram = self.latency.get((method, route))
+        if histogram is None:
+            histogram = self.latency.setdefault((method, route), Histogram())
+        histogram.observe(duration)
+        with self._lock:
+            self.status[(method, route, status)] += 1
+
+    def collect(self):
+        return {
+            'counters': {
+                series('http_requests_total', method=method, route=route, status=status): count
+                for (method, route, status), count in list(self.status.items())
+            },
+            'gauges': {
+                series('http_requests_in_flight'): self.in_flight,
+            },
+            'histograms': {
+                series('http_request_duration_seconds', method=method, route=route): histogram.snapshot()
+                for (method, route), histogram in list(self.latency.items())
+            },
+        }
+
+
+http_metrics = HttpMetrics()
+register_collector('http', http_metrics.collect)
+
+
+class HttpMetricsMiddleware(object):
+    """
+    @summary: ASGI 中间件，记录每个路由的耗时和状态码，并在响应头中加入 Server-Timing
+    （cache_l1 / redis / mysql 等阶段由 CacheBase、MysqlUtils 通过 record_timing 上报）
+    """
+
+    def __init__(self, app, metrics=http_metrics, server_timing=True, on_request=None, on_response=None):
+        self.app = app
+        self.metrics = metrics
+        self.server_timing = server_timing
+        self.on_request = on_request
+        self.on_response = on_response  # on_response(method, route, status, seconds)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        if self.on_request is not None:
+            self.on_request()
+        start = time.perf_counter()
+        token = start_timings()
+        status = 500
+
+        async def _send(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                if self.server_timing:
+                    server_timing = format_server_timing(get_timings(), time.perf_counter() - start)
+                    message['headers'] = [*message.get('headers', []), (b'server-timing', server_timing.encode())]
+            await send(message)
+
+        self.metrics.in_flight += 1
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            self.metrics.in_flight -= 1
+            route = getattr(scope.get('route'), 'path', None) or self.metrics.unmatched_route
+            duration = time.perf_counter() - start
+            self.metrics.observe(scope['method'], route, status, duration)
+            if self.on_response is not None:
+                self.on_response(scope['method'], route, status, duration)
+            reset_timings(token)
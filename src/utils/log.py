@@ -1,16 +1,43 @@
+import atexit
+import copy
 import json
 import logging
 import logging.config
 import logging.handlers
-from traceback import format_exc, print_exc
+import os
+import queue
+import random
+import threading
+import time
+from traceback import format_exception, print_exc
 
 from pythonjsonlogger import jsonlogger
 
+from .metrics import register_collector, series
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from pip._internal.utils.logging import ColorizedStreamHandler  # noqa: F401
+    stream_handler_class = 'pip._internal.utils.logging.ColorizedStreamHandler'
+except ImportError:
+    # pip 21 之后移除了 ColorizedStreamHandler
+    stream_handler_class = 'logging.StreamHandler'
+
 
 class TracebackFormatExcFilter(logging.Filter):
 
     def filter(self, record):
-        format_exc_str = format_exc()
+        # 只在带异常的记录上格式化异常栈，经过 QueueBatchHandler 的记录已把异常栈转成 exc_text
+        if record.exc_info:
+            format_exc_str = ''.join(format_exception(*record.exc_info))
+        elif record.exc_text:
+            format_exc_str = record.exc_text
+        else:
+            return True
         traceback_format_exc = json.dumps(format_exc_str)
         if isinstance(record.msg, dict):
             record.msg['traceback_format_exc'] = traceback_format_exc
@@ -19,6 +46,208 @@ class TracebackFormatExcFilter(logging.Filter):
         return True
 
 
+class FastJsonFormatter(jsonlogger.JsonFormatter):
+    """
+    @summary: 安装了 orjson 时用 orjson 序列化，否则与 JsonFormatter 一致
+    """
+
+    def jsonify_log_record(self, log_record):
+        if orjson is not None:
+            try:
+                return orjson.dumps(log_record, default=self.json_default).decode('utf-8')
+            except TypeError:
+                pass
+        return super().jsonify_log_record(log_record)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    @summary: 按 logger 名前缀采样和限流
+    sampling: {logger_name: {level: rate}}，例如 {"src.cache": {"DEBUG": 0.01}} 只保留 1% 的 debug 日志
+    rate_limit: {logger_name: records_per_second}，令牌桶限流，突发上限为 1 秒的量
+    """
+
+    def __init__(self, sampling=None, rate_limit=None):
+        super().__init__()
+        self.sampling = {
+            name: {logging.getLevelName(level.upper()): rate for level, rate in rates.items()}
+            for name, rates in (sampling or {}).items()
+        }
+        self.rate_limit = dict(rate_limit or {})
+        self.sampled_out = 0
+        self.rate_limited = 0
+        self._buckets = {name: [float(rate), time.monotonic()] for name, rate in self.rate_limit.items()}
+        self._rules = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _match(rules, name):
+        while True:
+            if name in rules:
+                return name
+            if not name:
+                return None
+            name = name.rpartition('.')[0]
+
+    def _get_rule(self, name):
+        rule = self._rules.get(name)
+        if rule is None:
+            rule = self._rules[name] = (self._match(self.sampling, name), self._match(self.rate_limit, name))
+        return rule
+
+    def filter(self, record):
+        sampling_name, rate_limit_name = self._get_rule(record.name)
+        if sampling_name is not None:
+            rate = self.sampling[sampling_name].get(record.levelno)
+            if rate is not None and random.random() >= rate:
+                self.sampled_out += 1
+                return False
+        if rate_limit_name is not None:
+            rate = self.rate_limit[rate_limit_name]
+            with self._lock:
+                bucket = self._buckets[rate_limit_name]
+                now = time.monotonic()
+                bucket[0] = min(rate, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+                if bucket[0] < 1:
+                    self.rate_limited += 1
+                    return False
+                bucket[0] -= 1
+        return True
+
+
+class QueueBatchHandler(logging.Handler):
+    """
+    @summary: 调用方只把 record 放入有界队列，后台线程批量执行目标 handler 的过滤、格式化并一次性写入 stream；
+    队列满时丢弃并计数
+    """
+
+    def __init__(self, handlers, maxsize=10000, batch_size=256):
+        super().__init__()
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize)
+        self.dropped = 0
+        self.written = 0
+        self._start()
+        os.register_at_fork(after_in_child=self._start)
+        atexit.register(self.close)
+
+    def _start(self):
+        self.queue = queue.Queue(self.queue.maxsize)
+        self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        self._thread.start()
+
+    def handle(self, record):
+        # 只做过滤和入队，不需要 Handler.handle 中的锁
+        if not self.filter(record):
+            return False
+        self.emit(record)
+        return True
+
+    def prepare(self, record):
+        """
+        @summary: 与 logging.handlers.QueueHandler.prepare 相同，入队前在调用方线程把 args 合并进 msg、异常栈转成 exc_text，
+        后台线程格式化时不再引用调用方之后可能修改的参数和异常的栈帧；没有 args 的 dict msg 原样保留给 json formatter
+        """
+        record = copy.copy(record)
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = ''.join(format_exception(*record.exc_info)).rstrip('\n')
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            record = self.prepare(record)
+        except Exception:
+            self.handleError(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                return
+            batch = [record]
+            while len(batch) < self.batch_size:
+                try:
+                    record = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is None:
+                    self._write_batch(batch)
+                    return
+                batch.append(record)
+            self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        outputs = {}
+        for record in batch:
+            for handler in self.handlers:
+                if record.levelno < handler.level or not handler.filter(record):
+                    continue
+                try:
+                    outputs.setdefault(handler, []).append(handler.format(record))
+                except Exception:
+                    handler.handleError(record)
+        for handler, lines in outputs.items():
+            try:
+                handler.stream.write(handler.terminator.join(lines) + handler.terminator)
+                handler.stream.flush()
+                self.written += len(lines)
+            except Exception:
+                print_exc()
+
+    def close(self):
+        if self._thread.is_alive():
+            try:
+                self.queue.put(None, timeout=1)
+                self._thread.join(timeout=5)
+            except queue.Full:
+                pass
+        super().close()
+
+    def stats(self):
+        return dict(queued=self.queue.qsize(), maxsize=self.queue.maxsize, dropped=self.dropped, written=self.written)
+
+
+def get_logging_stats():
+    stats = {}
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, QueueBatchHandler):
+            stats['queue'] = handler.stats()
+        for _filter in handler.filters:
+            if isinstance(_filter, SamplingFilter):
+                stats['sampling'] = dict(sampled_out=_filter.sampled_out, rate_limited=_filter.rate_limited)
+    return stats
+
+
+def collect_logging_stats():
+    stats = get_logging_stats()
+    counters, gauges = {}, {}
+    if 'queue' in stats:
+        queue_stats = stats['queue']
+        counters[series('logging_records_total', result='written')] = queue_stats['written']
+        counters[series('logging_records_total', result='dropped')] = queue_stats['dropped']
+        gauges[series('logging_queue_size')] = queue_stats['queued']
+        gauges[series('logging_queue_maxsize')] = queue_stats['maxsize']
+    if 'sampling' in stats:
+        counters[series('logging_records_total', result='sampled_out')] = stats['sampling']['sampled_out']
+        counters[series('logging_records_total', result='rate_limited')] = stats['sampling']['rate_limited']
+    return {'counters': counters, 'gauges': gauges}
+
+
+register_collector('logging', collect_logging_stats)
+
+
 def update_logging_config(config=None):
     default_format = "[%(levelname)s %(asctime)s %(msecs)s %(name)s:%(lineno)d] <%(process)d|%(threadName)s> %(message)s"
     default_level = 'INFO'
@@ -64,7 +293,7 @@ def update_logging_config(config=None):
                 "datefmt": config['datefmt'],
             },
             "json": {
-                "()": jsonlogger.JsonFormatter,
+                "()": FastJsonFormatter,
                 "format": config['format'],
                 "datefmt": config['datefmt'],
                 "rename_fields": rename_fields,
@@ -74,7 +303,7 @@ def update_logging_config(config=None):
         "handlers": {
             "console": {
                 "level": "DEBUG",
-                "class": "pip._internal.utils.logging.ColorizedStreamHandler",
+                "class": stream_handler_class,
                 "stream": "ext://sys.stdout",
                 "filters": [
                     "exclude_level"
@@ -86,7 +315,7 @@ def update_logging_config(config=None):
                 "filters": [
                     "traceback_format_exc"
                 ],
-                "class": "pip._internal.utils.logging.ColorizedStreamHandler",
+                "class": stream_handler_class,
                 "stream": "ext://sys.stderr",
                 "formatter": formatter
             }
@@ -111,3 +340,17 @@ def update_logging_config(config=None):
 
     logging_config.update(config['_logging_config'])
     logging.config.dictConfig(logging_config)
+
+    # queue 模式: 根 logger 的 handler 换成 QueueBatchHandler，格式化和写入在后台线程批量完成
+    root_logger = logging.getLogger()
+    if config.get('queue'):
+        queue_handler = QueueBatchHandler(
+            handlers=list(root_logger.handlers),
+            maxsize=config.get('queue_maxsize', 10000),
+            batch_size=config.get('queue_batch_size', 256),
+        )
+        root_logger.handlers = [queue_handler]
+    if config.get('sampling') or config.get('rate_limit'):
+        sampling_filter = SamplingFilter(sampling=config.get('sampling'), rate_limit=config.get('rate_limit'))
+        for handler in root_logger.handlers:
+            handler.addFilter(sampling_filter)
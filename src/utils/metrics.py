@@ -0,0 +1,249 @@
+import asyncio
+import bisect
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 单位：秒
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram(object):
+    """
+    @summary: 固定分桶的直方图，线程安全，分位数按桶内线性插值估算
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一个为 +Inf 桶
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q):
+        with self._lock:
+            counts, count = list(self.counts), self.count
+        return quantile_from_counts(self.buckets, counts, count, q)
+
+    def snapshot(self):
+        with self._lock:
+            counts, count, total = list(self.counts), self.count, self.sum
+        return dict(
+            buckets=list(self.buckets),
+            counts=counts,
+            count=count,
+            sum=total,
+            p50=quantile_from_counts(self.buckets, counts, count, 0.5),
+            p95=quantile_from_counts(self.buckets, counts, count, 0.95),
+            p99=quantile_from_counts(self.buckets, counts, count, 0.99),
+        )
+
+
+def quantile_from_counts(buckets, counts, count, q):
+    if not count:
+        return 0.0
+    rank = q * count
+    cumulative = 0
+    for index, bucket_count in enumerate(counts):
+        if cumulative + bucket_count >= rank and bucket_count:
+            if index >= len(buckets):
+                return buckets[-1]
+            lower = buckets[index - 1] if index else 0.0
+            return lower + (buckets[index] - lower) * (rank - cumulative) / bucket_count
+        cumulative += bucket_count
+    return buckets[-1]
+
+
+# ===========================
+# 请求内各阶段耗时，用于 Server-Timing
+# ===========================
+_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+def start_timings():
+    return _timings.set({})
+
+
+def reset_timings(token):
+    _timings.reset(token)
+
+
+def get_timings():
+    return _timings.get() or {}
+
+
+def record_timing(name, seconds):
+    timings = _timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextlib.contextmanager
+def timing(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(name, time.perf_counter() - start)
+
+
+def format_server_timing(timings, total):
+    spans = [f'{name};dur={seconds * 1000:.3f}' for name, seconds in timings.items()]
+    service = max(total - sum(timings.values()), 0.0)
+    spans.append(f'service;dur={service * 1000:.3f}')
+    spans.append(f'total;dur={total * 1000:.3f}')
+    return ', '.join(spans)
+
+
+# ===========================
+# 指标汇总与 prometheus 文本格式
+# 每个 collector 返回 {'counters': {series: value}, 'gauges': {...}, 'histograms': {series: Histogram.snapshot()}}
+# series 为 prometheus 格式的 'name{label="value"}'，多个 worker 的快照按 series 直接相加
+# ===========================
+_collectors = {}
+
+
+def series(name, **labels):
+    if not labels:
+        return name
+    label_str = ','.join(
+        '{0}="{1}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels.items()
+    )
+    return f'{name}{{{label_str}}}'
+
+
+def register_collector(name, collector):
+    _collectors[name] = collector
+
+
+def empty_snapshot():
+    return {'counters': {}, 'gauges': {}, 'histograms': {}}
+
+
+def merge_snapshot(target, snapshot):
+    for kind in ('counters', 'gauges'):
+        for key, value in snapshot.get(kind, {}).items():
+            target[kind][key] = target[kind].get(key, 0) + value
+    for key, histogram in snapshot.get('histograms', {}).items():
+        merged = target['histograms'].get(key)
+        if merged is None or merged['buckets'] != histogram['buckets']:
+            target['histograms'][key] = {
+                'buckets': list(histogram['buckets']), 'counts': list(histogram['counts']),
+                'count': histogram['count'], 'sum': histogram['sum'],
+            }
+            continue
+        merged['counts'] = [a + b for a, b in zip(merged['counts'], histogram['counts'])]
+        merged['count'] += histogram['count']
+        merged['sum'] += histogram['sum']
+    return target
+
+
+def collect():
+    snapshot = empty_snapshot()
+    for name, collector in list(_collectors.items()):
+        try:
+            merge_snapshot(snapshot, collector())
+        except Exception as e:
+            logger.error(f'metrics_collect_error {e=} {name=}')
+    return snapshot
+
+
+def _split_series(key):
+    name, _, labels = key.partition('{')
+    return name, labels.rstrip('}')
+
+
+def render_prometheus(snapshot):
+    lines = []
+    typed = set()
+
+    def _type(name, kind):
+        if name not in typed:
+            typed.add(name)
+            lines.append(f'# TYPE {name} {kind}')
+
+    for kind, prom_type in (('counters', 'counter'), ('gauges', 'gauge')):
+        for key in sorted(snapshot.get(kind, {})):
+            _type(_split_series(key)[0], prom_type)
+            lines.append(f'{key} {snapshot[kind][key]}')
+    for key in sorted(snapshot.get('histograms', {})):
+        histogram = snapshot['histograms'][key]
+        name, labels = _split_series(key)
+        _type(name, 'histogram')
+        prefix = f'{labels},' if labels else ''
+        cumulative = 0
+        for bucket, count in zip(list(histogram['buckets']) + ['+Inf'], histogram['counts']):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{prefix}le="{bucket}"}} {cumulative}')
+        suffix = f'{{{labels}}}' if labels else ''
+        lines.append(f'{name}_sum{suffix} {histogram["sum"]}')
+        lines.append(f'{name}_count{suffix} {histogram["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+class MultiProcessExporter(object):
+    """
+    @summary: gunicorn 多 worker 汇总，每个 worker 定期把本进程快照写到 directory/<pid>.json，
+    /metrics 读取所有未过期的文件相加；超过 stale_after 未更新的文件视为已退出的 worker 并删除
+    """
+
+    def __init__(self, directory, interval=5.0, stale_after=60.0):
+        self.directory = directory
+        self.interval = interval
+        self.stale_after = stale_after
+        self._task = None
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, f'{os.getpid()}.json')
+
+    def dump(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(collect(), f)
+        os.replace(tmp_path, self.path)
+
+    def aggregate(self):
+        self.dump()
+        snapshot = empty_snapshot()
+        now = time.time()
+        for file_name in os.listdir(self.directory):
+            if not file_name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, file_name)
+            try:
+                if now - os.path.getmtime(path) > self.stale_after:
+                    os.remove(path)
+                    continue
+                with open(path) as f:
+                    merge_snapshot(snapshot, json.load(f))
+            except (OSError, ValueError) as e:
+                logger.error(f'metrics_aggregate_error {e=} {path=}')
+        return snapshot
+
+    def ensure_started(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                self.dump()
+            except Exception as e:
+                logger.error(f'metrics_dump_error {e=}')
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,214 @@
+import collections
+import logging
+import pickle
+import re
+import threading
+import time
+from collections import defaultdict
+
+from cacheout import LRUCache
+
+from .metrics import register_collector, series
+from .mysql_utils import md
+
+logger = logging.getLogger(__name__)
+
+_table_name = r'`?(?:\w+`?\.`?)?(\w+)`?'
+_read_tables_re = re.compile(r'\b(?:from|join)\s+' + _table_name, re.IGNORECASE)
+_comma_tables_re = re.compile(r'\bfrom\s+([`\w.]+(?:\s+(?:as\s+)?\w+)?(?:\s*,\s*[`\w.]+(?:\s+(?:as\s+)?\w+)?)+)',
+                              re.IGNORECASE)
+_comment_re = re.compile(r'/\*.*?\*/|(?:--\s|#)[^\n]*', re.DOTALL)
+_write_statement_re = re.compile(r'^\s*(?:insert|update|delete|replace|alter|drop|truncate)\b', re.IGNORECASE)
+_write_tables_re = re.compile(
+    r'^\s*(?:(?:insert|replace)(?:\s+(?:low_priority|delayed|high_priority|ignore))*(?:\s+into)?'
+    r'|update(?:\s+(?:low_priority|ignore))*'
+    r'|delete(?:\s+(?:low_priority|quick|ignore))*(?:\s+from)?'
+    r'|truncate(?:\s+table)?|alter\s+table|drop\s+table(?:\s+if\s+exists)?)\s+' + _table_name,
+    re.IGNORECASE)
+_table_ref_re = re.compile(r'[`\w.]+')
+_join_keywords = {'inner', 'left', 'right', 'cross', 'outer', 'natural', 'straight_join'}
+_update_tables_re = re.compile(r'^\s*update(?:\s+(?:low_priority|ignore))*\s+(.+?)\s+set\b', re.IGNORECASE | re.DOTALL)
+_uncacheable_re = re.compile(r'\bfor\s+update\b|\block\s+in\s+share\s+mode\b|\b(?:now|rand|uuid)\s*\(', re.IGNORECASE)
+
+# 解析不出表名的写入语句使所有缓存失效，每个缓存 key 都带上它的版本号
+ALL_TABLES = '*'
+# prepare() 的返回值，key 为数据库、语句和参数的摘要，tables 为语句读取的表（含 ALL_TABLES）
+QueryKey = collections.namedtuple('QueryKey', ['key', 'tables', 'ttl'])
+_missing = object()
+
+
+def read_tables(sql):
+    tables = {table.lower() for table in _read_tables_re.findall(sql)}
+    for table_list in _comma_tables_re.findall(sql):
+        for table in table_list.split(','):
+            tables.add(table.split()[0].strip('`').rsplit('.', 1)[-1].strip('`').lower())
+    return tables
+
+
+def strip_comments(sql):
+    return _comment_re.sub(' ', sql)
+
+
+def is_write(sql):
+    return bool(_write_statement_re.match(strip_comments(sql)))
+
+
+def written_tables(sql):
+    """
+    @summary: 写入语句涉及的所有表（被写入的表和 join / 子查询读取的表），多表 update / delete 也不会漏掉；
+    不是写入语句返回空集合，是写入语句但解析不出表名返回 {ALL_TABLES}
+    """
+    sql = strip_comments(sql)
+    if not _write_statement_re.match(sql):
+        return set()
+    tables = read_tables(sql)
+    match = _write_tables_re.match(sql)
+    if match:
+        tables.add(match.group(1).lower())
+    match = _update_tables_re.match(sql)
+    if match:
+        # update a, b set ... / update a join b on ... set ...
+        for table_ref in re.split(r',|\bjoin\b', match.group(1), flags=re.IGNORECASE):
+            words = table_ref.split()
+            if words and _table_ref_re.fullmatch(words[0]) and words[0].lower() not in _join_keywords:
+                tables.add(words[0].strip('`').rsplit('.', 1)[-1].strip('`').lower())
+    return tables or {ALL_TABLES}
+
+
+class QueryCache(object):
+    """
+    @summary: MysqlUtils.query 的结果缓存，key 为数据库、sql 和参数的摘要加上语句读取的各表的版本号；
+    execute 写入语句后涉及的表版本号加一，旧版本的缓存不再命中，由 TTL 过期清理；未命中时从主库读取后写入缓存。
+    结果保存在进程内 LRU 中，传入 redis 客户端时同时写入 redis 供其他 worker 共享，表版本号也保存在 redis 中，
+    其他 worker 的写入最多 version_ttl 秒后可见；不传 redis 时版本号只在本进程内，其他 worker 的写入靠 TTL 过期
+    """
+
+    def __init__(self, name='mysql', maxsize=10000, default_ttl=0, redis=None, version_ttl=1.0,
+                 max_result_rows=1000, key_prefix='mysql_query_cache'):
+        self.name = name
+        self.default_ttl = default_ttl  # 0 表示只缓存显式传入 cache_ttl 的查询
+        self.redis = redis  # MysqlUtils 使用同步客户端（redis.Redis），AsyncMysqlUtils 使用 aioredis.Redis
+        self.version_ttl = version_ttl
+        self.max_result_rows = max_result_rows
+        self.key_prefix = key_prefix
+        self.counters = defaultdict(int)
+        self._results = LRUCache(maxsize=maxsize)
+        self._versions = {}  # table -> (version, 从 redis 读取的时间)
+        self._lock = threading.Lock()
+        register_collector(f'mysql_query_cache_{name}', self.collect)
+
+    def incr(self, counter, value=1):
+        with self._lock:
+            self.counters[counter] += value
+
+    def prepare(self, sql, param=None, ttl=None, database=''):
+        """
+        @param database: 连接的 host:port/db，多个库共用一个 QueryCache 或 redis 时区分相同的语句
+        @return QueryKey，不缓存的查询返回 None
+        """
+        ttl = self.default_ttl if ttl is None else ttl
+        if not ttl or _uncacheable_re.search(sql):
+            return None
+        tables = read_tables(sql)
+        if not tables:
+            return None
+        # 字符串常量中的空白是语句的一部分，只去掉首尾空白
+        return QueryKey(md((database, sql.strip(), param)), tuple(sorted(tables | {ALL_TABLES})), ttl)
+
+    @staticmethod
+    def tables_written(sql):
+        return sorted(written_tables(sql))
+
+    def stale_tables(self, tables):
+        """
+        @return 需要从 redis 重新读取版本号的表，不使用 redis 时为空
+        """
+        if self.redis is None:
+            return []
+        now = time.monotonic()
+        return [
+            table for table in tables
+            if table not in self._versions or now - self._versions[table][1] >= self.version_ttl
+        ]
+
+    def version_keys(self, tables):
+        return [f'{self.key_prefix}:version:{table}' for table in tables]
+
+    def set_versions(self, tables, versions):
+        now = time.monotonic()
+        with self._lock:
+            for table, version in zip(tables, versions):
+                self._versions[table] = (int(version or 0), now)
+
+    def bump_versions(self, tables, versions=None):
+        """
+        @param versions: redis INCR 之后的版本号，不使用 redis 时为 None，本地加一
+        """
+        if versions is not None:
+            self.set_versions(tables, versions)
+        else:
+            now = time.monotonic()
+            with self._lock:
+                for table in tables:
+                    self._versions[table] = (self._versions.get(table, (0, now))[0] + 1, now)
+        self.incr('invalidations', len(tables))
+
+    def cache_key(self, query_key):
+        versions = '.'.join(str(self._versions.get(table, (0,))[0]) for table in query_key.tables)
+        return f'{self.key_prefix}:{query_key.key}:{versions}'
+
+    def get_local(self, cache_key):
+        result = self._results.get(cache_key, default=_missing)
+        if result is _missing:
+            return False, None
+        self.incr('hit_local')
+        return True, self.copy_result(result)
+
+    @staticmethod
+    def copy_result(result):
+        # 调用方修改返回的行时不影响缓存中的结果
+        if not result:
+            return result
+        return [dict(row) if isinstance(row, dict) else row for row in result]
+
+    def set_local(self, cache_key, result, ttl):
+        if result is not None and len(result) > self.max_result_rows:
+            self.incr('too_large')
+            return False
+        self._results.set(cache_key, result, ttl=ttl)
+        return True
+
+    @staticmethod
+    def dumps(result):
+        return pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def loads(data):
+        return pickle.loads(data)
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = counters.get('hit_local', 0) + counters.get('hit_redis', 0) + counters.get('miss', 0)
+        hits = counters.get('hit_local', 0) + counters.get('hit_redis', 0)
+        return dict(counters=counters, size=self._results.size(), hit_ratio=hits / lookups if lookups else 0.0)
+
+    def collect(self):
+        with self._lock:
+            counters = dict(self.counters)
+        return {
+            'counters': {
+                series('mysql_query_cache_total', cache=self.name, event=event): value
+                for event, value in counters.items()
+            },
+            'gauges': {series('mysql_query_cache_size', cache=self.name): self._results.size()},
+        }
+
+
+def build_query_cache(enabled=False, **kwargs):
+    """
+    @summary: 按 pic_web_mysql_query_cache 配置创建 QueryCache，未开启时返回 None
+    """
+    if not enabled:
+        return None
+    return QueryCache(**kwargs)
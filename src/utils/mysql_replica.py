@@ -0,0 +1,107 @@
+import contextlib
+import contextvars
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_force_primary = contextvars.ContextVar('mysql_force_primary', default=False)
+
+
+@contextlib.contextmanager
+def force_primary():
+    """
+    @summary: 在上下文内所有读请求都走主库，用于写后立即读（read-your-writes）的场景
+    """
+    token = _force_primary.set(True)
+    try:
+        yield
+    finally:
+        _force_primary.reset(token)
+
+
+def is_force_primary():
+    return _force_primary.get()
+
+
+class ReplicaNode(object):
+    __slots__ = ('name', 'config', 'pool', 'outstanding', 'failures', 'ejected_until')
+
+    def __init__(self, name, config, pool=None):
+        self.name = name
+        self.config = config
+        self.pool = pool
+        self.outstanding = 0  # 正在执行的请求数
+        self.failures = 0  # 连续失败次数
+        self.ejected_until = 0.0
+
+    def snapshot(self):
+        return dict(
+            name=self.name,
+            outstanding=self.outstanding,
+            failures=self.failures,
+            ejected=self.ejected_until > time.monotonic(),
+        )
+
+
+class ReplicaSelector(object):
+    """
+    @summary: 从库选择器，round_robin 轮询或 least_outstanding 选正在执行请求最少的节点；
+    连续失败 max_failures 次的节点会被摘除 eject_seconds 秒，到期后重新参与选择
+    """
+    strategies = ('round_robin', 'least_outstanding')
+
+    def __init__(self, nodes, strategy='round_robin', max_failures=3, eject_seconds=30):
+        assert strategy in self.strategies, f'unknown replica strategy {strategy}'
+        self.nodes = list(nodes)
+        self.strategy = strategy
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def choose(self):
+        """
+        @return 可用的 ReplicaNode，全部被摘除时返回 None（调用方回退到主库）
+        """
+        now = time.monotonic()
+        with self._lock:
+            healthy = [node for node in self.nodes if node.ejected_until <= now]
+            if not healthy:
+                return None
+            if self.strategy == 'least_outstanding':
+                node = min(healthy, key=lambda _: _.outstanding)
+            else:
+                node = healthy[next(self._counter) % len(healthy)]
+            node.outstanding += 1
+        return node
+
+    def release(self, node, failed=False):
+        with self._lock:
+            node.outstanding -= 1
+            if not failed:
+                node.failures = 0
+                return
+            node.failures += 1
+            if node.failures >= self.max_failures:
+                node.ejected_until = time.monotonic() + self.eject_seconds
+                node.failures = 0
+                logger.error('mysql_replica_ejected name:%s eject_seconds:%s', node.name, self.eject_seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return [node.snapshot() for node in self.nodes]
+
+    @classmethod
+    def from_config(cls, primary_config, replicas, **kwargs):
+        """
+        @summary: replicas 中未配置的字段（账号、库名等）继承主库配置
+        """
+        nodes = []
+        for replica in replicas:
+            config = {**primary_config, **replica}
+            nodes.append(ReplicaNode(name='{host}:{port}'.format(host=config.get('host'), port=config.get('port')),
+                                     config=config))
+        return cls(nodes, **kwargs)
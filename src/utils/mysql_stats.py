@@ -0,0 +1,138 @@
+import functools
+import logging
+import re
+import threading
+from collections import defaultdict
+
+from .metrics import Histogram, record_timing, register_collector, series
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger(__name__ + '.slow')
+
+_sql_string_re = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_sql_placeholder_re = re.compile(r'%\(\w+\)s|%s|\b\d+(?:\.\d+)?\b')
+_sql_in_list_re = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_sql_values_re = re.compile(r'(\(\?\+?\))(?:\s*,\s*\(\?\+?\))+')
+_sql_space_re = re.compile(r'\s+')
+
+
+@functools.lru_cache(maxsize=2048)
+def normalize_sql(sql):
+    """
+    @summary: 把字面量和占位符替换为 ?，合并 IN 列表和多行 VALUES，用于按语句模板聚合
+    """
+    sql = _sql_string_re.sub('?', sql)
+    sql = _sql_placeholder_re.sub('?', sql)
+    sql = _sql_in_list_re.sub('(?+)', sql)
+    sql = _sql_values_re.sub(r'\1+', sql)
+    return _sql_space_re.sub(' ', sql).strip()
+
+
+class MysqlStats(object):
+    """
+    @summary: 连接池取连接等待时间、按语句模板的执行耗时直方图和慢查询日志，进程内读取 snapshot() 或通过 /metrics/mysql 查看
+    """
+    other_statement = '__other__'
+
+    def __init__(self, slow_query_threshold=0.5, max_statements=500):
+        self.slow_query_threshold = slow_query_threshold  # 秒，None 表示不记录慢查询
+        self.max_statements = max_statements  # 最多单独统计的语句模板数，超出的合并到 __other__
+        self.checkout_wait = Histogram()
+        self.statements = {}
+        self.counters = defaultdict(int)
+        self.hooks = []
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook):
+        """
+        @summary: hook(event, **fields)，event 为 checkout / query，在调用线程中同步执行
+        """
+        self.hooks.append(hook)
+
+    def register_pool(self, name, stats_func):
+        self._pools[name] = stats_func
+
+    def _emit(self, event, **fields):
+        for hook in self.hooks:
+            try:
+                hook(event, **fields)
+            except Exception as e:
+                logger.error(f'mysql_stats_hook_error {e=} {event=}')
+
+    def observe_checkout(self, wait, error=False):
+        record_timing('mysql_pool', wait)
+        self.checkout_wait.observe(wait)
+        with self._lock:
+            self.counters['checkouts'] += 1
+            if error:
+                self.counters['checkout_errors'] += 1
+        if self.hooks:
+            self._emit('checkout', wait=wait, error=error)
+
+    def observe_query(self, sql, param, duration, error=False):
+        record_timing('mysql', duration)
+        statement = normalize_sql(sql)
+        histogram = self.statements.get(statement)
+        if histogram is None:
+            with self._lock:
+                if len(self.statements) >= self.max_statements:
+                    statement = self.other_statement
+                histogram = self.statements.setdefault(statement, Histogram())
+        histogram.observe(duration)
+        is_slow = self.slow_query_threshold is not None and duration >= self.slow_query_threshold
+        with self._lock:
+            self.counters['queries'] += 1
+            if error:
+                self.counters['query_errors'] += 1
+            if is_slow:
+                self.counters['slow_queries'] += 1
+        if is_slow:
+            slow_logger.warning('mysql_slow_query duration:%.4f sql:%s param:%.200s', duration, statement, param)
+        if self.hooks:
+            self._emit('query', statement=statement, duration=duration, error=error, slow=is_slow)
+
+    def pool_snapshot(self):
+        pools = {}
+        for name, stats_func in list(self._pools.items()):
+            try:
+                pools[name] = stats_func()
+            except Exception as e:
+                pools[name] = dict(error=f'{e}')
+        return pools
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self.counters)
+            statements = dict(self.statements)
+        return dict(
+            counters=counters,
+            pools=self.pool_snapshot(),
+            checkout_wait=self.checkout_wait.snapshot(),
+            statements={statement: histogram.snapshot() for statement, histogram in statements.items()},
+        )
+
+    def collect(self):
+        with self._lock:
+            counters = dict(self.counters)
+            statements = dict(self.statements)
+        gauges = {}
+        for pool_name, pool_stats in self.pool_snapshot().items():
+            for key, value in pool_stats.items():
+                if isinstance(value, (int, float)):
+                    gauges[series(f'mysql_pool_{key}', pool=pool_name)] = value
+        return {
+            'counters': {series(f'mysql_{key}_total'): value for key, value in counters.items()},
+            'gauges': gauges,
+            'histograms': {
+                series('mysql_pool_checkout_wait_seconds'): self.checkout_wait.snapshot(),
+                **{
+                    series('mysql_query_duration_seconds', statement=statement): histogram.snapshot()
+                    for statement, histogram in statements.items()
+                },
+            },
+        }
+
+
+mysql_stats = MysqlStats()
+register_collector('mysql', mysql_stats.collect)
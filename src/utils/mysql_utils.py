@@ -1,15 +1,24 @@
 import logging
 
 import pymysql
-from pymysql.cursors import DictCursor
+from pymysql.cursors import DictCursor, SSCursor, SSDictCursor
 
+import functools
 import hashlib
 import logging
+import os
+import time
 
 from dbutils.pooled_db import PooledDB
 
+from .mysql_replica import ReplicaSelector, is_force_primary
+from .mysql_stats import mysql_stats
+
 logger = logging.getLogger(__name__)
 
+# 连接级别的错误，从库出现这些错误时计入健康检查并回退到主库重试
+CONNECTION_ERRORS = (pymysql.err.OperationalError, pymysql.err.InterfaceError)
+
 
 def md(obj):
     md5 = hashlib.md5()
@@ -19,13 +28,61 @@ def md(obj):
 
 class BaseDBlUtils(object):
     _cache_pool = {}
+    upsert_chunk_size = 500  # insert_or_update_many 每条语句最多包含的行数
+    upsert_max_packet_size = 1024 * 1024  # 每条语句的预估最大字节数，需小于 mysql max_allowed_packet
+
+    replica_option_keys = {
+        'replica_strategy': 'strategy',
+        'replica_max_failures': 'max_failures',
+        'replica_eject_seconds': 'eject_seconds',
+    }
+
+    def __init__(self, query_cache=None, **kwargs):
+        """
+        @param query_cache: mysql_query_cache.QueryCache，None 表示 query 不缓存结果
+        """
+        self.query_cache = query_cache
+        conn = self._normalize_conn(kwargs)
+        replicas = conn.pop('replicas', None) or []
+        replica_options = {
+            option: conn.pop(key) for key, option in self.replica_option_keys.items() if key in conn
+        }
+        self._db_config = {**conn}
+        self._database = self._pool_name(self._db_config)
+        # 连接池在当前进程首次使用时创建，见 _check_pid
+        self._pool = None
+        self._pid = None
+        self._replicas = self._init_replicas(replicas, replica_options)
+
+    def _check_pid(self):
+        """
+        @summary: fork 出的子进程丢弃从父进程继承的连接池引用，重新创建自己的连接，不与父进程共用 socket
+        """
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._pool = None
+        for node in self._replicas.nodes if self._replicas is not None else ():
+            node.pool = None
 
-    def __init__(self, **kwargs):
+    @classmethod
+    def _normalize_conn(cls, kwargs):
         conn = {**kwargs}
-        if 'user' not in conn:
+        if 'user' not in conn and 'username' in conn:
             conn['user'] = conn.pop('username')
-        self._db_config = {**conn}
-        self._pool = self._get_pool(**self._db_config)
+        return conn
+
+    def _init_replicas(self, replicas, replica_options):
+        if not replicas:
+            return None
+        replicas = [self._normalize_conn(replica) for replica in replicas]
+        # 从库连接池在首次使用时才创建
+        return ReplicaSelector.from_config(self._db_config, replicas, **replica_options)
+
+    def _choose_replica(self, readonly):
+        if not readonly or self._replicas is None or is_force_primary():
+            return None
+        return self._replicas.choose()
 
     @classmethod
     def _connect_default(cls):
@@ -49,23 +106,201 @@ class BaseDBlUtils(object):
         """
         connect = {**cls._connect_default()}
         connect.update(**kwargs)
-        cache_key = md(tuple((_, connect[_]) for _ in sorted(connect))).encode()
+        # key 带上 pid，fork 后的子进程不会拿到父进程的连接池
+        cache_key = (os.getpid(), md(tuple((_, connect[_]) for _ in sorted(connect))))
         if cache_key not in cls._cache_pool:
-            cls._cache_pool[cache_key] = PooledDB(**connect)
+            pool = cls._cache_pool[cache_key] = PooledDB(**connect)
+            mysql_stats.register_pool(cls._pool_name(connect), functools.partial(cls._pool_stats, pool))
         return cls._cache_pool[cache_key]
 
-    def query(self, sql, param=None):
-        result = self._query(sql, param, fetch=True)
-        return result
+    @staticmethod
+    def _pool_name(connect):
+        return '{host}:{port}/{database}'.format(
+            host=connect.get('host'), port=connect.get('port'), database=connect.get('database', connect.get('db')))
+
+    @staticmethod
+    def _pool_stats(pool):
+        return dict(
+            in_use=pool._connections,
+            idle=len(pool._idle_cache),
+            maxconnections=pool._maxconnections,
+            maxcached=pool._maxcached,
+        )
+
+    def _run_steps(self, steps):
+        """
+        @summary: 驱动 *_steps 生成器：生成器 yield 无参的 IO 调用（execute、redis 命令等），执行后把结果或异常送回生成器，
+        SQL 拼接、分片、计数、缓存和日志都在生成器中，同步和异步版本只在这里区分是否 await
+        @return 生成器的返回值
+        """
+        try:
+            call = next(steps)
+            while True:
+                try:
+                    result = call()
+                except Exception as e:
+                    call = steps.throw(e)
+                else:
+                    call = steps.send(result)
+        except StopIteration as stop:
+            return stop.value
+
+    def query(self, sql, param=None, cache_ttl=None):
+        """
+        @param cache_ttl: 开启 query_cache 时结果缓存的秒数，None 使用 query_cache.default_ttl，0 表示不缓存
+        """
+        return self._run_steps(self._query_steps(sql, param, cache_ttl))
+
+    def _query_steps(self, sql, param, cache_ttl):
+        query_key = self._prepare_query_cache(sql, param, cache_ttl)
+        if query_key is None:
+            return (yield functools.partial(self._query, sql, param, fetch=True, readonly=True))
+        cache = self.query_cache
+        try:
+            stale_tables = cache.stale_tables(query_key.tables)
+            if stale_tables:
+                cache.set_versions(
+                    stale_tables, (yield functools.partial(cache.redis.mget, cache.version_keys(stale_tables))))
+            cache_key = cache.cache_key(query_key)
+            hit, result = cache.get_local(cache_key)
+            if hit:
+                return result
+            if cache.redis is not None:
+                data = yield functools.partial(cache.redis.get, cache_key)
+                if data is not None:
+                    result = cache.loads(data)
+                    cache.set_local(cache_key, result, query_key.ttl)
+                    cache.incr('hit_redis')
+                    return cache.copy_result(result)
+        except Exception as e:
+            cache.incr('errors')
+            logger.error(f'mysql_query_cache_get_error {e=} {sql=}')
+            return (yield functools.partial(self._query, sql, param, fetch=True, readonly=True))
+        cache.incr('miss')
+        # 写入缓存的结果从主库读取，避免从库延迟时把写入之前的旧结果缓存到新版本号下
+        result = yield functools.partial(self._query, sql, param, fetch=True)
+        try:
+            if cache.set_local(cache_key, result, query_key.ttl) and cache.redis is not None:
+                yield functools.partial(cache.redis.set, cache_key, cache.dumps(result), ex=query_key.ttl)
+        except Exception as e:
+            cache.incr('errors')
+            logger.error(f'mysql_query_cache_set_error {e=} {sql=}')
+        return cache.copy_result(result)
+
+    def _prepare_query_cache(self, sql, param, cache_ttl):
+        if self.query_cache is None or is_force_primary():
+            return None
+        query_key = self.query_cache.prepare(sql, param, cache_ttl, database=self._database)
+        if query_key is None:
+            self.query_cache.incr('bypass')
+        return query_key
+
+    def _invalidate_query_cache(self, sql):
+        return self._run_steps(self._invalidate_query_cache_steps(sql))
+
+    def _invalidate_query_cache_steps(self, sql):
+        """
+        @summary: 写入语句执行后把涉及的表的版本号加一，使用 redis 时 INCR redis 中的版本号
+        """
+        tables = self.query_cache.tables_written(sql) if self.query_cache is not None else None
+        if not tables:
+            return
+        cache = self.query_cache
+        if cache.redis is None:
+            cache.bump_versions(tables)
+            return
+        try:
+            versions = []
+            for key in cache.version_keys(tables):
+                versions.append((yield functools.partial(cache.redis.incr, key)))
+            cache.bump_versions(tables, versions)
+        except Exception as e:
+            cache.bump_versions(tables)
+            cache.incr('errors')
+            logger.error(f'mysql_query_cache_invalidate_error {e=} {tables=}')
+
+    def query_iter(self, sql, param=None, chunk_size=1000, as_dict=True):
+        """
+        @summary: 基于服务端游标(SSCursor/SSDictCursor)的流式查询，每次从 mysql 拉取 chunk_size 行，不在内存中缓存整个结果集
+        提前 break 时生成器被关闭，游标会读完剩余结果后再把连接归还连接池
+        @return 逐行返回 dict（as_dict=False 时为 tuple）的生成器
+        """
+        logger.debug('debug_query_iter sql:%s param:%s chunk_size:%s', sql, param, chunk_size)
+        replica = self._choose_replica(readonly=True)
+        failed = False
+        _conn = _cursor = None
+        try:
+            _conn = self._get_conn(self._get_conn_pool(replica))
+            _cursor = _conn.cursor(SSDictCursor if as_dict else SSCursor)
+            start = time.perf_counter()
+            try:
+                if param:
+                    _cursor.execute(sql, param)
+                else:
+                    _cursor.execute(sql)
+            except Exception:
+                mysql_stats.observe_query(sql, param, time.perf_counter() - start, error=True)
+                raise
+            mysql_stats.observe_query(sql, param, time.perf_counter() - start)
+            while True:
+                rows = _cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield from rows
+        except CONNECTION_ERRORS:
+            failed = True
+            raise
+        finally:
+            self._close(_conn, _cursor)
+            if replica is not None:
+                self._replicas.release(replica, failed=failed)
 
     def _conn_cursor(self, conn):
         return conn.cursor()
 
-    def _query(self, sql, param=None, many=False, fetch=False):
+    def _query(self, sql, param=None, many=False, fetch=False, readonly=False):
         logger.debug('debug_query sql:%s param:%s many:%s fetch:%s', sql, param, many, fetch)
-        _conn = self._get_conn()
+        replica = self._choose_replica(readonly)
+        if replica is not None:
+            failed = False
+            try:
+                return self._execute_query(self._get_conn_pool(replica), sql, param, many, fetch)
+            except CONNECTION_ERRORS as e:
+                failed = True
+                logger.error(f'mysql_replica_query_error {e=} replica={replica.name}')
+            finally:
+                self._replicas.release(replica, failed=failed)
+        return self._execute_query(self._get_conn_pool(), sql, param, many, fetch)
+
+    def _get_conn_pool(self, replica=None):
+        self._check_pid()
+        if replica is not None:
+            if replica.pool is None:
+                replica.pool = self._get_pool(**replica.config)
+            return replica.pool
+        if self._pool is None:
+            self._pool = self._get_pool(**self._db_config)
+        return self._pool
+
+    def warm_up(self, connections=1):
+        """
+        @summary: 预先建立 connections 个主库连接并放回连接池（不超过 maxcached 的部分会保留为空闲连接）
+        """
+        conns = []
+        try:
+            for _ in range(connections):
+                conns.append(self._get_conn())
+        finally:
+            for _conn in conns:
+                self._close(_conn, None)
+        return len(conns)
+
+    def _execute_query(self, pool, sql, param=None, many=False, fetch=False):
+        _conn = self._get_conn(pool)
         _cursor = None
         result = None
+        start = time.perf_counter()
+        error = False
         try:
             _cursor = self._conn_cursor(_conn)
             if many:
@@ -78,12 +313,22 @@ class BaseDBlUtils(object):
                 result = execute_func(sql)
             if fetch:
                 result = _cursor.fetchall()
+        except Exception:
+            error = True
+            raise
         finally:
+            mysql_stats.observe_query(sql, param, time.perf_counter() - start, error=error)
             self._close(_conn, _cursor)
         return result
 
-    def _get_conn(self):
-        _conn = self._pool.connection()
+    def _get_conn(self, pool=None):
+        start = time.perf_counter()
+        try:
+            _conn = (self._get_conn_pool() if pool is None else pool).connection()
+        except Exception:
+            mysql_stats.observe_checkout(time.perf_counter() - start, error=True)
+            raise
+        mysql_stats.observe_checkout(time.perf_counter() - start)
         return _conn
 
     def _close(self, _conn, _cursor):
@@ -98,10 +343,16 @@ class BaseDBlUtils(object):
             logger.error('mysql_close_error e:{e}'.format(e=e))
 
     def execute(self, sql, param=None):
-        return self._query(sql, param)
+        try:
+            return self._query(sql, param)
+        finally:
+            self._invalidate_query_cache(sql)
 
     def execute_many(self, sql, param=None):
-        return self._query(sql, param, True)
+        try:
+            return self._query(sql, param, True)
+        finally:
+            self._invalidate_query_cache(sql)
 
     @staticmethod
     def gen_insert_duplicate_dict_params_sql(table_name, data, where):
@@ -118,8 +369,55 @@ class BaseDBlUtils(object):
         )
         return insert_duplicate_dict_params_sql
 
-    def update(self, table_name, where, results):
-        fields_list = results[0].keys() if isinstance(results, list) else results.keys()
+    @staticmethod
+    def gen_insert_duplicate_many_sql(table_name, fields_list, where, rows_count):
+        assert len(set(where) - set(fields_list)) == 0
+        fields = ','.join('`{0}`'.format(field) for field in fields_list)
+        row_values = '({0})'.format(','.join(['%s'] * len(fields_list)))
+        update_fields = [field for field in fields_list if field not in where] or fields_list[:1]
+        update_fields_values = ','.join('`{0}`=VALUES(`{0}`)'.format(field) for field in update_fields)
+        insert_duplicate_many_sql = """INSERT INTO {table_name} ({fields}) VALUES {values} ON DUPLICATE KEY UPDATE {update_fields_values}""".format(
+            table_name=table_name,
+            fields=fields,
+            values=','.join([row_values] * rows_count),
+            update_fields_values=update_fields_values,
+        )
+        return insert_duplicate_many_sql
+
+    @classmethod
+    def _iter_upsert_chunks(cls, table_name, where, results, chunk_size=None, max_packet_size=None):
+        """
+        @summary: 把 results 按行数和预估字节数切分成多条 multi-row INSERT ... ON DUPLICATE KEY UPDATE
+        @return (sql, params, rows_count) 的生成器
+        """
+        chunk_size = chunk_size or cls.upsert_chunk_size
+        max_packet_size = max_packet_size or cls.upsert_max_packet_size
+        fields_list = list(results[0].keys())
+        base_size = len(cls.gen_insert_duplicate_many_sql(table_name, fields_list, where, 1))
+        chunk_params, chunk_rows, chunk_bytes = [], 0, base_size
+        for result in results:
+            row_params = [result[field] for field in fields_list]
+            # 按 str 长度加引号/逗号估算转义后的大小，宁大勿小
+            row_bytes = sum(len(str(_)) + 3 for _ in row_params) + 3
+            if chunk_rows and (chunk_rows >= chunk_size or chunk_bytes + row_bytes > max_packet_size):
+                yield cls.gen_insert_duplicate_many_sql(table_name, fields_list, where, chunk_rows), chunk_params, chunk_rows
+                chunk_params, chunk_rows, chunk_bytes = [], 0, base_size
+            chunk_params.extend(row_params)
+            chunk_rows += 1
+            chunk_bytes += row_bytes
+        if chunk_rows:
+            yield cls.gen_insert_duplicate_many_sql(table_name, fields_list, where, chunk_rows), chunk_params, chunk_rows
+
+    @staticmethod
+    def _upsert_counts(upsert_counts, rows_count, affected):
+        # 未开启 CLIENT_FOUND_ROWS 时 ON DUPLICATE KEY UPDATE 每行的 affected rows 为：新插入 1，更新 2，值未变化 0，
+        # 只有总和无法还原插入和更新各自的行数，因此只统计 rows 和 affected
+        upsert_counts['rows'] += rows_count
+        upsert_counts['affected'] += affected or 0
+        return upsert_counts
+
+    @staticmethod
+    def gen_update_sql(table_name, where, fields_list):
         update_fields_values = ','.join(
             '`{0}`=%({0})s'.format(field) for field in set(fields_list) - set(where))
         where_fields_values = ' and '.join('`{0}`=%({0})s'.format(field) for field in where)
@@ -128,12 +426,47 @@ class BaseDBlUtils(object):
             where_fields_values=where_fields_values,
             update_fields_values=update_fields_values,
         )
+        return update_sql
+
+    @staticmethod
+    def gen_insert_sql(table_name, fields_list, ignore=True):
+        fields = ','.join('`{0}`'.format(field) for field in fields_list)
+        values = ','.join('%({0})s'.format(field) for field in fields_list)
+        insert_sql = """{insert} into {table_name} ({fields}) VALUES ({values})""".format(
+            insert='insert ignore' if ignore else 'insert',
+            table_name=table_name,
+            fields=fields,
+            values=values,
+        )
+        return insert_sql
+
+    @classmethod
+    def gen_insert_or_update_sqls(cls, table_name, where, fields_list):
+        fields = ','.join('`{0}`'.format(field) for field in fields_list)
+        where_fields_values = ' and '.join('`{0}`=%({0})s'.format(field) for field in where)
+        select_sql = """select {fields} from {table_name} where {where_fields_values}""".format(
+            fields=fields,
+            table_name=table_name,
+            where_fields_values=where_fields_values,
+        )
+        update_sql = cls.gen_update_sql(table_name, where, fields_list)
+        insert_sql = cls.gen_insert_sql(table_name, fields_list, ignore=False)
+        return select_sql, update_sql, insert_sql
+
+    def update(self, table_name, where, results):
+        return self._run_steps(self._update_steps(table_name, where, results))
+
+    def _write_steps(self, sql, results):
+        if isinstance(results, list):
+            return (yield functools.partial(self.execute_many, sql, param=results))
+        return (yield functools.partial(self.execute, sql, param=results))
+
+    def _update_steps(self, table_name, where, results):
+        fields_list = results[0].keys() if isinstance(results, list) else results.keys()
+        update_sql = self.gen_update_sql(table_name, where, fields_list)
         update_res = None
         try:
-            if isinstance(results, list):
-                update_res = self.execute_many(update_sql, param=results)
-            else:
-                update_res = self.execute(update_sql, param=results)
+            update_res = yield from self._write_steps(update_sql, results)
             logger.debug(
                 'update_success '
                 'table_name:{table_name} '
@@ -150,21 +483,14 @@ class BaseDBlUtils(object):
         return update_res
 
     def insert_ignore(self, table_name, results, ignore=True):
+        return self._run_steps(self._insert_ignore_steps(table_name, results, ignore))
+
+    def _insert_ignore_steps(self, table_name, results, ignore):
         fields_list = results[0].keys() if isinstance(results, list) else results.keys()
-        fields = ','.join('`{0}`'.format(field) for field in fields_list)
-        values = ','.join('%({0})s'.format(field) for field in fields_list)
-        insert_sql = """{insert} into {table_name} ({fields}) VALUES ({values})""".format(
-            insert='insert ignore' if ignore else 'insert',
-            table_name=table_name,
-            fields=fields,
-            values=values,
-        )
+        insert_sql = self.gen_insert_sql(table_name, fields_list, ignore=ignore)
         insert_res = None
         try:
-            if isinstance(results, list):
-                insert_res = self.execute_many(insert_sql, param=results)
-            else:
-                insert_res = self.execute(insert_sql, param=results)
+            insert_res = yield from self._write_steps(insert_sql, results)
             logger.debug(
                 'insert_ignore_success '
                 'table_name:{table_name} '
@@ -183,35 +509,48 @@ class BaseDBlUtils(object):
     def insert(self, table_name, results):
         return self.insert_ignore(table_name, results, ignore=False)
 
+    def insert_or_update_many(self, table_name, where, results, chunk_size=None, max_packet_size=None):
+        """
+        @summary: 批量 upsert，每个分片一次往返，依赖 where 字段上的唯一索引
+        @return dict(rows, affected)，rows 为提交的行数，affected 为 mysql 返回的 affected rows 之和，见 _upsert_counts
+        """
+        return self._run_steps(
+            self._insert_or_update_many_steps(table_name, where, results, chunk_size, max_packet_size))
+
+    def _insert_or_update_many_steps(self, table_name, where, results, chunk_size, max_packet_size):
+        upsert_counts = dict(rows=0, affected=0)
+        if not results:
+            return upsert_counts
+        try:
+            for sql, params, rows_count in self._iter_upsert_chunks(
+                    table_name, where, results, chunk_size, max_packet_size):
+                affected = yield functools.partial(self.execute, sql, param=params)
+                self._upsert_counts(upsert_counts, rows_count, affected)
+            logger.debug(
+                'insert_or_update_many_success '
+                'table_name:{table_name} '
+                'upsert_counts:{upsert_counts}'.format(
+                    table_name=table_name,
+                    upsert_counts=upsert_counts)
+            )
+        except Exception as e:
+            logger.error(
+                'insert_or_update_many_error e:{e} table_name:{table_name} upsert_counts:{upsert_counts}'.format(
+                    e=e, table_name=table_name, upsert_counts=upsert_counts))
+        return upsert_counts
+
     def insert_or_update(self, table_name, where, result):
-        fields_list = result.keys()
-        fields = ','.join('`{0}`'.format(field) for field in fields_list)
-        values = ','.join('%({0})s'.format(field) for field in fields_list)
-        update_fields_values = ','.join(
-            '`{0}`=%({0})s'.format(field) for field in set(fields_list) - set(where))
-        where_fields_values = ' and '.join('`{0}`=%({0})s'.format(field) for field in where)
-        select_sql = """select {fields} from {table_name} where {where_fields_values}""".format(
-            fields=fields,
-            table_name=table_name,
-            where_fields_values=where_fields_values,
-        )
-        update_sql = """update {table_name} set {update_fields_values} where {where_fields_values}""".format(
-            table_name=table_name,
-            where_fields_values=where_fields_values,
-            update_fields_values=update_fields_values,
-        )
-        insert_sql = """insert into {table_name} ({fields}) VALUES ({values})""".format(
-            table_name=table_name,
-            fields=fields,
-            values=values,
-        )
+        return self._run_steps(self._insert_or_update_steps(table_name, where, result))
+
+    def _insert_or_update_steps(self, table_name, where, result):
+        select_sql, update_sql, insert_sql = self.gen_insert_or_update_sqls(table_name, where, result.keys())
         select_res = update_res = insert_res = None
         try:
-            select_res = self.execute(select_sql, param=result)
+            select_res = yield functools.partial(self.execute, select_sql, param=result)
             if select_res:
-                update_res = self.execute(update_sql, param=result)
+                update_res = yield functools.partial(self.execute, update_sql, param=result)
             else:
-                insert_res = self.execute(insert_sql, param=result)
+                insert_res = yield functools.partial(self.execute, insert_sql, param=result)
             logger.debug(
                 'insert_or_update_success '
                 'table_name:{table_name} '
@@ -0,0 +1,33 @@
+import asyncio
+
+from src.ai_picture import service
+from src.ai_picture.batching import BACKENDS, BatchScheduler, PictureBatchBackend, build_batch_scheduler
+
+
+def test_default_backend_calls_get_ai_picture():
+    scheduler = build_batch_scheduler()
+    assert isinstance(scheduler.backend, PictureBatchBackend)
+    assert isinstance(BACKENDS[service.pic_web_ai_picture['model_backend']](), PictureBatchBackend)
+
+    async def main():
+        return await asyncio.gather(*(scheduler.submit(f'question-{index}') for index in range(5)))
+
+    assert asyncio.run(main()) == [service.get_ai_picture(f'question-{index}') for index in range(5)]
+    assert scheduler.batch_size_histogram.count < 5
+
+
+def test_item_error_only_fails_its_caller(monkeypatch):
+    def get_ai_picture(question=''):
+        if question == 'bad':
+            raise ValueError(question)
+        return question
+
+    monkeypatch.setattr(service, 'get_ai_picture', get_ai_picture)
+    scheduler = BatchScheduler(PictureBatchBackend(), max_batch_size=4, max_wait=0.01)
+
+    async def main():
+        return await asyncio.gather(*(scheduler.submit(q) for q in ('ok', 'bad', 'fine')), return_exceptions=True)
+
+    ok, bad, fine = asyncio.run(main())
+    assert (ok, fine) == ('ok', 'fine')
+    assert isinstance(bad, ValueError)
@@ -0,0 +1,24 @@
+import asyncio
+
+import pytest
+
+from src.ai_picture import service
+from src.ai_picture.executor import build_process_pool
+
+
+@pytest.fixture
+def process_pool(monkeypatch):
+    monkeypatch.setitem(service.pic_web_ai_picture, 'batching', False)
+    pool = build_process_pool(process_pool_workers=1, model_backend=service.pic_web_ai_picture['model_backend'])
+    monkeypatch.setattr(service, '_process_pool', pool)
+    yield pool
+    pool.shutdown()
+
+
+def test_process_pool_is_opt_in():
+    assert build_process_pool(process_pool_workers=0) is None
+
+
+def test_process_pool_runs_get_ai_picture(process_pool):
+    question = 'a cat on the moon'
+    assert asyncio.run(service.generate_ai_picture(question)) == service.get_ai_picture(question)
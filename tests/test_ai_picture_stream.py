@@ -0,0 +1,29 @@
+import asyncio
+
+import pytest
+
+from src.ai_picture import service
+
+
+@pytest.fixture(autouse=True)
+def inline_generation(monkeypatch):
+    monkeypatch.setitem(service.pic_web_ai_picture, 'batching', False)
+    monkeypatch.setitem(service.pic_web_ai_picture, 'process_pool_workers', 0)
+    monkeypatch.setattr(service, '_process_pool', None)
+
+
+async def _collect(question, chunk_size):
+    return [chunk async for chunk in service.stream_ai_picture(question, chunk_size=chunk_size)]
+
+
+def test_stream_chunks_generated_picture():
+    question = 'a cat on the moon'
+    chunks = asyncio.run(_collect(question, 4))
+    assert b''.join(chunks) == service.get_ai_picture(question).encode('utf-8')
+    assert all(len(chunk) == 4 for chunk in chunks[:-1])
+
+
+def test_stream_missing_picture_raises_lookup_error(monkeypatch):
+    monkeypatch.setattr(service, 'get_ai_picture', lambda question='': None)
+    with pytest.raises(LookupError):
+        asyncio.run(_collect('missing', 4))
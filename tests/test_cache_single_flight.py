@@ -0,0 +1,64 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from src.cache import CacheBase
+
+
+class FakeCache(CacheBase):
+    fill_lock_lease = 1.0
+    fill_lock_poll_interval = 0.01
+
+    def __init__(self):
+        self.store = {}
+        self.reads = 0
+
+    async def get_cache(self, items):
+        self.reads += 1
+        await asyncio.sleep(0.02)
+        return [self.store[key] for key in map(self.get_cache_key, items) if key in self.store]
+
+    async def save_cache(self, items, only_update_ttl=False):
+        self.store.update({self.get_cache_key(item): item for item in items})
+        return True
+
+
+class LockedFakeCache(FakeCache):
+    fill_lock_enabled = True
+
+
+def _item(item_id):
+    return SimpleNamespace(item_type='t', item_id=item_id)
+
+
+def test_concurrent_misses_without_save_resolve_immediately():
+    cache = FakeCache()
+
+    async def main():
+        start = time.monotonic()
+        results = await asyncio.gather(*(cache.get_cache_single_flight([_item(1)]) for _ in range(3)))
+        return results, time.monotonic() - start
+
+    results, elapsed = asyncio.run(main())
+    assert results == [([], [])] * 3
+    assert cache.reads == 1
+    assert elapsed < cache.fill_lock_lease / 2
+    assert not cache.inflight
+
+
+def test_fill_lock_waiters_receive_saved_item():
+    cache = LockedFakeCache()
+    item = _item(2)
+
+    async def main():
+        owner = await cache.get_cache_single_flight([item])
+        waiter = asyncio.ensure_future(cache.get_cache_single_flight([item]))
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        await cache.save([item])
+        return owner, await waiter
+
+    owner, waited = asyncio.run(main())
+    assert owner == ([], [])
+    assert waited == ([item], [])
+    assert cache.reads == 1
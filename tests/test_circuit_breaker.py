@@ -0,0 +1,119 @@
+import pytest
+
+from src.utils import circuit_breaker
+from src.utils.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+class FakeTime(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_time = FakeTime()
+    monkeypatch.setattr(circuit_breaker, 'time', fake_time)
+    return fake_time
+
+
+def make_breaker(**kwargs):
+    options = dict(window=10.0, buckets=10, min_calls=10, error_rate=0.5, slow_call_threshold=0.1,
+                   slow_call_rate=0.5, open_duration=5.0, half_open_max_calls=2)
+    options.update(kwargs)
+    return CircuitBreaker('test', **options)
+
+
+def call(breaker, duration=0.01, error=False):
+    allowed = breaker.allow()
+    if allowed:
+        breaker.record(duration, error=error)
+    return allowed
+
+
+def trip(breaker):
+    for _ in range(breaker.min_calls):
+        call(breaker, error=True)
+    assert breaker.state == OPEN
+
+
+def test_stays_closed_below_min_calls(clock):
+    breaker = make_breaker()
+    for _ in range(9):
+        call(breaker, error=True)
+    assert breaker.state == CLOSED
+
+
+def test_opens_on_error_rate(clock):
+    breaker = make_breaker()
+    for _ in range(5):
+        call(breaker)
+    for _ in range(5):
+        call(breaker, error=True)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.counters['rejected'] == 1
+
+
+def test_opens_on_slow_call_rate(clock):
+    breaker = make_breaker()
+    for _ in range(10):
+        call(breaker, duration=0.2)
+    assert breaker.state == OPEN
+
+
+def test_old_buckets_leave_the_window(clock):
+    breaker = make_breaker()
+    for _ in range(9):
+        call(breaker, error=True)
+    clock.now += 11
+    for _ in range(9):
+        call(breaker)
+    assert breaker.state == CLOSED
+
+
+def test_half_open_closes_after_successful_probes(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock.now += 5
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+    # 探测调用数达到 half_open_max_calls 后拒绝其他调用
+    assert not breaker.allow()
+    breaker.record(0.01)
+    breaker.record(0.01)
+    assert breaker.state == CLOSED
+    assert breaker.transitions[(OPEN, HALF_OPEN)] == 1
+    assert breaker.transitions[(HALF_OPEN, CLOSED)] == 1
+
+
+@pytest.mark.parametrize('duration, error', [(0.01, True), (0.2, False)])
+def test_half_open_reopens_on_failed_or_slow_probe(clock, duration, error):
+    breaker = make_breaker()
+    trip(breaker)
+    clock.now += 5
+    assert call(breaker, duration=duration, error=error)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+
+def test_cancelled_probe_frees_its_slot(clock):
+    breaker = make_breaker(half_open_max_calls=1)
+    trip(breaker)
+    clock.now += 5
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.cancel()
+    assert breaker.allow()
+
+
+def test_collect_reports_state(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    gauges = breaker.collect()['gauges']
+    assert gauges['circuit_breaker_state{breaker="test",state="open"}'] == 1
+    assert gauges['circuit_breaker_state{breaker="test",state="closed"}'] == 0
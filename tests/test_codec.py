@@ -0,0 +1,27 @@
+import pytest
+
+from item_store.structure.proto_structure.all import ItemDoc
+
+from src.cache import CacheBase
+from src.cache.codec import MAGIC, ItemCodec
+
+
+@pytest.fixture
+def codec():
+    return ItemCodec(codec='protobuf', compression=None)
+
+
+def test_roundtrip(codec):
+    item = ItemDoc(item_type='t', item_id='1', data='x' * 2000)
+    data = codec.encode(item)
+    assert data.startswith(MAGIC)
+    assert codec.is_encoded(data)
+    assert codec.decode(data) == item
+
+
+@pytest.mark.parametrize('legacy', [
+    b'7', b'7abc', b'G\x01\x02', b'{"item_id": "1"}', b'\x0a\x01t', b'\x80\x04\x95', CacheBase.absent_value, b'',
+    MAGIC,
+])
+def test_legacy_values_are_not_encoded(codec, legacy):
+    assert not codec.is_encoded(legacy)
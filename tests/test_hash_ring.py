@@ -0,0 +1,46 @@
+import pytest
+
+from src.cache.hash_ring import HashRing
+
+KEYS = [f'item_store:t:{i}' for i in range(10000)]
+
+
+def assignments(ring):
+    return {key: ring.get_node(key) for key in KEYS}
+
+
+def test_empty_ring_raises():
+    with pytest.raises(ValueError):
+        HashRing().get_node('key')
+
+
+def test_mapping_is_deterministic_and_uses_every_node():
+    nodes = ['a:6379', 'b:6379', 'c:6379']
+    first, second = assignments(HashRing(nodes)), assignments(HashRing(reversed(nodes)))
+    assert first == second
+    counts = {node: list(first.values()).count(node) for node in nodes}
+    # 160 个虚拟节点时各节点的 key 数量大致均匀
+    assert all(len(KEYS) / 3 * 0.7 < count < len(KEYS) / 3 * 1.3 for count in counts.values())
+
+
+def test_removing_a_node_only_moves_its_keys():
+    ring = HashRing(['a', 'b', 'c'])
+    before = assignments(ring)
+    ring.remove_node('b')
+    after = assignments(ring)
+    assert ring.nodes == ['a', 'c']
+    for key in KEYS:
+        if before[key] != 'b':
+            assert after[key] == before[key]
+        else:
+            assert after[key] in ('a', 'c')
+
+
+def test_adding_a_node_moves_about_one_nth_of_keys():
+    ring = HashRing(['a', 'b', 'c'])
+    before = assignments(ring)
+    ring.add_node('d')
+    after = assignments(ring)
+    moved = [key for key in KEYS if before[key] != after[key]]
+    assert all(after[key] == 'd' for key in moved)
+    assert len(KEYS) / 4 * 0.7 < len(moved) < len(KEYS) / 4 * 1.3
@@ -0,0 +1,55 @@
+import io
+import logging
+
+from src.utils.log import QueueBatchHandler, TracebackFormatExcFilter
+
+
+def _handler(stream, *filters):
+    target = logging.StreamHandler(stream)
+    target.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+    for _filter in filters:
+        target.addFilter(_filter)
+    return QueueBatchHandler(handlers=[target])
+
+
+def _logger(handler):
+    logger = logging.getLogger('tests.queue_batch_handler')
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    return logger
+
+
+def test_args_are_formatted_before_enqueue():
+    stream = io.StringIO()
+    handler = _handler(stream)
+    logger = _logger(handler)
+    items = ['a']
+    logger.info('items=%s', items)
+    items.append('b')
+    handler.close()
+    assert stream.getvalue() == "INFO items=['a']\n"
+
+
+def test_exc_info_is_converted_to_text():
+    stream = io.StringIO()
+    handler = _handler(stream, TracebackFormatExcFilter())
+    logger = _logger(handler)
+    try:
+        raise ValueError('boom')
+    except ValueError as e:
+        logger.exception('failed')
+        exc_info = (ValueError, e, e.__traceback__)
+        record = handler.prepare(logging.LogRecord('t', logging.ERROR, __file__, 1, 'failed', None, exc_info))
+    handler.close()
+    output = stream.getvalue()
+    assert output.startswith('ERROR failed traceback_format_exc=')
+    assert 'ValueError: boom' in output
+    assert record.exc_info is None and record.exc_text.endswith('ValueError: boom')
+
+
+def test_dict_msg_without_args_is_kept():
+    handler = QueueBatchHandler(handlers=[])
+    record = logging.LogRecord('t', logging.INFO, __file__, 1, {'event': 'x'}, None, None)
+    assert handler.prepare(record).msg == {'event': 'x'}
+    handler.close()
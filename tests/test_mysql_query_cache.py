@@ -0,0 +1,78 @@
+import pytest
+
+from src.utils.mysql_query_cache import ALL_TABLES, QueryCache, is_write, read_tables, written_tables
+
+
+@pytest.mark.parametrize('sql, tables', [
+    ('select * from t where id = %s', {'t'}),
+    ('select * from `db`.`t` a join u b on a.id = b.id', {'t', 'u'}),
+    ('select * from a, b as x, c where a.id = x.id', {'a', 'b', 'c'}),
+    ('select * from a where id in (select id from b)', {'a', 'b'}),
+])
+def test_read_tables(sql, tables):
+    assert read_tables(sql) == tables
+
+
+@pytest.mark.parametrize('sql, tables', [
+    ('insert into t (a) values (1)', {'t'}),
+    ('insert ignore into `db`.`t` values (1)', {'t'}),
+    ('replace into t values (1)', {'t'}),
+    ('insert into t (a) select a from s', {'t', 's'}),
+    ('update t set a = 1', {'t'}),
+    ('update a join b on a.id = b.id set a.x = b.y', {'a', 'b'}),
+    ('update low_priority a inner join b on a.id = b.id set a.x = 1', {'a', 'b'}),
+    ('update a, b set a.x = b.x where a.id = b.id', {'a', 'b'}),
+    ('delete from t where id = 1', {'t'}),
+    ('delete a from a join b on a.id = b.id where b.z = 1', {'a', 'b'}),
+    ('/* hint */ update t set a = 1', {'t'}),
+    ('-- comment\nupdate t set a = 1', {'t'}),
+    ('truncate table t', {'t'}),
+    ('alter table t add column c int', {'t'}),
+    ('drop table if exists t', {'t'}),
+])
+def test_written_tables(sql, tables):
+    assert is_write(sql)
+    assert written_tables(sql) == tables
+
+
+def test_unparseable_write_invalidates_everything():
+    assert written_tables('update (select 1) x set y = 1') == {ALL_TABLES}
+
+
+@pytest.mark.parametrize('sql', ['select * from t', 'set names utf8mb4', '/* update t */ select 1 from t'])
+def test_reads_are_not_writes(sql):
+    assert not is_write(sql)
+    assert written_tables(sql) == set()
+
+
+def test_prepare_skips_uncacheable_queries():
+    cache = QueryCache(name='test_prepare', default_ttl=10)
+    assert cache.prepare('select * from t for update') is None
+    assert cache.prepare('select now()') is None
+    assert cache.prepare('select * from t', ttl=0) is None
+    query_key = cache.prepare('select * from t where id = %s', (1,))
+    assert query_key.tables == (ALL_TABLES, 't')
+    assert query_key.key == cache.prepare('  select * from t where id = %s\n', (1,)).key
+    assert query_key.key != cache.prepare('select * from t where id = %s', (2,)).key
+
+
+def test_prepare_key_keeps_literal_whitespace_and_database():
+    cache = QueryCache(name='test_prepare_key', default_ttl=10)
+    key = cache.prepare("select * from t where name = 'a  b'").key
+    assert key != cache.prepare("select * from t where name = 'a b'").key
+    assert cache.prepare('select * from t', database='h:3306/a').key != cache.prepare(
+        'select * from t', database='h:3306/b').key
+
+
+def test_bumping_a_table_changes_the_cache_key():
+    cache = QueryCache(name='test_bump', default_ttl=10)
+    query_key = cache.prepare('select * from a join b on a.id = b.id')
+    cache_key = cache.cache_key(query_key)
+    cache.set_local(cache_key, [{'id': 1}], query_key.ttl)
+    assert cache.get_local(cache_key) == (True, [{'id': 1}])
+    cache.bump_versions(['c'])
+    assert cache.cache_key(query_key) == cache_key
+    cache.bump_versions(['b'])
+    assert cache.cache_key(query_key) != cache_key
+    cache.bump_versions([ALL_TABLES])
+    assert cache.get_local(cache.cache_key(query_key)) == (False, None)
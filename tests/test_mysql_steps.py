@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+from src.utils.aiomysql_utils import AsyncMysqlUtils
+from src.utils.mysql_query_cache import QueryCache
+from src.utils.mysql_utils import BaseDBlUtils
+
+
+class FakeRedis(object):
+    def __init__(self):
+        self.data = {}
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def incr(self, key):
+        self.data[key] = int(self.data.get(key) or 0) + 1
+        return self.data[key]
+
+
+class AsyncFakeRedis(FakeRedis):
+    async def mget(self, keys):
+        return super().mget(keys)
+
+    async def get(self, key):
+        return super().get(key)
+
+    async def set(self, key, value, ex=None):
+        return super().set(key, value, ex)
+
+    async def incr(self, key):
+        return super().incr(key)
+
+
+class FakeDBUtils(BaseDBlUtils):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.queries = []
+
+    def _query(self, sql, param=None, many=False, fetch=False, readonly=False):
+        self.queries.append((sql, param, many))
+        if fetch:
+            return [dict(id=1)]
+        return len(param) if many else 1
+
+
+class AsyncFakeDBUtils(AsyncMysqlUtils):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.queries = []
+
+    async def _query(self, sql, param=None, many=False, fetch=False, readonly=False):
+        return FakeDBUtils._query(self, sql, param, many, fetch, readonly)
+
+
+def _run(result):
+    return asyncio.run(result) if asyncio.iscoroutine(result) else result
+
+
+@pytest.fixture(params=['sync', 'async'])
+def make_db(request):
+    def make(redis=False):
+        if request.param == 'sync':
+            cache = QueryCache(name='test_sync', default_ttl=60, redis=FakeRedis() if redis else None)
+            return FakeDBUtils(query_cache=cache)
+        cache = QueryCache(name='test_async', default_ttl=60, redis=AsyncFakeRedis() if redis else None)
+        return AsyncFakeDBUtils(query_cache=cache)
+    return make
+
+
+def test_update_many_uses_executemany(make_db):
+    db = make_db()
+    rows = [dict(id=1, name='a'), dict(id=2, name='b')]
+    assert _run(db.update('t', ['id'], rows)) == 2
+    assert db.queries == [('update t set `name`=%(name)s where `id`=%(id)s', rows, True)]
+
+
+def test_insert_or_update_runs_select_then_update(make_db):
+    db = make_db()
+    assert _run(db.insert_or_update('t', ['id'], dict(id=1, name='a'))) == (1, None, 1)
+    assert [sql.split()[0] for sql, _, _ in db.queries] == ['select', 'update']
+
+
+def test_write_error_is_logged_not_raised(make_db):
+    db = make_db()
+    db.execute_many = None  # 调用时抛出 TypeError
+    assert _run(db.update('t', ['id'], [dict(id=1, name='a')])) is None
+
+
+@pytest.mark.parametrize('redis', [False, True])
+def test_query_cache_hit_and_invalidate(make_db, redis):
+    db = make_db(redis=redis)
+    sql = 'select * from t where id = %s'
+    assert _run(db.query(sql, (1,))) == [dict(id=1)]
+    assert _run(db.query(sql, (1,))) == [dict(id=1)]
+    assert len(db.queries) == 1
+    _run(db.execute('update t set name = %s where id = %s', ('a', 1)))
+    assert _run(db.query(sql, (1,))) == [dict(id=1)]
+    assert len(db.queries) == 3
+    counters = db.query_cache.snapshot()['counters']
+    assert counters['hit_local'] == 1 and counters['miss'] == 2
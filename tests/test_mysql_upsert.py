@@ -0,0 +1,65 @@
+import pytest
+
+from src.utils.mysql_utils import BaseDBlUtils
+
+
+class FakeDBUtils(BaseDBlUtils):
+    def __init__(self, affected_rows=(), fail_at=None):
+        super().__init__()
+        self.affected_rows = list(affected_rows)
+        self.fail_at = fail_at
+        self.executed = []
+
+    def execute(self, sql, param=None):
+        if len(self.executed) == self.fail_at:
+            raise RuntimeError('lost connection')
+        self.executed.append((sql, param))
+        return self.affected_rows[len(self.executed) - 1]
+
+
+def _rows(count, name='x'):
+    return [dict(id=index, name=name) for index in range(count)]
+
+
+def test_chunks_split_by_row_count():
+    chunks = list(BaseDBlUtils._iter_upsert_chunks('t', ['id'], _rows(5), chunk_size=2))
+    assert [rows_count for _, _, rows_count in chunks] == [2, 2, 1]
+    assert [params for _, params, _ in chunks] == [[0, 'x', 1, 'x'], [2, 'x', 3, 'x'], [4, 'x']]
+    sql = chunks[0][0]
+    assert sql.count('(%s,%s)') == 2
+    assert sql.endswith('ON DUPLICATE KEY UPDATE `name`=VALUES(`name`)')
+
+
+def test_chunks_split_by_packet_size():
+    rows = _rows(4, name='y' * 100)
+    base_size = len(BaseDBlUtils.gen_insert_duplicate_many_sql('t', ['id', 'name'], ['id'], 1))
+    chunks = list(BaseDBlUtils._iter_upsert_chunks('t', ['id'], rows, chunk_size=100, max_packet_size=base_size + 250))
+    assert [rows_count for _, _, rows_count in chunks] == [2, 2]
+
+
+def test_oversized_row_still_sent_alone():
+    chunks = list(BaseDBlUtils._iter_upsert_chunks('t', ['id'], _rows(2, name='z' * 100), max_packet_size=1))
+    assert [rows_count for _, _, rows_count in chunks] == [1, 1]
+
+
+@pytest.mark.parametrize('rows_count, chunk_size, affected_rows, expected', [
+    # 1 新插入 + 1 更新 + 1 值未变化
+    (3, 3, (3,), dict(rows=3, affected=3)),
+    (4, 2, (2, 4), dict(rows=4, affected=6)),
+    (3, 3, (None,), dict(rows=3, affected=0)),
+])
+def test_upsert_counts(rows_count, chunk_size, affected_rows, expected):
+    db = FakeDBUtils(affected_rows)
+    assert db.insert_or_update_many('t', ['id'], _rows(rows_count), chunk_size=chunk_size) == expected
+    assert len(db.executed) == len(affected_rows)
+
+
+def test_upsert_counts_stop_at_failed_chunk():
+    db = FakeDBUtils([2], fail_at=1)
+    assert db.insert_or_update_many('t', ['id'], _rows(4), chunk_size=2) == dict(rows=2, affected=2)
+
+
+def test_upsert_empty_results():
+    db = FakeDBUtils()
+    assert db.insert_or_update_many('t', ['id'], []) == dict(rows=0, affected=0)
+    assert not db.executed
@@ -0,0 +1,63 @@
+import asyncio
+
+from src.cache.redis_batch import RedisBatchLoader
+from src.cache.response_cache import ResponseCache
+
+
+class FakeRedis(object):
+    def __init__(self, data=None):
+        self.data = dict(data or {})
+        self.mget_calls = []
+        self.mset_calls = []
+
+    async def mget(self, cache_keys):
+        self.mget_calls.append(list(cache_keys))
+        await asyncio.sleep(0)
+        return [self.data.get(cache_key) for cache_key in cache_keys]
+
+    async def mset(self, cache_items):
+        self.mset_calls.append(dict(cache_items))
+        await asyncio.sleep(0.01)
+        self.data.update(cache_items)
+        return True
+
+
+def test_batch_loader_keyed_by_cache_ttl():
+    short, other_short, long = ResponseCache(cache_ttl=60), ResponseCache(cache_ttl=60), ResponseCache(cache_ttl=3600)
+    assert short.batch_loader is other_short.batch_loader
+    assert short.batch_loader is not long.batch_loader
+    assert short.batch_loader.mset_func.__self__ is short
+    assert long.batch_loader.mset_func.__self__ is long
+
+
+def test_concurrent_gets_merge_into_one_mget():
+    redis = FakeRedis({'a': b'1', 'b': b'2'})
+    loader = RedisBatchLoader(redis.mget, redis.mset, max_wait=0)
+
+    async def main():
+        return await asyncio.gather(loader.mget(['a', 'b']), loader.mget(['b', 'c']))
+
+    assert asyncio.run(main()) == [[b'1', b'2'], [b'2', None]]
+    assert redis.mget_calls == [['a', 'b', 'c']]
+    assert loader.counters['get_deduplicated'] == 1
+
+
+def test_get_reads_pending_and_in_flight_sets():
+    redis = FakeRedis({'a': b'old'})
+    loader = RedisBatchLoader(redis.mget, redis.mset, max_wait=0)
+
+    async def main():
+        save = asyncio.ensure_future(loader.mset({'a': b'new'}))
+        await asyncio.sleep(0)
+        assert loader._pending_sets == {'a': b'new'}
+        pending = await loader.mget(['a'])
+        await asyncio.sleep(0)
+        assert loader._writing == {'a': b'new'}
+        in_flight = await loader.mget(['a'])
+        assert await save
+        return pending, in_flight
+
+    assert asyncio.run(main()) == ([b'new'], [b'new'])
+    assert redis.mget_calls == []
+    assert loader.counters['get_from_pending_set'] == 2
+    assert redis.data == {'a': b'new'}
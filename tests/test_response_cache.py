@@ -0,0 +1,68 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src.cache.response_cache import etag_matches, response_cache
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    calls = []
+
+    @app.get('/answer')
+    @response_cache(ttl=60, cache_control='private, max-age=10')
+    async def answer(question: str = ''):
+        calls.append(question)
+        return {'data': question}
+
+    store = {}
+
+    async def mget_keys(cache_keys):
+        return [store.get(cache_key) for cache_key in cache_keys]
+
+    async def mset_keys(cache_items):
+        store.update(cache_items)
+        return True
+
+    cache = answer.response_cache
+    cache.mget_keys, cache.mset_keys = mget_keys, mset_keys
+    with TestClient(app) as test_client:
+        test_client.calls = calls
+        yield test_client
+
+
+def test_etag_and_conditional_get(client):
+    response = client.get('/answer', params={'question': 'q1'})
+    assert response.status_code == 200
+    assert response.json() == {'data': 'q1'}
+    assert response.headers['x-cache'] == 'MISS'
+    assert response.headers['cache-control'] == 'private, max-age=10'
+    etag = response.headers['etag']
+
+    not_modified = client.get('/answer', params={'question': 'q1'}, headers={'If-None-Match': etag})
+    assert not_modified.status_code == 304
+    assert not_modified.content == b''
+    assert not_modified.headers['etag'] == etag
+    assert not_modified.headers['x-cache'] == 'HIT'
+    assert client.calls == ['q1']
+
+    stale = client.get('/answer', params={'question': 'q1'}, headers={'If-None-Match': '"other"'})
+    assert stale.status_code == 200
+    assert stale.json() == {'data': 'q1'}
+
+    other = client.get('/answer', params={'question': 'q2'})
+    assert other.headers['etag'] != etag
+    assert client.calls == ['q1', 'q2']
+
+
+@pytest.mark.parametrize('if_none_match, matches', [
+    (None, False),
+    ('"a"', True),
+    ('W/"a"', True),
+    ('"b", "a"', True),
+    ('*', True),
+    ('"b"', False),
+])
+def test_etag_matches(if_none_match, matches):
+    assert etag_matches(if_none_match, '"a"') is matches
@@ -0,0 +1,118 @@
+import multiprocessing
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from src.cache.shm_cache import SharedMemoryCache, _SEQ, _SLOT_HEADER
+
+
+def make_item(item_id, value=''):
+    return SimpleNamespace(item_type='t', item_id=str(item_id), value=value)
+
+
+def make_cache(directory, **kwargs):
+    options = dict(name='test_l1', size_bytes=64 * 1024, slot_size=512, ways=4, directory=str(directory))
+    options.update(kwargs)
+    return SharedMemoryCache(**options)
+
+
+def slot_offset(cache, item):
+    mm = cache._ensure_open()
+    key_bytes, _, set_index = cache._locate(cache.key_func(item))
+    for offset in cache._slot_offsets(set_index):
+        data_offset = offset + _SLOT_HEADER.size
+        if mm[data_offset:data_offset + len(key_bytes)] == key_bytes:
+            return offset
+    raise AssertionError('slot not found')
+
+
+def test_set_get_delete(tmp_path):
+    cache = make_cache(tmp_path)
+    items = [make_item(i, value=f'v{i}') for i in range(10)]
+    cache.set_many_items(items)
+    assert [item.value for item in cache.get_many_items(items)] == [item.value for item in items]
+    cache.delete_many_items(items[:3])
+    assert len(cache.get_many_items(items)) == 7
+
+
+def test_write_leaves_sequence_even(tmp_path):
+    cache = make_cache(tmp_path)
+    item = make_item(1)
+    cache.set_many_items([item])
+    offset = slot_offset(cache, item)
+    seq = _SEQ.unpack_from(cache._mm, offset)[0]
+    assert seq % 2 == 0
+    cache.set_many_items([item])
+    assert _SEQ.unpack_from(cache._mm, offset)[0] == seq + 2
+
+
+def test_reader_skips_slot_being_written(tmp_path):
+    cache = make_cache(tmp_path)
+    item = make_item(1, value='v')
+    cache.set_many_items([item])
+    offset = slot_offset(cache, item)
+    seq = _SEQ.unpack_from(cache._mm, offset)[0]
+    # 模拟写入进行中：序号为奇数时读者不返回该 slot 的数据
+    _SEQ.pack_into(cache._mm, offset, seq + 1)
+    assert cache.get_many_items([item]) == []
+    _SEQ.pack_into(cache._mm, offset, seq + 2)
+    assert cache.get_many_items([item])[0].value == 'v'
+
+
+def test_add_does_not_overwrite(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.set_many_items([make_item(1, value='old')])
+    cache.add_many_items([make_item(1, value='new')])
+    assert cache.get_many_items([make_item(1)])[0].value == 'old'
+
+
+def test_oversized_item_is_not_cached(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.set_many_items([make_item(1, value='x' * 1024)])
+    assert cache.get_many_items([make_item(1)]) == []
+    assert cache.counters['oversize'] == 1
+
+
+def test_layout_is_part_of_file_name(tmp_path):
+    small, large = make_cache(tmp_path), make_cache(tmp_path, slot_size=1024)
+    small.set_many_items([make_item(1)])
+    large.set_many_items([make_item(1)])
+    assert small.path != large.path
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_incompatible_file_raises_instead_of_truncating(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.set_many_items([make_item(1)])
+    with open(cache.path, 'r+b') as f:
+        f.write(b'BADMAGIC')
+    size = os.path.getsize(cache.path)
+    with pytest.raises(ValueError):
+        make_cache(tmp_path).get_many_items([make_item(1)])
+    assert os.path.getsize(cache.path) == size
+
+
+def _set_in_child(directory):
+    make_cache(directory).set_many_items([make_item('child', value='from child')])
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason='requires fork')
+def test_visible_across_processes(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.set_many_items([make_item('parent')])
+    process = multiprocessing.get_context('fork').Process(target=_set_in_child, args=(tmp_path,))
+    process.start()
+    process.join(10)
+    assert process.exitcode == 0
+    assert cache.get_many_items([make_item('child')])[0].value == 'from child'
+
+
+def test_collect_exports_counters(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.set_many_items([make_item(1)])
+    cache.get_many_items([make_item(1), make_item(2)])
+    counters = cache.collect()['counters']
+    assert counters['cache_l1_total{backend="shm",event="hits"}'] == 1
+    assert counters['cache_l1_total{backend="shm",event="misses"}'] == 1
+    assert counters['cache_l1_total{backend="shm",event="sets"}'] == 1
@@ -0,0 +1,24 @@
+from src.startup import load_warm_items
+
+
+def _config(hot_keys_file, snapshot_file, warm_max_items=10):
+    return dict(hot_keys_file=hot_keys_file, snapshot_file=snapshot_file, warm_max_items=warm_max_items)
+
+
+def test_load_warm_items_merges_and_dedups(tmp_path):
+    hot_keys_file = tmp_path / 'hot_keys'
+    hot_keys_file.write_text('# comment\na\t1\na\t2\n', encoding='utf-8')
+    snapshot_file = tmp_path / 'snapshot'
+    snapshot_file.write_text('a\t2\nb\t3\n', encoding='utf-8')
+    items = load_warm_items(_config(str(hot_keys_file), str(snapshot_file)))
+    assert [(item.item_type, item.item_id) for item in items] == [('a', '1'), ('a', '2'), ('b', '3')]
+
+
+def test_load_warm_items_skips_unreadable_file(tmp_path):
+    bad_file = tmp_path / 'bad'
+    bad_file.write_bytes(b'\xff\xfe\tx\n')
+    snapshot_file = tmp_path / 'snapshot'
+    snapshot_file.write_text('b\t3\n', encoding='utf-8')
+    items = load_warm_items(_config(str(bad_file), str(snapshot_file)))
+    assert [(item.item_type, item.item_id) for item in items] == [('b', '3')]
+    assert load_warm_items(_config(str(tmp_path), None)) == []
@@ -0,0 +1,106 @@
+from types import SimpleNamespace
+
+from src.cache.tinylfu import CountMinSketch, TinyLFUCache
+
+
+def make_item(item_id):
+    return SimpleNamespace(item_type='t', item_id=str(item_id))
+
+
+def make_cache(max_bytes=10000, item_size=100, **kwargs):
+    return TinyLFUCache(max_bytes=max_bytes, size_func=lambda item: item_size, **kwargs)
+
+
+def test_sketch_counts_saturate_at_15():
+    sketch = CountMinSketch(1024)
+    for _ in range(20):
+        sketch.increment('hot')
+    sketch.increment('cold')
+    assert sketch.estimate('hot') == 15
+    assert sketch.estimate('cold') >= 1
+    assert sketch.estimate('missing') == 0
+
+
+def test_sketch_reset_halves_counts():
+    sketch = CountMinSketch(16, sample_factor=1)
+    for _ in range(10):
+        sketch.increment('key')
+    assert sketch.resets == 0
+    hot = sketch.estimate('key')
+    for index in range(sketch.sample_size - sketch.additions):
+        sketch.increment(f'other-{index}')
+    assert sketch.resets == 1
+    assert sketch.estimate('key') <= hot // 2 + 1
+
+
+def test_set_get_delete():
+    cache = make_cache()
+    items = [make_item(i) for i in range(5)]
+    cache.set_many_items(items)
+    assert cache.get_many_items(items) == items
+    cache.delete_many_items(items[:2])
+    assert cache.get_many_items(items) == items[2:]
+    assert cache.counters['deletes'] == 2
+
+
+def test_add_does_not_overwrite_live_entry():
+    cache = make_cache()
+    old, new = make_item(1), make_item(1)
+    old.value, new.value = 'old', 'new'
+    cache.set_many_items([old])
+    cache.add_many_items([new])
+    assert cache.get_many_items([make_item(1)])[0].value == 'old'
+    cache.set_many_items([new])
+    assert cache.get_many_items([make_item(1)])[0].value == 'new'
+
+
+def test_expired_entries_are_misses():
+    cache = make_cache(ttl=0)
+    cache.set_many_items([make_item(1)])
+    assert cache.get_many_items([make_item(1)]) == []
+
+
+def test_stays_within_byte_budget():
+    cache = make_cache(max_bytes=5000, item_size=100)
+    cache.set_many_items([make_item(i) for i in range(1000)])
+    assert cache.used_bytes <= cache.max_bytes
+    assert len(cache) <= 50
+
+
+def test_frequent_keys_survive_a_scan():
+    cache = make_cache(max_bytes=5000, item_size=100, window_ratio=0.1)
+    hot_items = [make_item(f'hot-{i}') for i in range(20)]
+    cache.set_many_items(hot_items)
+    for _ in range(5):
+        cache.get_many_items(hot_items)
+    # 只访问一次的大量 key 不应把热 key 挤出 main
+    for start in range(0, 2000, 100):
+        cache.set_many_items([make_item(f'scan-{i}') for i in range(start, start + 100)])
+    assert len(cache.get_many_items(hot_items)) == len(hot_items)
+    assert cache.counters['admission_rejects'] > 0
+
+
+def test_oversized_item_is_rejected():
+    cache = make_cache(max_bytes=1000, item_size=2000)
+    cache.set_many_items([make_item(1)])
+    assert cache.get_many_items([make_item(1)]) == []
+    assert cache.used_bytes == 0
+
+
+def test_collect_exports_counters_and_bytes():
+    cache = make_cache(max_bytes=5000, item_size=100, window_ratio=0.2)
+    cache.set_many_items([make_item(i) for i in range(100)])
+    cache.get_many_items([make_item(99), make_item('missing')])
+    snapshot = cache.collect()
+    assert snapshot['counters']['cache_l1_total{backend="tinylfu",event="hits"}'] == 1
+    assert snapshot['counters']['cache_l1_total{backend="tinylfu",event="misses"}'] == 1
+    assert snapshot['counters']['cache_l1_total{backend="tinylfu",event="admission_rejects"}'] > 0
+    assert snapshot['gauges']['cache_l1_used_bytes{backend="tinylfu"}'] == cache.used_bytes
+
+
+def test_l1_counters_are_exported_with_cache_stats(monkeypatch):
+    from src.cache import CacheBase, collect_cache_stats
+    cache = make_cache()
+    monkeypatch.setattr(CacheBase, 'cache_memory', cache)
+    cache.get_many_items([make_item(1)])
+    assert collect_cache_stats()['counters']['cache_l1_total{backend="tinylfu",event="misses"}'] == 1